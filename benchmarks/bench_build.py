@@ -0,0 +1,340 @@
+"""
+Benchmark the resolve, clone and merge path of the plugin against synthetic repositories.
+
+The benchmark generates `--includes` chains of `--depth` bare repositories with `--files` Markdown
+files of `--file-size` bytes each. Every repository includes the next one of its chain, and they are
+all served over `file://`, so the numbers do not depend on the network.
+
+Every stage is timed with a cold cache (nothing cloned or merged yet) and a warm cache (the same
+build repeated), and the results are written as JSON:
+
+    python benchmarks/bench_build.py --includes 10 --files 200 --depth 2 --output results.json
+    python benchmarks/bench_build.py --compare results.json --output results-new.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+from tempfile import mkdtemp
+from typing import Callable, Dict, List
+
+import git
+import mkdocs
+from mkdocs.config import load_config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkdocs_ultirepo_plugin.cache import CloneCache  # noqa: E402
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang  # noqa: E402
+from mkdocs_ultirepo_plugin.merger import Merger  # noqa: E402
+from mkdocs_ultirepo_plugin.nav_generator import NavGenerator  # noqa: E402
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher  # noqa: E402
+from mkdocs_ultirepo_plugin.resolver import Resolver  # noqa: E402
+
+RESULTS_VERSION = 1
+PARSERS = [("!include", IncludeParserBang)]
+
+
+def _repo_name(chain: int, level: int) -> str:
+    return f"lib{chain:03d}_{level}"
+
+
+def _include(repos_dir: str, name: str) -> str:
+    url = f"file://{os.path.join(repos_dir, name)}.git"
+    return f"!include {url}?ref=main&nav_path=docs/{name}/nav.yml"
+
+
+def create_repos(repos_dir: str, includes: int, files: int, depth: int, file_size: int) -> List[str]:
+    """
+    Create the bare repositories of the benchmark.
+
+    :return: The include directives of the first repository of every chain.
+    """
+    work_dir = mkdtemp(prefix="ultirepo_bench_work_")
+    line = "Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n"
+    body = (line * (file_size // len(line) + 1))[:file_size]
+    try:
+        for chain in range(includes):
+            for level in range(depth):
+                name = _repo_name(chain, level)
+                docs = os.path.join(work_dir, name, "docs", name)
+                os.makedirs(docs)
+                nav = []
+                for i in range(files):
+                    with open(os.path.join(docs, f"page_{i:05d}.md"), "w") as f:
+                        f.write(f"# {name} page {i}\n\n{body}")
+                    nav.append({f"Page {i}": f"page_{i:05d}.md"})
+                if level + 1 < depth:
+                    nav.append({"Nested": [_include(repos_dir, _repo_name(chain, level + 1))]})
+                with open(os.path.join(docs, "nav.yml"), "w") as f:
+                    json.dump({"nav": nav}, f)
+
+                repo = git.Repo.init(os.path.join(work_dir, name), initial_branch="main")
+                repo.git.add("--all")
+                repo.git.commit("--quiet", "--message", "Benchmark docs",
+                                env={"GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@example.com",
+                                     "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@example.com"})
+                git.Repo.clone_from(repo.working_tree_dir, os.path.join(repos_dir, f"{name}.git"), bare=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return [_include(repos_dir, _repo_name(chain, 0)) for chain in range(includes)]
+
+
+def create_site(site_dir: str, includes: List[str], options: Dict) -> str:
+    """
+    Create the MkDocs project that includes every chain.
+
+    :return: The path to its config file.
+    """
+    os.makedirs(os.path.join(site_dir, "docs"), exist_ok=True)
+    with open(os.path.join(site_dir, "docs", "index.md"), "w") as f:
+        f.write("# Benchmark\n")
+    config = {
+        "site_name": "Benchmark",
+        "nav": ["index.md", {"Libraries": [{f"Library {i}": [include]} for i, include in enumerate(includes)]}],
+        "plugins": [{"ultirepo": options}],
+    }
+    config_file = os.path.join(site_dir, "mkdocs.yml")
+    with open(config_file, "w") as f:
+        json.dump(config, f, indent=2)
+    return config_file
+
+
+def measure(repeat: int, setup: Callable[[], None], run: Callable[[], object]) -> Dict:
+    """
+    Time `run` `repeat` times, calling `setup` before every run outside of the timing.
+    """
+    timings = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return {
+        "runs": timings,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+    }
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, root: str) -> None:
+        self.args = args
+        self.root = root
+        self.repos_dir = os.path.join(root, "repos")
+        self.site_dir = os.path.join(root, "site")
+        self.cache_dir = os.path.join(root, "cache")
+        self.merged_dir = os.path.join(root, "merged")
+        os.makedirs(self.repos_dir)
+        self.includes = create_repos(self.repos_dir, args.includes, args.files, args.depth, args.file_size)
+        self.config_file = create_site(self.site_dir, self.includes, {
+            "resolve_max_depth": 0,
+            "cache_dir": self.cache_dir,
+            "cache_max_age": 0,
+            "docs_destination_dir": self.merged_dir,
+            "clone_mode": args.clone_mode,
+            "include_source": args.include_source,
+            "merge_strategy": args.merge_strategy,
+            "prefetch_workers": args.workers,
+            "merge_workers": args.merge_workers,
+        })
+
+    def _reset(self, *paths: str) -> Callable[[], None]:
+        def setup():
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+        return setup
+
+    def _config(self):
+        return load_config(config_file=self.config_file)
+
+    def _resolve(self):
+        config = self._config()
+        cache = CloneCache(cache_dir=self.cache_dir)
+        prefetcher = Prefetcher(PARSERS, max_workers=self.args.workers, resolve_max_depth=0, cache=cache,
+                                clone_mode=self.args.clone_mode, source=self.args.include_source)
+        resolver = Resolver(resolve_max_depth=0)
+        resolver.set_parsers(PARSERS)
+        resolver.set_prefetcher(prefetcher)
+        resolver.set_nav_generator(NavGenerator(cache_dir=cache.cache_dir))
+        return config, prefetcher, resolver
+
+    def bench_clone(self) -> Dict:
+        """
+        Time fetching every repository into its object store and checking it out in a worktree on the prefetch
+        pool, the way builds clone, without scanning the nested navs.
+        """
+        clone_dir = os.path.join(self.root, "clones")
+        nav = [_include(self.repos_dir, os.path.splitext(name)[0]) for name in sorted(os.listdir(self.repos_dir))]
+
+        def run():
+            prefetcher = Prefetcher(PARSERS, max_workers=self.args.workers, resolve_max_depth=1,
+                                    cache=CloneCache(cache_dir=clone_dir), clone_mode=self.args.clone_mode)
+            prefetcher.prefetch(nav)
+
+        return {
+            "cold": measure(self.args.repeat, self._reset(clone_dir), run),
+            "warm": measure(self.args.repeat, lambda: None, run),
+        }
+
+    def bench_resolve(self) -> Dict:
+        """
+        Time `Resolver.resolve` once every repository is cloned, so only loading and resolving the navs is timed.
+        """
+        state = {}
+
+        def setup():
+            state["config"], prefetcher, state["resolver"] = self._resolve()
+            prefetcher.prefetch(state["config"]["nav"])
+
+        def run():
+            state["resolver"].resolve(state["config"]["nav"])
+
+        def cold_setup():
+            self._reset(self.cache_dir)()
+            setup()
+
+        return {
+            "cold": measure(self.args.repeat, cold_setup, run),
+            "warm": measure(self.args.repeat, setup, run),
+        }
+
+    def bench_prefetch(self) -> Dict:
+        state = {}
+
+        def setup():
+            state["config"], state["prefetcher"], _ = self._resolve()
+
+        def run():
+            state["prefetcher"].prefetch(state["config"]["nav"])
+
+        def cold_setup():
+            self._reset(self.cache_dir)()
+            setup()
+
+        return {
+            "cold": measure(self.args.repeat, cold_setup, run),
+            "warm": measure(self.args.repeat, setup, run),
+        }
+
+    def bench_merge(self) -> Dict:
+        config, prefetcher, resolver = self._resolve()
+        prefetcher.prefetch(config["nav"])
+        _, additional_info = resolver.resolve(config["nav"])
+
+        def run():
+            Merger(config=config, merged_docs_dir=self.merged_dir, strategy=self.args.merge_strategy,
+                   workers=self.args.merge_workers).merge(additional_info)
+
+        return {
+            "cold": measure(self.args.repeat, self._reset(self.merged_dir), run),
+            "warm": measure(self.args.repeat, lambda: None, run),
+        }
+
+    def bench_on_config(self) -> Dict:
+        state = {}
+
+        def setup():
+            state["config"] = self._config()
+            state["config"].plugins.on_startup(command="build", dirty=False)
+
+        def run():
+            state["config"].plugins["ultirepo"].on_config(state["config"])
+
+        def cold_setup():
+            self._reset(self.cache_dir, self.merged_dir)()
+            setup()
+
+        return {
+            "cold": measure(self.args.repeat, cold_setup, run),
+            "warm": measure(self.args.repeat, setup, run),
+        }
+
+
+STAGES = ("clone", "prefetch", "resolve", "merge", "on_config")
+
+
+def compare(results: Dict, previous: Dict) -> None:
+    """
+    Print the median of every stage next to the one of a previous run.
+    """
+    print(f"{'stage':<12}{'cache':<7}{'previous':>12}{'current':>12}{'change':>9}")
+    for stage, caches in results["results"].items():
+        for cache, timing in caches.items():
+            before = previous.get("results", {}).get(stage, {}).get(cache)
+            if before is None:
+                continue
+            change = (timing["median"] / before["median"] - 1) * 100 if before["median"] else 0.0
+            print(f"{stage:<12}{cache:<7}{before['median']:>11.3f}s{timing['median']:>11.3f}s{change:>+8.1f}%")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--includes", type=int, default=10, help="Number of includes in the site nav.")
+    parser.add_argument("--files", type=int, default=100, help="Number of Markdown files per repository.")
+    parser.add_argument("--depth", type=int, default=1, help="Number of nested repositories per include.")
+    parser.add_argument("--file-size", type=int, default=2048, help="Size of every Markdown file in bytes.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per stage and cache state.")
+    parser.add_argument("--workers", type=int, default=4, help="The prefetch_workers option.")
+    parser.add_argument("--clone-mode", default="full", help="The clone_mode option.")
+    parser.add_argument("--include-source", default="checkout", help="The include_source option.")
+    parser.add_argument("--merge-strategy", default="copy", help="The merge_strategy option.")
+    parser.add_argument("--merge-workers", type=int, default=4, help="The merge_workers option.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="The stages to time.")
+    parser.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument("--compare", help="A JSON file of a previous run to compare the medians with.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated repositories and caches.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("mkdocs").setLevel(logging.ERROR)
+
+    root = mkdtemp(prefix="ultirepo_bench_")
+    try:
+        start = time.perf_counter()
+        benchmark = Benchmark(args, root)
+        setup_time = time.perf_counter() - start
+        results = {}
+        for stage in args.stages:
+            results[stage] = getattr(benchmark, f"bench_{stage}")()
+    finally:
+        if args.keep:
+            print(f"Kept the benchmark files in '{root}'.", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("output", "compare", "keep")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mkdocs": mkdocs.__version__,
+            "git": ".".join(str(part) for part in git.cmd.Git().version_info),
+            "gitpython": git.__version__,
+        },
+        "repositories": args.includes * args.depth,
+        "setup_seconds": setup_time,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
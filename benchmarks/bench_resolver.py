@@ -0,0 +1,182 @@
+"""
+Benchmark how `Resolver.resolve` scales with the number of nav entries.
+
+Navs of every size in `--sizes` are generated in memory: sections of `--fanout` entries nested `--depth`
+levels deep, where one section in `--include-every` is an include whose nav is generated the same way.
+Includes are resolved by an in-memory parser, so only the resolver is timed, not git or the file system.
+
+For every size the best of `--repeat` runs is reported, with the time and the peak memory allocated per
+nav entry. Both stay flat when the resolver scales linearly:
+
+    python benchmarks/bench_resolver.py --sizes 1000 10000 100000 --output results.json
+    python benchmarks/bench_resolver.py --compare results.json --output results-new.json
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkdocs_ultirepo_plugin.include_parsers import ParserInterface  # noqa: E402
+from mkdocs_ultirepo_plugin.resolver import Resolver  # noqa: E402
+
+RESULTS_VERSION = 1
+PATTERN = "!memory"
+
+
+class MemoryParser(ParserInterface):
+    """
+    Include parser resolving `!memory <name>` to a nav generated by the benchmark.
+    """
+    navs: Dict[str, List] = {}
+
+    def execute(self, *args, **kwargs) -> Tuple[List, List[dict]]:
+        self.resolver.set_parsers(kwargs.get("parsers"))
+        resolved_nav, additional_info = self.resolver.resolve(nav=self.navs[self.string], parent=self.parent)
+        additional_info.append({"orig_docs_dir": self.string, "orig_docs_sub_dir": ""})
+        return resolved_nav, additional_info
+
+
+def generate_nav(entries: int, fanout: int, depth: int, include_every: int) -> Tuple[List, Dict[str, List]]:
+    """
+    Generate a nav with about `entries` pages, and the navs of its includes.
+
+    :return: The root nav and the nav of every include by name.
+    """
+    navs: Dict[str, List] = {}
+    counter = {"pages": 0, "sections": 0}
+
+    def section(level: int, name: str) -> List:
+        items = []
+        while len(items) < fanout and counter["pages"] < entries:
+            if level < depth and len(items) % 2:
+                counter["sections"] += 1
+                number = counter["sections"]
+                child = section(level + 1, f"{name}/s{number}")
+                if number % include_every == 0:
+                    include = f"inc{number}"
+                    navs[include] = child
+                    child = [f"{PATTERN} {include}"]
+                items.append({f"Section {number}": child})
+            else:
+                counter["pages"] += 1
+                items.append({f"Page {counter['pages']}": f"{name}/page_{counter['pages']}.md"})
+        return items
+
+    nav = ["index.md"]
+    while counter["pages"] < entries:
+        counter["sections"] += 1
+        nav.append({f"Part {counter['sections']}": section(1, f"part{counter['sections']}")})
+    return nav, navs
+
+
+def resolve(nav: List) -> Tuple[List, List[dict]]:
+    resolver = Resolver(resolve_max_depth=0)
+    resolver.set_parsers([(PATTERN, MemoryParser)])
+    return resolver.resolve(nav)
+
+
+def bench_size(entries: int, args: argparse.Namespace) -> Dict:
+    nav, navs = generate_nav(entries, args.fanout, args.depth, args.include_every)
+    MemoryParser.navs = navs
+    timings = []
+    for _ in range(args.repeat):
+        copies = copy.deepcopy((nav, navs))
+        MemoryParser.navs = copies[1]
+        gc.collect()
+        start = time.perf_counter()
+        resolved_nav, additional_info = resolve(copies[0])
+        timings.append(time.perf_counter() - start)
+        del resolved_nav, additional_info
+
+    # Memory is measured in a separate run, tracing allocations slows the resolver down
+    copies = copy.deepcopy((nav, navs))
+    MemoryParser.navs = copies[1]
+    gc.collect()
+    tracemalloc.start()
+    resolve(copies[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best = min(timings)
+    return {
+        "entries": entries,
+        "includes": len(navs),
+        "runs": timings,
+        "min": best,
+        "us_per_entry": best / entries * 1e6,
+        "peak_bytes": peak,
+        "peak_bytes_per_entry": peak / entries,
+    }
+
+
+def compare(results: Dict, previous: Dict) -> None:
+    """
+    Print the time per entry of every size next to the one of a previous run.
+    """
+    before = {result["entries"]: result for result in previous.get("results", [])}
+    print(f"{'entries':>9}{'previous':>14}{'current':>14}{'change':>9}")
+    for result in results["results"]:
+        old = before.get(result["entries"])
+        if old is None:
+            continue
+        change = (result["min"] / old["min"] - 1) * 100 if old["min"] else 0.0
+        print(f"{result['entries']:>9}{old['us_per_entry']:>11.2f}µs{result['us_per_entry']:>11.2f}µs{change:>+8.1f}%")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Number of nav entries of every generated nav.")
+    parser.add_argument("--fanout", type=int, default=10, help="Number of entries per section.")
+    parser.add_argument("--depth", type=int, default=4, help="Number of nested section levels.")
+    parser.add_argument("--include-every", type=int, default=5, help="Make one section in this many an include.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per size.")
+    parser.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument("--compare", help="A JSON file of a previous run to compare the times with.")
+    args = parser.parse_args(argv)
+
+    results = [bench_size(entries, args) for entries in sorted(args.sizes)]
+    smallest, largest = results[0], results[-1]
+    report = {
+        "version": RESULTS_VERSION,
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+        # Close to 1 when the time and memory per entry do not grow with the size of the nav
+        "time_growth": largest["us_per_entry"] / smallest["us_per_entry"],
+        "memory_growth": largest["peak_bytes_per_entry"] / smallest["peak_bytes_per_entry"],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    print(f"{'entries':>9}{'includes':>10}{'time':>10}{'per entry':>12}{'peak memory':>14}{'per entry':>12}",
+          file=sys.stderr)
+    for result in results:
+        print(f"{result['entries']:>9}{result['includes']:>10}{result['min']:>9.3f}s{result['us_per_entry']:>10.2f}µs"
+              f"{result['peak_bytes'] / 1e6:>12.1f}MB{result['peak_bytes_per_entry']:>11.0f}B", file=sys.stderr)
+    print(f"Growth per entry from {smallest['entries']} to {largest['entries']} entries: "
+          f"time x{report['time_growth']:.2f}, memory x{report['memory_growth']:.2f}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
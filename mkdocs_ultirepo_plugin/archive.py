@@ -0,0 +1,388 @@
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from tempfile import NamedTemporaryFile, mkdtemp
+from typing import IO, Dict, Iterable, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urlparse
+from urllib.request import Request, urlopen
+
+from mkdocs.plugins import get_plugin_logger
+
+from .exceptions import IncludeFetchError
+from .fetch_policy import FetchPolicy
+
+log = get_plugin_logger(__name__)
+
+# Where the archive of a reference is downloaded from, see `archive_url`
+DEFAULT_ARCHIVE_URL = "{repo}/archive/{ref}.tar.gz"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def archive_url(template: str, git_url: str, git_ref: str) -> str:
+    """
+    Build the URL of the archive of a reference from a template.
+
+    :param template: The template, with the placeholders `{url}` (the git URL), `{repo}` (the git URL without
+        `.git`), `{name}` (the name of the repository) and `{ref}` (the git reference).
+    :param git_url: The URL of the git repository.
+    :param git_ref: The git reference.
+    :return: An HTTP(S) URL, a `file://` URL or a local path.
+    """
+    repo = git_url.rstrip("/")
+    if repo.endswith(".git"):
+        repo = repo[:-len(".git")]
+    return template.format(url=git_url, repo=repo, name=os.path.basename(repo), ref=git_ref)
+
+
+def _local_path(url: str) -> Optional[str]:
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return unquote(parsed.path)
+    if parsed.scheme in ("http", "https"):
+        return None
+    return url
+
+
+def _covers(subtrees: Iterable[str], subtree: str) -> bool:
+    return any(not extracted or subtree == extracted or subtree.startswith(f"{extracted}/")
+               for extracted in subtrees)
+
+
+class _HashingReader:
+    def __init__(self, stream: IO[bytes], timeout: Optional[float] = None) -> None:
+        """
+        Initialize _HashingReader object.
+
+        Hashes and counts the bytes of a stream while they are read, so an archive is hashed in the same
+        pass that extracts it.
+
+        :param timeout: The seconds reading the whole stream may take, a socket timeout only bounds every read.
+        """
+        self.stream = stream
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError("The download timed out.")
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self) -> None:
+        # The end of a tar archive is padded with blocks tarfile does not read
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+class GitArchive:
+    index_file = "index.json"
+
+    def __init__(self, target_dir: str, offline: bool = False, timeout: float = 60,
+                 policy: Optional[FetchPolicy] = None) -> None:
+        """
+        Initialize GitArchive object.
+
+        Gets the files of a reference from a tar or zip archive instead of a git repository, when the history
+        is not needed. Only the members under the requested directories are extracted, while the archive is
+        streamed. Extracted trees are kept by the SHA-256 digest of their archive, so references or URLs
+        serving the same archive share them, and the validators of every URL are kept so an unchanged
+        archive is not downloaded again.
+
+        :param target_dir: The directory where the archives are extracted.
+        :param offline: Never access the network. Getting an archive whose tree is not already extracted
+            fails instead.
+        :param timeout: The timeout of HTTP requests in seconds, when the policy does not set one.
+        :param policy: The timeouts, retries and deadline of downloads.
+        """
+        self.target_dir = target_dir
+        self.offline = offline
+        self.timeout = timeout
+        self.policy = policy
+        # What the last fetch cost, for the build report
+        self.stats = {}
+        os.makedirs(target_dir, exist_ok=True)
+
+    def _load_index(self) -> Dict:
+        try:
+            with open(os.path.join(self.target_dir, self.index_file)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("archives", {})
+        index.setdefault("trees", {})
+        return index
+
+    def _save_index(self, index: Dict) -> None:
+        path = os.path.join(self.target_dir, self.index_file)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(temp_path, path)
+
+    def tree_dir(self, digest: str) -> str:
+        """
+        Return the directory where the archive with this digest is extracted.
+        """
+        return os.path.join(self.target_dir, digest[:24])
+
+    def _cached(self, index: Dict, digest: Optional[str], subtrees: List[str]) -> bool:
+        extracted = index["trees"].get(digest) if digest else None
+        return (extracted is not None and os.path.isdir(self.tree_dir(digest))
+                and all(_covers(extracted, subtree) for subtree in subtrees))
+
+    @staticmethod
+    def _member_path(name: str) -> Optional[str]:
+        """
+        Normalize the path of an archive member, None for paths that would leave the extraction directory.
+        """
+        parts = [part for part in name.replace("\\", "/").split("/") if part and part != "."]
+        if not parts or ".." in parts or name.startswith("/"):
+            return None
+        return "/".join(parts)
+
+    def _extract(self, members, subtrees: List[str], temp_dir: str) -> str:
+        """
+        Extract the regular files under the subtrees from archive members read in order.
+
+        Archives of hosting services put every file in a top directory named after the repository and
+        reference, which is stripped. Whether all members share one is only known at the end, so the
+        files that match either way are extracted with their full path first.
+
+        :param members: The (path, open) of every member, `open` returns a file object of a regular file
+            and None for anything else.
+        :return: The directory of the extracted tree, the temporary directory or its top directory.
+        """
+        root = None
+        common = True
+        matched_stripped = False
+        files = 0
+        for name, open_member in members:
+            path = self._member_path(name)
+            if path is None:
+                continue
+            top, _, rest = path.partition("/")
+            if root is None:
+                root = top
+            common = common and top == root
+            plain = any(_covers([subtree], path) for subtree in subtrees)
+            stripped = bool(rest) and any(_covers([subtree], rest) for subtree in subtrees)
+            if not plain and not stripped:
+                continue
+            source = open_member()
+            if source is None:
+                continue
+            matched_stripped = matched_stripped or stripped
+            destination = os.path.join(temp_dir, *path.split("/"))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with source, open(destination, "wb") as f:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+            files += 1
+        self.stats["files_extracted"] = files
+        if root is not None and common and matched_stripped:
+            return os.path.join(temp_dir, root)
+        return temp_dir
+
+    def _extract_tar(self, reader: _HashingReader, subtrees: List[str], temp_dir: str) -> str:
+        # Stream mode reads every member once, in order, and never seeks
+        with tarfile.open(fileobj=reader, mode="r|*") as archive:
+            members = ((member.name, lambda member=member: archive.extractfile(member) if member.isreg() else None)
+                       for member in archive)
+            tree = self._extract(members, subtrees, temp_dir)
+        reader.drain()
+        return tree
+
+    def _extract_zip(self, path: str, subtrees: List[str], temp_dir: str) -> str:
+        # Zip archives are read from their central directory at the end, they need a file to seek in
+        with zipfile.ZipFile(path) as archive:
+            members = ((info.filename, lambda info=info: None if info.is_dir() else archive.open(info))
+                       for info in archive.infolist())
+            return self._extract(members, subtrees, temp_dir)
+
+    def _download(self, url: str, entry: Dict, subtrees: List[str], temp_dir: str, conditional: bool = False,
+                  timeout: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        """
+        Download an archive and extract it while it is streamed.
+
+        :param conditional: Ask the server to only send the archive if it changed since `entry` was recorded.
+        :param timeout: The seconds the whole download may take.
+        :return: The extracted tree and the digest of the archive, or None if it did not change.
+        """
+        headers = {}
+        if conditional and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if conditional and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=timeout or self.timeout)
+        except HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        with response:
+            entry["etag"] = response.headers.get("ETag")
+            entry["last_modified"] = response.headers.get("Last-Modified")
+            reader = _HashingReader(response, timeout)
+            if urlparse(url).path.endswith(".zip"):
+                with NamedTemporaryFile(dir=self.target_dir, suffix=".zip") as spool:
+                    shutil.copyfileobj(reader, spool, CHUNK_SIZE)
+                    spool.flush()
+                    tree = self._extract_zip(spool.name, subtrees, temp_dir)
+            else:
+                tree = self._extract_tar(reader, subtrees, temp_dir)
+        self.stats["bytes_fetched"] = reader.size
+        return tree, reader.hash.hexdigest()
+
+    def _read_local(self, path: str, entry: Dict, subtrees: List[str], temp_dir: str) -> Tuple[str, str]:
+        stat = os.stat(path)
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime_ns
+        if path.endswith(".zip"):
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    digest.update(chunk)
+            return self._extract_zip(path, subtrees, temp_dir), digest.hexdigest()
+        with open(path, "rb") as f:
+            reader = _HashingReader(f)
+            tree = self._extract_tar(reader, subtrees, temp_dir)
+        return tree, reader.hash.hexdigest()
+
+    def _fetch_remote(self, url: str, entry: Dict, subtrees: List[str], temp_dir: str,
+                      conditional: bool) -> Optional[Tuple[str, str]]:
+        """
+        Download an archive within the timeouts, retries and deadline of the policy, see `_download`.
+        """
+        if self.policy is None:
+            return self._download(url, entry, subtrees, temp_dir, conditional)
+        # Client errors such as a missing archive do not go away by trying again
+        return self.policy.run(f"download the archive '{url}'",
+                               lambda timeout: self._download(url, entry, subtrees, temp_dir, conditional, timeout),
+                               errors=(URLError, OSError, tarfile.TarError, zipfile.BadZipFile),
+                               transient=lambda e: not isinstance(e, HTTPError) or e.code >= 500)
+
+    def cached(self, url: str, subtrees: Iterable[str]) -> Optional[Tuple[str, str]]:
+        """
+        Return the tree extracted from an archive by a previous build, without looking at the archive.
+
+        :return: The directory of the extracted tree and the digest of the archive, or None if the subtrees
+            were not extracted.
+        """
+        subtrees = sorted({subtree.strip("/") for subtree in subtrees}) or [""]
+        index = self._load_index()
+        digest = index["archives"].get(url, {}).get("digest")
+        if not self._cached(index, digest, subtrees):
+            return None
+        return self.tree_dir(digest), digest
+
+    def _store(self, index: Dict, digest: str, tree: str, subtrees: List[str]) -> None:
+        """
+        Move an extracted tree to the directory of its digest, adding its subtrees to an existing one.
+        """
+        tree_dir = self.tree_dir(digest)
+        extracted = index["trees"].get(digest) if os.path.isdir(tree_dir) else None
+        if extracted is None:
+            if os.path.exists(tree_dir):
+                shutil.rmtree(tree_dir)
+            os.replace(tree, tree_dir)
+            index["trees"][digest] = sorted(set(subtrees))
+            return
+
+        for subtree in subtrees:
+            if _covers(extracted, subtree):
+                continue
+            source = os.path.join(tree, subtree)
+            destination = os.path.join(tree_dir, subtree)
+            if not subtree:
+                shutil.rmtree(tree_dir)
+            elif os.path.exists(destination):
+                shutil.rmtree(destination)
+            if os.path.isdir(source):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(source, destination)
+            extracted = [path for path in extracted if not _covers([subtree], path)] + [subtree]
+        index["trees"][digest] = sorted(extracted)
+
+    def _prune(self, index: Dict) -> None:
+        """
+        Remove the trees no archive URL points to anymore.
+        """
+        used = {entry.get("digest") for entry in index["archives"].values()}
+        for digest in list(index["trees"]):
+            if digest not in used:
+                shutil.rmtree(self.tree_dir(digest), ignore_errors=True)
+                del index["trees"][digest]
+
+    def fetch(self, url: str, subtrees: Iterable[str], expected_digest: Optional[str] = None,
+              immutable: bool = False) -> Tuple[str, str]:
+        """
+        Get the extracted tree of an archive, downloading and extracting it only when needed.
+
+        :param url: The HTTP(S) or `file://` URL, or the local path of a tar (optionally compressed) or zip archive.
+        :param subtrees: The directories of the archive that are extracted, relative to its top directory.
+            An empty string extracts everything.
+        :param expected_digest: The SHA-256 digest the archive is known to have. A tree that is already
+            extracted is used without looking at the archive, and the archive must have this digest.
+        :param immutable: The archive never changes, e.g. the one of a commit. A tree that is already
+            extracted for this URL is used without looking at the archive.
+        :return: The directory of the extracted tree and the digest of the archive.
+        :raises IncludeFetchError: When the archive cannot be read or downloaded, or does not have the locked digest.
+        """
+        start = time.perf_counter()
+        self.stats = {}
+        subtrees = sorted({subtree.strip("/") for subtree in subtrees}) or [""]
+        index = self._load_index()
+        entry = dict(index["archives"].get(url, {}))
+        local_path = _local_path(url)
+        try:
+            if expected_digest is not None and self._cached(index, expected_digest, subtrees):
+                log.debug(f"The archive '{url}' is already extracted at its locked digest {expected_digest}.")
+                return self.tree_dir(expected_digest), expected_digest
+            if self.offline:
+                raise IncludeFetchError(
+                    f"The archive '{url}' is not extracted in the clone cache at '{self.target_dir}', and it "
+                    f"cannot be downloaded while the build is locked. Update the lock file to download it.")
+            cached = self._cached(index, entry.get("digest"), subtrees)
+            if cached:
+                unchanged = immutable
+                if local_path is not None:
+                    stat = os.stat(local_path)
+                    unchanged = unchanged or (entry.get("size"), entry.get("mtime")) == (stat.st_size, stat.st_mtime_ns)
+                if unchanged:
+                    log.debug(f"The archive '{url}' is already extracted.")
+                    return self.tree_dir(entry["digest"]), entry["digest"]
+
+            temp_dir = mkdtemp(dir=self.target_dir, prefix=".extract-")
+            try:
+                if local_path is not None:
+                    tree, digest = self._read_local(local_path, entry, subtrees, temp_dir)
+                else:
+                    result = self._fetch_remote(url, entry, subtrees, temp_dir, conditional=cached)
+                    if result is None:
+                        log.debug(f"The archive '{url}' did not change since it was downloaded.")
+                        return self.tree_dir(entry["digest"]), entry["digest"]
+                    tree, digest = result
+                if expected_digest is not None and digest != expected_digest:
+                    raise IncludeFetchError(
+                        f"The archive '{url}' has the digest {digest} instead of the locked {expected_digest}.")
+                if not self._cached(index, digest, subtrees):
+                    self._store(index, digest, tree, subtrees)
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+            entry["digest"] = digest
+            index["archives"][url] = entry
+            self._prune(index)
+            self._save_index(index)
+            log.info(f"Extracted {self.stats.get('files_extracted', 0)} files of {', '.join(subtrees) or '/'} "
+                     f"from the archive '{url}' in {time.perf_counter() - start:.2f}s.")
+            return self.tree_dir(digest), digest
+        except (HTTPError, URLError, OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            raise IncludeFetchError(f"Error while getting the archive '{url}': {e}") from e
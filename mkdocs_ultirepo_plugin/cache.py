@@ -0,0 +1,253 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mkdocs.plugins import get_plugin_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = get_plugin_logger(__name__)
+
+
+def default_cache_dir() -> str:
+    """
+    Return the default location of the clone cache.
+
+    :return: `$XDG_CACHE_HOME/mkdocs-ultirepo`, falling back to `~/.cache/mkdocs-ultirepo`.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "mkdocs-ultirepo")
+
+
+def directory_size(path: str, exclude: Iterable[str] = ()) -> Tuple[int, int]:
+    """
+    Compute the size of a directory tree without following symlinks.
+
+    :param path: The directory to measure.
+    :param exclude: Names of files and directories that are skipped.
+    :return: The number of files and their total size in bytes.
+    """
+    files = 0
+    total = 0
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.name in exclude:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    files += 1
+                    total += entry.stat(follow_symlinks=False).st_size
+    return files, total
+
+
+def lock_file(path: str, shared: bool = False, blocking: bool = True) -> Optional[IO]:
+    """
+    Take an advisory lock on a file, creating it if needed. The lock is released when the file is closed.
+
+    Locks are taken on open file descriptions, so they exclude other threads of the same process as well
+    as other processes. Nothing is locked on platforms without `fcntl`.
+
+    :param path: The lock file.
+    :param shared: Take a shared lock instead of an exclusive one.
+    :param blocking: Wait for the lock, instead of giving up when it is held by someone else.
+    :return: The open lock file, or None if the lock is held by someone else and `blocking` is False.
+    """
+    f = open(path, "a")
+    if fcntl is None:
+        return f
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        fcntl.flock(f.fileno(), flags if blocking else flags | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    except BaseException:
+        f.close()
+        raise
+    return f
+
+
+@contextmanager
+def locked(path: str, shared: bool = False) -> Iterator[None]:
+    """
+    Hold a lock on a file for the duration of a `with` block, see `lock_file`.
+    """
+    f = lock_file(path, shared=shared)
+    try:
+        yield
+    finally:
+        f.close()
+
+
+class CloneCache:
+    access_file = ".ultirepo-access"
+    locks_dir = ".locks"
+
+    def __init__(self, cache_dir: str = None, max_size: int = 0, max_age: int = 0) -> None:
+        """
+        Initialize CloneCache object.
+
+        :param cache_dir: The directory where the repositories are cached.
+        :param max_size: The maximum size of the cache in megabytes (0 means unlimited).
+        :param max_age: The maximum number of days an unused repository is kept (0 means unlimited).
+        """
+        self.cache_dir = os.path.abspath(cache_dir or default_cache_dir())
+        self.max_size = max_size
+        self.max_age = max_age
+        self.used = set()
+        self._held: Dict[str, IO] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.cache_dir, self.locks_dir), exist_ok=True)
+
+    @staticmethod
+    def _slugify(value: str, key: str = None) -> str:
+        slug = re.sub(r"[^\w.-]+", "_", value).strip("_")[:48]
+        digest = hashlib.sha1((key or value).encode()).hexdigest()[:12]
+        return f"{slug}-{digest}"
+
+    def entry_dir(self, git_url: str) -> str:
+        """
+        Return the cache entry of a remote and mark it as recently used.
+
+        The entry stays in use until the cache is closed, so other builds sharing the cache do not evict it.
+
+        :param git_url: The URL of the git repository.
+        :return: The directory holding everything cached for the remote.
+        """
+        name = os.path.splitext(os.path.basename(git_url.rstrip("/")))[0]
+        entry = os.path.join(self.cache_dir, self._slugify(name, key=git_url))
+        self.touch(entry)
+        return entry
+
+    def _lock_path(self, entry: str, name: str) -> str:
+        return os.path.join(self.cache_dir, self.locks_dir, f"{os.path.basename(entry)}.{name}.lock")
+
+    def lock(self, git_url: str, name: str = "objects"):
+        """
+        Lock a part of the cache entry of a remote against other threads and other builds sharing the cache.
+
+        The first build that needs a commit fetches it or checks it out while holding the lock, the others
+        wait for it and find the commit already there.
+
+        :param git_url: The URL of the git repository.
+        :param name: What is locked: "objects" for the object store, "archives" for the extracted archives,
+            or the name of a checkout directory.
+        :return: A context manager holding the lock.
+        """
+        return locked(self._lock_path(self.entry_dir(git_url), name))
+
+    def checkout_dir(self, git_url: str, git_ref: str) -> str:
+        """
+        Return the directory where a reference of a remote is checked out, as a worktree of the object store.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :return: The checkout directory inside the cache entry of the remote.
+        """
+        return os.path.join(self.entry_dir(git_url), self._slugify(git_ref))
+
+    def objects_dir(self, git_url: str) -> str:
+        """
+        Return the directory of the object store shared by every reference of a remote, whether it is read
+        directly or checked out in a worktree.
+
+        :param git_url: The URL of the git repository.
+        :return: The object store directory inside the cache entry of the remote.
+        """
+        return os.path.join(self.entry_dir(git_url), "objects")
+
+    def archives_dir(self, git_url: str) -> str:
+        """
+        Return the directory where the archives of the references of a remote are extracted.
+
+        :param git_url: The URL of the git repository.
+        :return: The archives directory inside the cache entry of the remote.
+        """
+        return os.path.join(self.entry_dir(git_url), "archives")
+
+    def touch(self, entry: str) -> None:
+        with self._lock:
+            self.used.add(entry)
+            if entry not in self._held:
+                # Waits for another build that is evicting the entry to finish
+                self._held[entry] = lock_file(self._lock_path(entry, "use"), shared=True)
+        os.makedirs(entry, exist_ok=True)
+        access_file = os.path.join(entry, self.access_file)
+        with open(access_file, "a"):
+            pass
+        os.utime(access_file)
+
+    def _last_used(self, entry: str) -> float:
+        try:
+            return os.stat(os.path.join(entry, self.access_file)).st_mtime
+        except FileNotFoundError:
+            return os.stat(entry).st_mtime
+
+    def _entries(self) -> List[Tuple[float, str]]:
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False) and entry.name != self.locks_dir:
+                    entries.append((self._last_used(entry.path), entry.path))
+        return sorted(entries)
+
+    def _remove(self, entry: str, reason: str) -> bool:
+        in_use = lock_file(self._lock_path(entry, "use"), blocking=False)
+        if in_use is None:
+            log.debug(f"Not evicting '{entry}' from the clone cache, it is used by another build.")
+            return False
+        try:
+            log.info(f"Evicting '{entry}' from the clone cache ({reason}).")
+            shutil.rmtree(entry, ignore_errors=True)
+        finally:
+            in_use.close()
+        return True
+
+    def evict(self, keep: Optional[Iterable[str]] = None) -> None:
+        """
+        Evict the least recently used repositories until the cache honours its age and size limits.
+
+        Entries used during the current build, or by another build sharing the cache, are never evicted.
+
+        :param keep: Additional cache entries that must not be evicted.
+        """
+        keep = set(keep or ()) | self.used
+        now = time.time()
+        remaining = []
+        for last_used, entry in self._entries():
+            expired = self.max_age and now - last_used > self.max_age * 86400
+            if entry in keep or not expired or not self._remove(entry, "expired"):
+                remaining.append(entry)
+
+        if not self.max_size:
+            return
+
+        sizes = [(entry, directory_size(entry)[1]) for entry in remaining]
+        total = sum(size for _, size in sizes)
+        for entry, size in sizes:
+            if total <= self.max_size * 1024 * 1024:
+                break
+            if entry in keep:
+                continue
+            if self._remove(entry, "size limit"):
+                total -= size
+
+    def close(self) -> None:
+        """
+        Release the entries used by this build, so that other builds may evict them.
+        """
+        with self._lock:
+            for f in self._held.values():
+                f.close()
+            self._held.clear()
@@ -1,3 +1,11 @@
+from mkdocs.exceptions import PluginError
+
 
 class InvalidNavPathError(Exception):
     pass
+
+class IncludeCycleError(PluginError):
+    pass
+
+class IncludeFetchError(PluginError):
+    pass
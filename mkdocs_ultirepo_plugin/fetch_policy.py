@@ -0,0 +1,88 @@
+import time
+from typing import Callable, Optional, Tuple, Type, TypeVar
+
+from mkdocs.plugins import get_plugin_logger
+
+from .exceptions import IncludeFetchError
+
+log = get_plugin_logger(__name__)
+
+# What happens to an include that cannot be fetched: fail the build, use what is cached, or leave it out of the nav
+FETCH_FAILURE_MODES = ("fail", "cached", "omit")
+
+T = TypeVar("T")
+
+
+class FetchPolicy:
+    def __init__(self, timeout: float = 0, retries: int = 0, backoff: float = 1, deadline: float = 0) -> None:
+        """
+        Initialize FetchPolicy object.
+
+        Bounds the time the network operations of the includes of a build may take: every attempt has a
+        timeout, failed attempts are retried with an exponential backoff, and nothing is attempted anymore
+        once the deadline of the build has passed.
+
+        :param timeout: The maximum duration of a single attempt in seconds, 0 for no limit.
+        :param retries: How many times a failed attempt is retried.
+        :param backoff: The delay before the first retry in seconds, doubled before every next one.
+        :param deadline: The time from now in seconds all attempts must be done by, 0 for no limit.
+        """
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.deadline = deadline
+        self._deadline_at = time.monotonic() + deadline if deadline else None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Return the seconds left before the deadline, or None when there is no deadline.
+        """
+        if self._deadline_at is None:
+            return None
+        return max(0.0, self._deadline_at - time.monotonic())
+
+    def attempt_timeout(self) -> Optional[float]:
+        """
+        Return the timeout of the next attempt: the per attempt timeout, cut to what is left before the deadline.
+
+        :return: The timeout in seconds, None for no limit.
+        """
+        remaining = self.remaining()
+        if not self.timeout:
+            return remaining
+        if remaining is None:
+            return self.timeout
+        return min(self.timeout, remaining)
+
+    def run(self, description: str, operation: Callable[[Optional[float]], T],
+            errors: Tuple[Type[BaseException], ...] = (Exception,),
+            transient: Callable[[BaseException], bool] = lambda error: True) -> T:
+        """
+        Run a network operation within the timeout and deadline, retrying it when it fails.
+
+        :param description: What the operation does, e.g. "fetch 'main' of 'https://...'", for the messages.
+        :param operation: The operation, called with the timeout of the attempt in seconds (None for no limit).
+        :param errors: The errors the operation fails with.
+        :param transient: Whether an error may go away by trying again, e.g. not when a reference does not exist.
+        :return: What the operation returned.
+        :raises IncludeFetchError: When the last attempt failed, or the deadline passed.
+        """
+        attempt = 0
+        while True:
+            timeout = self.attempt_timeout()
+            if timeout is not None and timeout <= 0:
+                raise IncludeFetchError(f"Unable to {description}: the fetch deadline of {self.deadline}s passed.")
+            attempt += 1
+            try:
+                return operation(timeout)
+            except errors as e:
+                error = e
+
+            reason = str(getattr(error, "stderr", "") or error).strip()
+            delay = self.backoff * 2 ** (attempt - 1)
+            remaining = self.remaining()
+            if attempt > self.retries or not transient(error) or (remaining is not None and remaining <= delay):
+                attempts = f" after {attempt} attempts" if attempt > 1 else ""
+                raise IncludeFetchError(f"Unable to {description}{attempts}: {reason}") from error
+            log.info(f"Unable to {description}, trying again in {delay:g}s: {reason}")
+            time.sleep(delay)
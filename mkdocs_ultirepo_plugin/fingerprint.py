@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from mkdocs.plugins import get_plugin_logger
+
+from .manifest import MANIFEST_FILE
+
+log = get_plugin_logger(__name__)
+
+FINGERPRINT_VERSION = 1
+
+# Written next to the manifest in the merged directory
+BUILD_STATE_FILE = ".ultirepo-build.json"
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def tree_state(paths: Iterable[str]) -> str:
+    """
+    Digest the state of local files: the path, size and modification time of every file under the paths.
+
+    Symlinks are followed like the merger does, and a missing path is part of the state.
+
+    :param paths: Files and directories.
+    :return: The digest of their state.
+    """
+    state = hashlib.sha256()
+    for path in paths:
+        state.update(f"{path}\0".encode())
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            try:
+                stat = os.stat(current)
+            except OSError:
+                state.update(f"{current}\0-\0".encode())
+                continue
+            if not os.path.isdir(current):
+                state.update(f"{current}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+                continue
+            try:
+                with os.scandir(current) as it:
+                    stack.extend(sorted((entry.path for entry in it), reverse=True))
+            except OSError:
+                state.update(f"{current}\0-\0".encode())
+    return state.hexdigest()
+
+
+def _file_stat(path: str) -> Optional[List[int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class BuildFingerprint:
+    def __init__(self, merged_docs_dir: str) -> None:
+        """
+        Initialize BuildFingerprint object.
+
+        Identifies the inputs of a build, so a build with the same inputs as the previous one can reuse its
+        resolved nav and merged directory instead of resolving and merging again. The inputs are the
+        root nav and the plugin config, the commit (or archive digest) of every include, and the state of
+        the local files: the original docs and the local includes. The state of the previous build is kept
+        in the merged directory it describes.
+
+        :param merged_docs_dir: The persistent directory the docs are merged into.
+        """
+        self.merged_docs_dir = merged_docs_dir
+        self.path = os.path.join(merged_docs_dir, BUILD_STATE_FILE)
+        self._manifest_path = os.path.join(merged_docs_dir, MANIFEST_FILE)
+        self.previous: Optional[Dict] = None
+
+    @staticmethod
+    def config_key(nav, config: Dict, docs_dir: str) -> str:
+        """
+        Digest what the build starts from: the root nav, the plugin config and the original docs directory.
+        """
+        return _digest({"version": FINGERPRINT_VERSION, "nav": nav, "config": config, "docs_dir": docs_dir})
+
+    @staticmethod
+    def local_paths(docs_dir: str, additional_info: List[dict]) -> List[str]:
+        """
+        Return the local files and directories a build read: the original docs, and the nav file and docs
+        of every local include.
+        """
+        paths = [os.path.abspath(docs_dir)]
+        for info in additional_info:
+            if info.get("local"):
+                paths.append(os.path.abspath(os.path.join(info["orig_docs_dir"], info["orig_docs_sub_dir"])))
+                if info.get("nav_file"):
+                    paths.append(info["nav_file"])
+        return sorted(set(paths))
+
+    @staticmethod
+    def _fingerprint(config_key: str, includes: List, local_state: str) -> str:
+        return _digest([config_key, includes, local_state])
+
+    def load(self) -> Optional[Dict]:
+        """
+        Read the state of the previous build.
+
+        :return: The state, or None if there is none or it cannot be read.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring unreadable build state '{self.path}': {e}")
+            return None
+        if data.get("version") != FINGERPRINT_VERSION:
+            return None
+        self.previous = data
+        return data
+
+    def includes(self) -> List[Tuple[str, str, bool, str]]:
+        """
+        Return the (git_url, git_ref, archive, version) of every include of the previous build, where the
+        version is the commit, or the digest of the archive.
+        """
+        if self.previous is None:
+            return []
+        return [tuple(include) for include in self.previous["includes"]]
+
+    def matches(self, config_key: str, versions: Dict[Tuple[str, str], Optional[str]]) -> bool:
+        """
+        Check if a build has the same inputs as the previous one, and its results are still in place.
+
+        :param config_key: The `config_key` of the build.
+        :param versions: The commit or archive digest every include of the previous build points to now.
+        :return: True if the resolved nav and merged directory of the previous build can be reused.
+        """
+        previous = self.previous
+        if previous is None or previous["config_key"] != config_key:
+            return False
+        includes = []
+        for git_url, git_ref, archive, _ in self.includes():
+            version = versions.get((git_url, git_ref))
+            if version is None:
+                return False
+            includes.append([git_url, git_ref, archive, version])
+        fingerprint = self._fingerprint(config_key, includes, tree_state(previous["local_paths"]))
+        if fingerprint != previous["fingerprint"]:
+            return False
+
+        # Another build of the same site may have merged into the directory since, or the sources of the
+        # merged files may have been evicted from the clone cache
+        if _file_stat(self._manifest_path) != previous["manifest"]:
+            return False
+        # Includes read from the object store have no directory of their own
+        return all(os.path.isdir(info.get("git_repo")
+                                 or os.path.join(info["orig_docs_dir"], info["orig_docs_sub_dir"]))
+                   for info in previous["additional_info"])
+
+    def save(self, config_key: str, versions: Dict[Tuple[str, str], str], archives: Iterable[Tuple[str, str]],
+             docs_dir: str, nav, additional_info: List[dict]) -> None:
+        """
+        Record the inputs and results of a build, replacing the previous state atomically.
+
+        :param config_key: The `config_key` of the build.
+        :param versions: The commit or archive digest of every (git_url, git_ref) included.
+        :param archives: The (git_url, git_ref) that were included from an archive.
+        :param docs_dir: The original docs directory.
+        :param nav: The resolved nav.
+        :param additional_info: The include information produced by the resolver.
+        """
+        archives = set(archives)
+        includes = [[git_url, git_ref, (git_url, git_ref) in archives, version]
+                    for (git_url, git_ref), version in sorted(versions.items())]
+        local_paths = self.local_paths(docs_dir, additional_info)
+        data = {
+            "version": FINGERPRINT_VERSION,
+            "fingerprint": self._fingerprint(config_key, includes, tree_state(local_paths)),
+            "config_key": config_key,
+            "includes": includes,
+            "local_paths": local_paths,
+            "manifest": _file_stat(self._manifest_path),
+            "nav": nav,
+            "additional_info": additional_info,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+        self.previous = data
+
+    def discard(self) -> None:
+        """
+        Remove the state of the previous build, so nothing is reused before a build completes again.
+        """
+        self.previous = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -1,25 +1,66 @@
 import errno
-import logging
+import hashlib
 import os
+import re
 import shutil
-import sys
+import time
 from tempfile import mkdtemp
+from typing import Dict, Iterable, Optional
 
 import git
-from mkdocs.utils import warning_filter
+from mkdocs.plugins import get_plugin_logger
 
-log = logging.getLogger(__name__)
-log.addFilter(warning_filter)
+from .cache import directory_size
+from .exceptions import IncludeFetchError
+from .fetch_policy import FetchPolicy
+
+log = get_plugin_logger(__name__)
+
+# Clone modes ordered from the narrowest to the widest checkout
+CLONE_MODES = {"sparse": 0, "shallow": 1, "partial": 1, "full": 2}
+
+# Keeps git from downloading the missing blobs of a partial clone on demand
+OFFLINE_ENVIRONMENT = {"GIT_NO_LAZY_FETCH": "1"}
+
+# Errors of git that trying again does not fix
+PERMANENT_ERRORS = ("couldn't find remote ref", "not our ref", "Repository not found",
+                    "does not appear to be a git repository", "Authentication failed")
+
+
+def _timeout_options(timeout: Optional[float]) -> Dict:
+    """
+    Return the keyword arguments that bound a git command accessing the network to a timeout.
+
+    Killing git does not end the helper that talks to an HTTP remote, which keeps the output of git open
+    until the remote answers. The helper is made to give up by itself once the transfer stalls, and so is ssh.
+    """
+    if timeout is None:
+        return {}
+    seconds = max(1, int(timeout))
+    env = {"GIT_HTTP_LOW_SPEED_LIMIT": "1", "GIT_HTTP_LOW_SPEED_TIME": str(seconds)}
+    if "GIT_SSH_COMMAND" not in os.environ and "GIT_SSH" not in os.environ:
+        env["GIT_SSH_COMMAND"] = (f"ssh -o ConnectTimeout={seconds} -o ServerAliveInterval={seconds} "
+                                  f"-o ServerAliveCountMax=1")
+    return {"kill_after_timeout": timeout, "env": env}
 
 
 class GitClone:
-    def __init__(self, target_dir=None):
+    def __init__(self, target_dir=None, offline=False, policy: Optional[FetchPolicy] = None):
         """
         Initialize GitClone object.
 
         :param target_dir: The target directory where the git repositories will be cloned.
+        :param offline: Never access the network. Cloning or fetching a commit that is not already in the
+            target directory fails instead.
+        :param policy: The timeouts, retries and deadline of the git commands that access the network. When
+            set, a command that still fails raises IncludeFetchError instead of ending the build.
         """
-        self.target_dir = target_dir or mkdtemp()
+        self.tempdir = None if target_dir else mkdtemp()
+        self.target_dir = target_dir or self.tempdir
+        self.offline = offline
+        self.policy = policy
+        # What the last clone or fetch cost, for the build report
+        self.stats = {}
 
         if not target_dir is None:
             if not os.path.exists(target_dir):
@@ -27,80 +68,375 @@ class GitClone:
                     os.makedirs(target_dir)
                 except OSError as e:
                     if e.errno != errno.EEXIST:
-                        log.error(
-                            f"Error creating target directory '{target_dir}': {e}",
-                            file=sys.stderr)
+                        log.error(f"Error creating target directory '{target_dir}': {e}")
                         self.cleanup()
                         raise SystemExit(1)
 
-    def _is_git_repo(self, path):
+    def _repo(self, path):
+        repo = git.Repo(path)
+        if self.offline:
+            repo.git.update_environment(**OFFLINE_ENVIRONMENT)
+        return repo
+
+    def _require_commit(self, repo, git_url, sha):
+        """
+        Fail the build when an offline clone or fetch would need the network.
+        """
+        if repo is None or not self._has_commit(repo, sha):
+            log.error(f"Commit {sha} of '{git_url}' is not in the clone cache at '{self.target_dir}', "
+                      f"and it cannot be fetched while the build is locked. Update the lock file to fetch it.")
+            raise SystemExit(1)
+
+    def _network(self, description, operation):
         """
-        Check if a given path contains a .git directory.
+        Run a git command that accesses the network within the timeouts, retries and deadline of the policy.
 
-        :param path: The path to check.
-        :return: True if .git directory is present, False otherwise.
+        :param description: What the command does, for the messages.
+        :param operation: The command, called with the timeout of the attempt in seconds (None for no limit).
         """
-        if not os.path.exists(path):
+        if self.policy is None:
+            return operation(None)
+        return self.policy.run(description, operation, errors=(git.GitCommandError,),
+                               transient=lambda e: not any(error in str(e.stderr) for error in PERMANENT_ERRORS))
+
+    def _is_partial(self, repo):
+        try:
+            return bool(repo.git.config("--get", "extensions.partialClone"))
+        except git.GitCommandError:
             return False
 
+    def _lazy_fetch(self, repo, description, command, *args):
+        """
+        Run a git command that downloads the missing blobs of a partial clone, within the policy.
+        """
+        run = getattr(repo.git, command)
+        if self.policy is None or self.offline or not self._is_partial(repo):
+            return run(*args)
+        return self._network(description, lambda timeout: run(*args, **_timeout_options(timeout)))
+
+    @staticmethod
+    def _repo_name(git_url):
+        repo_name = os.path.splitext(os.path.basename(git_url))[0]
+        if repo_name.endswith('.git'):
+            repo_name = repo_name[:-4]
+        return os.path.basename(repo_name)
+
+    @staticmethod
+    def _is_full_sha(git_ref):
+        return re.fullmatch(r"[0-9a-f]{40}", git_ref) is not None
+
+    def _has_commit(self, repo, git_ref):
+        """
+        Check if the commit a git reference points to is already present in the local repository.
+        """
         try:
-            repo = git.Repo(path)
-            return os.path.samefile(repo.git.rev_parse("--show-toplevel"),
-                                    self.target_dir)
-        except git.InvalidGitRepositoryError:
+            repo.git.rev_parse("--verify", "--quiet", f"{git_ref}^{{commit}}")
+            return True
+        except git.GitCommandError:
             return False
 
-    # TODO: Improve the error handling by allowing the cloning to fail and instead omitting the `!include` string from the nav.
-    def clone(self, git_url, git_ref="main"):
+    @staticmethod
+    def ls_remote(git_url, git_refs, timeout: Optional[float] = None) -> Dict[str, Optional[str]]:
+        """
+        Resolve several references of a remote to commit SHAs in a single round trip.
+
+        :param git_url: The URL of the git repository.
+        :param git_refs: The branches, tags or other references to resolve.
+        :param timeout: Kill git when it takes longer than this many seconds.
+        :return: The commit SHA of every reference, or None for references the remote does not have.
+        """
+        git_refs = list(dict.fromkeys(git_refs))
+        patterns = []
+        for git_ref in git_refs:
+            patterns.extend((git_ref, f"{git_ref}^{{}}"))
+
+        advertised = {}
+        for line in git.cmd.Git().ls_remote(git_url, *patterns, **_timeout_options(timeout)).splitlines():
+            sha, name = line.split("\t", 1)
+            advertised[name] = sha
+
+        resolved = {}
+        for git_ref in git_refs:
+            candidates = [git_ref] if git_ref.startswith("refs/") or git_ref == "HEAD" else [
+                f"refs/heads/{git_ref}", f"refs/tags/{git_ref}"]
+            sha = None
+            for candidate in candidates:
+                # Prefer the peeled commit of annotated tags
+                sha = advertised.get(f"{candidate}^{{}}") or advertised.get(candidate)
+                if sha is not None:
+                    break
+            resolved[git_ref] = sha
+        return resolved
+
+    @staticmethod
+    def _object_bytes(repo):
+        """
+        Return the size of the git objects of a repository, packed and loose.
+        """
+        counts = dict(line.split(": ", 1) for line in repo.git.count_objects("-v").splitlines())
+        return (int(counts.get("size", 0)) + int(counts.get("size-pack", 0))) * 1024
+
+    def _timed(self, name, start):
+        self.stats[name] = self.stats.get(name, 0.0) + time.perf_counter() - start
+
+    def _checkout(self, repo, git_ref):
+        start = time.perf_counter()
+        self._lazy_fetch(repo, f"check out '{git_ref}'", "checkout", "--force", "--detach", git_ref)
+        self._timed("checkout_seconds", start)
+
+    def _head(self, repo):
+        try:
+            return repo.head.commit.hexsha
+        except ValueError:
+            return None
+
+    def _is_sparse(self, repo):
+        # sparse-checkout may store its setting in the worktree config, which GitPython does not read
+        try:
+            return repo.git.config("--type=bool", "--get", "core.sparseCheckout") == "true"
+        except git.GitCommandError:
+            return False
+
+    @staticmethod
+    def _sparse_cone(clone_mode: str, sparse_paths: Optional[Iterable[str]]):
+        """
+        Return the sparse-checkout cone, or None when the whole tree has to be checked out.
+        """
+        if clone_mode != "sparse" or not sparse_paths:
+            return None
+        paths = sorted({path.strip("/") for path in sparse_paths})
+        if "" in paths:
+            return None
+        return paths
+
+    def configure_checkout(self, repo_path, clone_mode="full", sparse_paths=None):
+        """
+        Restrict or widen the working tree of an existing clone to match the clone mode.
+
+        :param repo_path: The path to the cloned git repository.
+        :param clone_mode: One of "full", "shallow", "partial" or "sparse".
+        :param sparse_paths: The directories checked out when the clone mode is "sparse".
+        """
+        repo = self._repo(repo_path)
+        cone = self._sparse_cone(clone_mode, sparse_paths)
+        if cone is not None:
+            self._lazy_fetch(repo, f"check out {', '.join(cone)}", "sparse_checkout", "set", "--cone", *cone)
+        elif self._is_sparse(repo):
+            repo.git.sparse_checkout("disable")
+
+    def _fetch_ref(self, repo, git_url, options, refspec):
         """
-        Clone a git repository into the specified target directory.
+        Fetch from the origin, recording the time it took and the size of the objects it added.
+        """
+        start = time.perf_counter()
+        object_bytes = self._object_bytes(repo)
+        self._network(f"fetch '{refspec.split(':')[0].lstrip('+')}' of '{git_url}'",
+                      lambda timeout: repo.git.fetch(*options, "origin", refspec, **_timeout_options(timeout)))
+        self.stats["bytes_fetched"] = self.stats.get("bytes_fetched", 0) + max(
+            0, self._object_bytes(repo) - object_bytes)
+        self._timed("fetch_seconds", start)
+
+    def report(self, repo_path, git_url, git_ref, clone_mode, elapsed):
+        """
+        Log the time spent and the size of a checkout, so the savings of the clone mode are visible.
+
+        :param repo_path: The path to the clone or worktree.
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference checked out.
+        :param clone_mode: The clone mode used.
+        :param elapsed: The seconds spent fetching and checking out.
+        """
+        repo = self._repo(repo_path)
+        # The objects of a worktree are in the object store it was added from
+        _, git_bytes = directory_size(repo.common_dir)
+        checked_out, checked_out_bytes = directory_size(repo.working_tree_dir, exclude=(".git",))
+        total = len(repo.git.ls_tree("-r", "--name-only", "HEAD").splitlines())
+        log.info(
+            f"Cloned '{git_url}' at '{git_ref}' ({clone_mode}) in {elapsed:.2f}s: "
+            f"{git_bytes} bytes of git objects, {checked_out} of {total} files checked out "
+            f"({checked_out_bytes} bytes)."
+        )
+
+    def clone(self, git_url, git_ref="main", clone_mode="full", sparse_paths=None, expected_sha=None):
+        """
+        Check out a git reference in a worktree of the object store of its remote, in the target directory.
+
+        This runs `fetch_objects`, `add_worktree` and `checkout_worktree` one after the other, for callers that
+        do not share the target directory with concurrent checkouts.
 
         :param git_url: The URL of the git repository to clone.
         :param git_ref: The git reference to checkout after cloning (default: "main").
-        :return: The target directory where the repository was cloned.
+        :param clone_mode: "full" fetches the whole history, "shallow" only the requested commit,
+            "partial" downloads file contents on demand and "sparse" combines both and only checks out
+            `sparse_paths` (default: "full").
+        :param sparse_paths: The directories checked out when the clone mode is "sparse".
+        :param expected_sha: The commit the reference is known to point to, see `fetch_objects`.
+        :return: The path to the worktree.
         """
+        start = time.perf_counter()
+        store_path, sha = self.fetch_objects(git_url, git_ref, clone_mode=clone_mode, expected_sha=expected_sha,
+                                             filter_blobs=clone_mode in ("partial", "sparse"))
+        worktree_path, added = self.add_worktree(store_path, self.target_dir, git_url, sha)
         try:
-            repo_name = os.path.splitext(os.path.basename(git_url))[0]
-            if repo_name.endswith('.git'):
-                repo_name = repo_name[:-4]
-
-            if self.target_dir is None:
-                self.target_dir = os.path.join(self.tempdir,
-                                               os.path.basename(repo_name))
-            else:
-                self.target_dir = os.path.join(self.target_dir,
-                                               os.path.basename(repo_name))
-
-            if not self._is_git_repo(self.target_dir):
-                repo = git.Repo.clone_from(git_url, self.target_dir)
-                repo.git.checkout(git_ref)
-            else:
-                log.info(
-                    f"The repository '{git_url}' is already cloned at '{self.target_dir}'."
-                )
-                repo = git.Repo(self.target_dir)
-                repo.git.checkout(git_ref)
-
-            return self.target_dir
+            self.configure_checkout(worktree_path, clone_mode, sparse_paths)
+        except git.GitCommandError as e:
+            log.error(f"Error while checking out '{git_url}' at {sha}: {e.stderr.strip()}")
+            raise SystemExit(1)
+        if self.checkout_worktree(worktree_path, git_url, sha, added=added):
+            self.report(worktree_path, git_url, git_ref, clone_mode, time.perf_counter() - start)
+        return worktree_path
+
+    @staticmethod
+    def _objects_ref(git_ref):
+        """
+        Return the local reference that keeps the objects of a fetched reference in the object store.
+        """
+        slug = re.sub(r"[^\w.-]+", "_", git_ref).strip("_.")[:48]
+        return f"refs/ultirepo/{slug}-{hashlib.sha1(git_ref.encode()).hexdigest()[:8]}"
+
+    def fetch_objects(self, git_url, git_ref="main", clone_mode="full", expected_sha=None, filter_blobs=False):
+        """
+        Fetch a reference into a bare object store in the target directory, without checking anything out.
+
+        Every reference of a remote is fetched into the same object store, so the files of several
+        references are served from one set of objects, or checked out from it with `add_worktree`.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference to fetch (default: "main").
+        :param clone_mode: "shallow" and "sparse" only fetch the requested commit.
+        :param expected_sha: The commit the reference is known to point to. The fetch is skipped when the
+            object store already holds the reference at this commit. When the fetch is offline, this commit
+            must already be in the object store.
+        :param filter_blobs: Leave out file contents, they are downloaded when a worktree checks them out.
+            Objects read straight from the store are fetched with their blobs, since reading them one by one
+            from a partial store would cost a round trip each.
+        :return: The path to the object store and the commit the reference points to.
+        """
+        if clone_mode not in CLONE_MODES:
+            raise ValueError(f"Unknown clone mode '{clone_mode}'. Expected one of: {', '.join(CLONE_MODES)}")
+
+        start = time.perf_counter()
+        self.stats = {}
+        repo_path = os.path.join(self.target_dir, f"{self._repo_name(git_url)}.git")
+        local_ref = self._objects_ref(git_ref)
+        try:
+            try:
+                repo = self._repo(repo_path)
+            except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+                if self.offline:
+                    self._require_commit(None, git_url, expected_sha)
+                # Remove leftovers of an interrupted fetch
+                if os.path.exists(repo_path):
+                    shutil.rmtree(repo_path)
+                repo = git.Repo.init(repo_path, bare=True)
+                repo.create_remote("origin", git_url)
+
+            if expected_sha is None and self._is_full_sha(git_ref):
+                expected_sha = git_ref
+            if self.offline:
+                self._require_commit(repo, git_url, expected_sha)
+            if expected_sha is not None and self._has_commit(repo, expected_sha):
+                log.debug(f"Commit {expected_sha} of '{git_url}' is already in the object store.")
+                repo.git.update_ref(local_ref, expected_sha)
+                return repo_path, expected_sha
+
+            options = ["--no-tags"]
+            if clone_mode in ("shallow", "sparse"):
+                options.append("--depth=1")
+            elif os.path.exists(os.path.join(repo.git_dir, "shallow")):
+                options.append("--unshallow")
+            if filter_blobs:
+                options.append("--filter=blob:none")
+            self._fetch_ref(repo, git_url, options, f"+{git_ref}:{local_ref}")
+            sha = repo.git.rev_parse(f"{local_ref}^{{commit}}")
+
+            _, git_bytes = directory_size(repo.git_dir)
+            log.info(f"Fetched '{git_url}' at '{git_ref}' ({clone_mode}) into the object store in "
+                     f"{time.perf_counter() - start:.2f}s: {git_bytes} bytes of git objects.")
+            return repo_path, sha
+        except IncludeFetchError:
+            raise
         except git.GitCommandError as e:
-            log.error(
-                f"Error while cloning the repository '{git_url}': {e.stderr.strip()}",
-                file=sys.stderr)
+            log.error(f"Error while fetching the repository '{git_url}': {e.stderr.strip()}")
             raise SystemExit(1)
         except Exception as e:
-            log.error(
-                f"Unexpected error while cloning the repository '{git_url}': {e}",
-                file=sys.stderr)
+            log.error(f"Unexpected error while fetching the repository '{git_url}': {e}")
+            raise SystemExit(1)
+
+    def _is_worktree_of(self, path, store_path):
+        try:
+            repo = git.Repo(path)
+        except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+            return False
+        return (repo.git_dir != repo.common_dir
+                and os.path.realpath(repo.common_dir) == os.path.realpath(store_path))
+
+    def add_worktree(self, store_path, worktree_dir, git_url, sha):
+        """
+        Add a worktree of an object store, without checking anything out yet.
+
+        Adding a worktree changes the object store, so it must not run concurrently with another change
+        of the same store. Checking it out with `checkout_worktree` only touches the worktree.
+
+        :param store_path: The object store returned by `fetch_objects`.
+        :param worktree_dir: The directory the worktree is added to.
+        :param git_url: The URL of the git repository.
+        :param sha: The commit the new worktree starts at.
+        :return: The path to the worktree, and whether it was added now.
+        """
+        worktree_path = os.path.join(worktree_dir, self._repo_name(git_url))
+        try:
+            if self._is_worktree_of(worktree_path, store_path):
+                return worktree_path, False
+
+            # Remove a clone of the previous cache layout, or the leftovers of an interrupted checkout
+            if os.path.lexists(worktree_path):
+                shutil.rmtree(worktree_path)
+            os.makedirs(worktree_dir, exist_ok=True)
+            store = self._repo(store_path)
+            # Keep the sparse-checkout of a worktree in its own config. Enabling this before sparse-checkout
+            # does keeps `core.bare` in the config of the store, where GitPython reads it.
+            store.git.config("extensions.worktreeConfig", "true")
+            store.git.worktree("prune")
+            store.git.worktree("add", "--detach", "--no-checkout", worktree_path, sha)
+            self._repo(worktree_path).git.config("--worktree", "core.bare", "false")
+            return worktree_path, True
+        except git.GitCommandError as e:
+            log.error(f"Error while adding a worktree of '{git_url}': {e.stderr.strip()}")
+            raise SystemExit(1)
+
+    def checkout_worktree(self, worktree_path, git_url, sha, added=False):
+        """
+        Check out a commit in a worktree added with `add_worktree`, within the cone set by `configure_checkout`.
+
+        Worktrees of the same object store can be checked out concurrently.
+
+        :param worktree_path: The path to the worktree.
+        :param git_url: The URL of the git repository.
+        :param sha: The commit to check out.
+        :param added: True when the worktree was just added and nothing is checked out yet.
+        :return: True if the commit was checked out, False if it already was.
+        """
+        try:
+            repo = self._repo(worktree_path)
+            # A worktree added by an interrupted build has no index yet
+            checked_out = os.path.exists(os.path.join(repo.git_dir, "index"))
+            if added or not checked_out or self._head(repo) != sha:
+                self._checkout(repo, sha)
+                return True
+            log.debug(f"'{git_url}' is already checked out at {sha} in '{worktree_path}'.")
+            return False
+        except git.GitCommandError as e:
+            log.error(f"Error while checking out '{git_url}' at {sha}: {e.stderr.strip()}")
             raise SystemExit(1)
 
     def cleanup(self):
+        if self.tempdir is None:
+            return
         try:
             shutil.rmtree(self.tempdir)
             log.debug(f"Temporary directory '{self.tempdir}' has been cleaned up.")
         except FileNotFoundError as e:
-            log.error(f"Error while cleaning up the temporary directory: {e}",
-                  file=sys.stderr)
+            log.error(f"Error while cleaning up the temporary directory: {e}")
         except Exception as e:
-            log.error(
-                f"Unexpected error while cleaning up the temporary directory: {e}",
-                file=sys.stderr)
+            log.error(f"Unexpected error while cleaning up the temporary directory: {e}")
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import threading
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+import git
+from gitdb.util import hex_to_bin
+from mkdocs.plugins import get_plugin_logger
+
+log = get_plugin_logger(__name__)
+
+# Tree entry modes that are neither regular files nor directories
+SYMLINK_MODE = 0o120000
+SUBMODULE_MODE = 0o160000
+
+# Where the files of an include are read from: a checked out working tree, the object database or an archive
+INCLUDE_SOURCES = ("checkout", "objects", "archive")
+
+_repos = threading.local()
+
+
+def open_repo(repo_path: str) -> git.Repo:
+    """
+    Return the shared Repo of a repository, so its `git cat-file --batch` process is started only once.
+
+    The process answers one request at a time, so every thread gets a Repo of its own.
+    """
+    repo_path = os.path.abspath(repo_path)
+    repos = getattr(_repos, "repos", None)
+    if repos is None:
+        repos = _repos.repos = {}
+    repo = repos.get(repo_path)
+    if repo is None:
+        repo = repos[repo_path] = git.Repo(repo_path)
+    return repo
+
+
+class GitTree:
+    def __init__(self, repo_path: str, commit: str) -> None:
+        """
+        Initialize GitTree object.
+
+        Reads the files of a commit straight from the object database, without a working tree.
+        All trees of a repository share one Repo per thread, which reads every object through a single
+        long-lived `git cat-file --batch` process. A tree must only be used by the thread that created it.
+
+        :param repo_path: The path to the git repository, bare or not.
+        :param commit: The commit to read.
+        """
+        self.repo_path = os.path.abspath(repo_path)
+        self.commit = commit
+        self.repo = open_repo(repo_path)
+        self.tree = self.repo.commit(commit).tree
+
+    def relative(self, path: str) -> str:
+        """
+        Convert a path below the repository path into a path inside the tree.
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.repo_path)
+        path = path.replace(os.sep, "/").strip("/")
+        return "" if path == "." else path
+
+    def _entry(self, path: str) -> Optional[git.objects.base.IndexObject]:
+        relative = self.relative(path)
+        if not relative:
+            return self.tree
+        try:
+            return self.tree / relative
+        except KeyError:
+            return None
+
+    def exists(self, path: str) -> bool:
+        return self._entry(path) is not None
+
+    def is_dir(self, path: str) -> bool:
+        return isinstance(self._entry(path), git.Tree)
+
+    def tree_id(self, path: str) -> Optional[str]:
+        """
+        Return the id of the tree of a directory, which changes whenever anything below it changes.
+        """
+        entry = self._entry(path)
+        return entry.hexsha if isinstance(entry, git.Tree) else None
+
+    def listdir(self, path: str) -> Iterator[Tuple[str, bool]]:
+        """
+        List the name of every file and directory in a directory of the tree, and whether it is a directory.
+        """
+        entry = self._entry(path)
+        if not isinstance(entry, git.Tree):
+            return
+        for item in entry:
+            if isinstance(item, git.Tree):
+                yield item.name, True
+            elif isinstance(item, git.Blob) and item.mode not in (SYMLINK_MODE, SUBMODULE_MODE):
+                yield item.name, False
+
+    def read(self, path: str) -> bytes:
+        """
+        Read the content of a file in the tree.
+
+        :param path: The path of the file, absolute below the repository path or relative to the tree.
+        :return: The content of the file.
+        """
+        entry = self._entry(path)
+        if not isinstance(entry, git.Blob):
+            raise FileNotFoundError(f"'{self.relative(path)}' is not a file in {self.commit}")
+        return entry.data_stream.read()
+
+    def files(self, path: str) -> Iterator[Tuple[str, git.Blob]]:
+        """
+        Walk the files below a directory of the tree.
+
+        Symlinks and submodules are skipped since they have no content in the tree.
+
+        :param path: The directory to walk.
+        :return: The path relative to the directory and the blob of every file.
+        """
+        entry = self._entry(path)
+        if not isinstance(entry, git.Tree):
+            return
+        for item in entry.traverse():
+            if not isinstance(item, git.Blob):
+                continue
+            if item.mode in (SYMLINK_MODE, SUBMODULE_MODE):
+                log.debug(f"Skipping '{item.path}' in {self.commit}, it is not a regular file.")
+                continue
+            yield os.path.relpath(item.path, entry.path) if entry.path else item.path, item
+
+
+class GitBlob(NamedTuple):
+    """
+    A file of an include that is read from the object database instead of a working tree.
+    """
+    repo_path: str
+    hexsha: str
+    size: int
+    path: str
+
+
+def stream_blob(repo: git.Repo, hexsha: str, destination: BinaryIO) -> None:
+    """
+    Stream the content of a blob into a file object without holding it in memory.
+    """
+    stream = repo.odb.stream(hex_to_bin(hexsha))
+    shutil.copyfileobj(stream, destination)
+
+
+def read_blob(repo_path: str, hexsha: str) -> bytes:
+    """
+    Read the content of a blob into memory.
+    """
+    return open_repo(repo_path).odb.stream(hex_to_bin(hexsha)).read()
+
+
+def blob_hexsha(path: str) -> str:
+    """
+    Compute the git blob id of a file on disk, to check if it holds the content of a blob.
+    """
+    digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,19 +1,24 @@
-import logging
 import os
 import re
 import sys
 from abc import ABC, abstractmethod
+from tempfile import mkdtemp
 from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import parse_qs, urlparse
 
 import yaml
-from mkdocs.utils import warning_filter
+from mkdocs.plugins import get_plugin_logger
 
-from .exceptions import InvalidNavPathError
+from .archive import DEFAULT_ARCHIVE_URL, GitArchive, archive_url
+from .exceptions import IncludeCycleError, IncludeFetchError, InvalidNavPathError
 from .git_clone import GitClone
+from .git_objects import INCLUDE_SOURCES, GitTree, open_repo
+from .nav_generator import NavGenerator
 
-log = logging.getLogger(__name__)
-log.addFilter(warning_filter)
+log = get_plugin_logger(__name__)
+
+# Use the C implementation of the YAML loader when PyYAML was built with libyaml
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 class ParserInterface(ABC):
     def __init__(self, resolver, parent, string) -> None:
@@ -29,8 +34,9 @@ class ParserInterface(ABC):
 class IncludeParserBang(ParserInterface):
     def __init__(self, resolver, parent, string) -> None:
         super().__init__(resolver, parent, string)
-        self.clone_dir = None
         self.nav_files = ["nav.yml", "nav.yaml"]
+        self.query_params = {}
+        self.tree: Optional[GitTree] = None
 
     def _get_docs_sub_dir(self, path: str, docs_dir: str) -> str:
         docs_sub_dir = ""
@@ -39,7 +45,13 @@ class IncludeParserBang(ParserInterface):
             if path.endswith(s):
                 docs_sub_dir = path.rsplit(s, 1)[0]
                 docs_sub_dir = docs_sub_dir.replace(f"{docs_dir}/", "", 1)
-        return docs_sub_dir
+                return docs_sub_dir
+
+        # The path is a directory with a generated nav
+        docs_sub_dir = path.strip("/")
+        if docs_sub_dir == docs_dir:
+            return ""
+        return docs_sub_dir.replace(f"{docs_dir}/", "", 1)
 
     def _get_docs_dir(self, nav_config: Dict, abs_path: str, nav_path: str) -> Tuple[str, str]:
         orig_docs_dir = None
@@ -54,18 +66,70 @@ class IncludeParserBang(ParserInterface):
         orig_docs_sub_dir = self._get_docs_sub_dir(nav_path, docs_dir)
         return orig_docs_dir, orig_docs_sub_dir
 
-    def _clone_git_repo(self, git_url: str, git_ref: str) -> str:
+    def _get_nav_dir(self, nav_path: str) -> str:
+        """
+        Get the directory of the repository that holds the nav file and the documents it references.
+
+        :param nav_path: The nav_path of the include.
+        :return: The directory relative to the repository root.
+        """
+        if os.path.basename(nav_path) in self.nav_files:
+            return os.path.dirname(nav_path)
+        return nav_path.strip("/")
+
+    def _clone_git_repo(self, git_url: str, git_ref: str, clone_mode: Optional[str] = None,
+                        sparse_path: Optional[str] = None) -> str:
         """
         Clone a git repository and return the path to the cloned repo.
 
         :param git_url: The URL of the git repository to clone.
         :param git_ref: The git reference to checkout after cloning.
+        :param clone_mode: The clone mode, defaults to the one configured for the plugin.
+        :param sparse_path: The directory checked out when the clone mode is "sparse".
         :return: The path to the cloned git repository.
         """
+        prefetcher = getattr(self.resolver, "prefetcher", None)
+        if prefetcher is not None:
+            return prefetcher.get(git_url, git_ref, clone_mode=clone_mode, sparse_path=sparse_path)
+
         git_clone = GitClone()
-        git_repo_path = git_clone.clone(git_url, git_ref)
+        git_repo_path = git_clone.clone(git_url, git_ref, clone_mode=clone_mode or "full",
+                                        sparse_paths=[sparse_path] if sparse_path is not None else None)
         return git_repo_path
 
+    def _fetch_git_objects(self, git_url: str, git_ref: str, clone_mode: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Fetch a git reference into an object store without checking it out.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference to fetch.
+        :param clone_mode: The clone mode, defaults to the one configured for the plugin.
+        :return: The path to the object store and the commit the reference points to.
+        """
+        prefetcher = getattr(self.resolver, "prefetcher", None)
+        if prefetcher is not None:
+            return prefetcher.get_objects(git_url, git_ref, clone_mode=clone_mode)
+
+        git_clone = GitClone()
+        return git_clone.fetch_objects(git_url, git_ref, clone_mode=clone_mode or "full")
+
+    def _fetch_archive(self, git_url: str, git_ref: str, subtree: str) -> Tuple[str, str]:
+        """
+        Extract a directory of the archive of a git reference, without git.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :param subtree: The directory of the repository the include needs.
+        :return: The directory of the extracted tree and the digest of the archive.
+        """
+        prefetcher = getattr(self.resolver, "prefetcher", None)
+        if prefetcher is not None:
+            return prefetcher.get_archive(git_url, git_ref, subtree, archive_url=self.get_option("archive_url"))
+
+        git_archive = GitArchive(mkdtemp(prefix="ultirepo_"))
+        url = archive_url(self.get_option("archive_url", DEFAULT_ARCHIVE_URL), git_url, git_ref)
+        return git_archive.fetch(url, [subtree])
+
     def _validate_git_url(self, value: str) -> bool:
         """
         Validate if a given value is a correct git URL.
@@ -73,12 +137,12 @@ class IncludeParserBang(ParserInterface):
         :param value: The URL string to validate.
         :return: True if the URL is valid, False otherwise.
         """
-        git_url_pattern = r"^(?P<git_url>((git|ssh|http(s)?)|(git@[\w\.]+))(:(//)?)([\w\.@\:/\-~]+)(\.git)(/)?).*$"
+        git_url_pattern = r"^(?P<git_url>((git|ssh|file|http(s)?)|(git@[\w\.]+))(:(//)?)([\w\.@\:/\-~]+)(\.git)(/)?).*$"
 
         match = re.match(git_url_pattern, value)
 
         if not match:
-            log.error(f"Not a valid git URL: {value}", file=sys.stderr)
+            log.error(f"Not a valid git URL: {value}")
             raise ValueError(f"Not a valid Git URL: {value}")
         return True
 
@@ -94,6 +158,7 @@ class IncludeParserBang(ParserInterface):
         nav_path = None
         url = urlparse(string)
         query_params = parse_qs(url.query)
+        self.query_params = query_params
 
         if "ref" not in query_params:
             log.error("Missing 'ref' key in query parameters.")
@@ -110,6 +175,44 @@ class IncludeParserBang(ParserInterface):
 
         return git_url, git_ref, nav_path
 
+    def parse(self) -> Tuple[str, str, str]:
+        """
+        Validate the include string and parse it.
+
+        :return: git_url, git_ref, and nav_path extracted from the include string.
+        """
+        self._validate_git_url(self.string)
+        return self._parse_query_params(self.string)
+
+    def get_option(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Get an optional query parameter of the include string, such as `clone_mode`.
+
+        :param name: The name of the query parameter.
+        :param default: The value returned when the parameter is not set.
+        :return: The value of the query parameter.
+        """
+        values = self.query_params.get(name)
+        return values[0] if values else default
+
+    def get_source(self, default: str = "checkout") -> str:
+        """
+        Get where the files of the include are read from, set by the `source` query parameter.
+
+        :param default: The source used when the parameter is not set.
+        :return: "checkout", "objects" or "archive".
+        """
+        source = self.get_option("source", default)
+        if source not in INCLUDE_SOURCES:
+            log.error(f"Unknown include source '{source}'.")
+            raise ValueError(f"Unknown include source '{source}'. Expected one of: {', '.join(INCLUDE_SOURCES)}")
+        return source
+
+    def _path_exists(self, path: str) -> bool:
+        if self.tree is not None:
+            return self.tree.exists(path)
+        return os.path.exists(path)
+
     def _get_nav_file_path(self, abs_path, nav_path: str):
         nav_file_path = None
 
@@ -126,22 +229,26 @@ class IncludeParserBang(ParserInterface):
             # Attempt to find the nav files in the directory
             for nav_file in self.nav_files:
                 temp_nav_file_path = os.path.join(abs_path, nav_path, nav_file)
-                if os.path.exists(temp_nav_file_path):
+                if self._path_exists(temp_nav_file_path):
                     nav_file_path = temp_nav_file_path
                     log.debug(f"Found nav file in nav_path. Path: {nav_file_path}")
                     break
-                else:
-                    log.error("Functionality for recursively parsing through a directory is not yet implemented")
-                    raise InvalidNavPathError("Neither 'nav.yml' nor 'nav.yaml' found in the specified path.")
+            else:
+                if not self._path_exists(os.path.join(abs_path, nav_path)):
+                    raise InvalidNavPathError(f"The nav_path '{nav_path}' does not exist.")
+                log.debug(f"Neither 'nav.yml' nor 'nav.yaml' found in '{nav_path}', the nav will be generated.")
 
         return nav_file_path
 
     def _load_nav_file(self, nav_file_path: str) -> Tuple[Dict[str, Union[str, List, Dict]], str]:
         nav_config = None
 
+        if self.tree is not None:
+            return yaml.load(self.tree.read(nav_file_path), Loader=SafeLoader)
+
         try:
             with open(nav_file_path, "r") as nav_file:
-                nav_config = yaml.safe_load(nav_file)
+                nav_config = yaml.load(nav_file, Loader=SafeLoader)
         except FileNotFoundError:
             raise FileNotFoundError(f"Nav file not found: {nav_file_path}")
         except PermissionError:
@@ -155,56 +262,167 @@ class IncludeParserBang(ParserInterface):
 
         return nav_config
 
-    def _generate_nav(self, git_repo_path: str, subpath: str) -> Tuple[Dict[str, Union[str, List, Dict]], str]:
-        # TODO: Implement recursive nav parser
+    def _generate_nav(self, git_repo_path: str, subpath: str) -> Dict[str, Union[str, List, Dict]]:
+        """
+        Generate the nav config of a directory that has no nav file.
+
+        :param git_repo_path: The path to the git repository.
+        :param subpath: The directory relative to the repository.
+        :return: The nav config, with paths relative to the directory.
+        """
         full_path = os.path.join(git_repo_path, subpath)
-        pass
+        nav_generator = getattr(self.resolver, "nav_generator", None) or NavGenerator()
+        return {"nav": nav_generator.generate(full_path, tree=self.tree)}
 
     def _resolve_nav_file(self, nav_config: Dict, parsers: ParserInterface) -> Tuple[List, List[dict]]:
         self.resolver.set_parsers(parsers)
         resolved_nav, additional_info = self.resolver.resolve(nav=nav_config["nav"], parent=self.parent)
         return resolved_nav, additional_info
 
-    def execute(self, *args, **kwargs) -> Tuple[List, List[dict]]:
-        super().execute()
-
-        # Set clone dir
-        self.clone_dir = kwargs.get("clone_dir", os.path.join(os.getcwd(), "git_clones"))
-
-        # Validate URL
-        self._validate_git_url(self.string)
+    def _open_source(self) -> Tuple[str, str, Tuple[str, str], Dict]:
+        """
+        Get the files of the include: clone the git repository, only fetch its objects, or extract its archive.
 
-        # Parse URL
-        git_url, git_ref, nav_path = self._parse_query_params(self.string)
+        :return: The directory the nav_path is relative to, the nav_path, the (git_url, commit) identifying
+            this version of the files, and the additional info that depends on the source.
+        """
+        # Validate and parse URL
+        git_url, git_ref, nav_path = self.parse()
+
+        # Clone Git repo, or only fetch its objects
+        prefetcher = getattr(self.resolver, "prefetcher", None)
+        source = self.get_source(getattr(prefetcher, "source", "checkout"))
+        if source == "objects":
+            git_repo_path, git_commit = self._fetch_git_objects(git_url, git_ref,
+                                                                clone_mode=self.get_option("clone_mode"))
+            self.tree = GitTree(git_repo_path, git_commit)
+        elif source == "archive":
+            # The digest of the archive identifies the version of the files
+            git_repo_path, git_commit = self._fetch_archive(git_url, git_ref, self._get_nav_dir(nav_path))
+        else:
+            git_repo_path = self._clone_git_repo(git_url, git_ref,
+                                                 clone_mode=self.get_option("clone_mode"),
+                                                 sparse_path=self._get_nav_dir(nav_path))
+            git_commit = open_repo(git_repo_path).head.commit.hexsha
+
+        info = {"git_url": git_url, "git_ref": git_ref}
+        if self.tree is not None:
+            # The docs are not checked out, the merger reads them from the object store
+            info.update({"git_repo": self.tree.repo_path, "git_commit": self.tree.commit})
+        return git_repo_path, nav_path, (git_url, git_commit), info
+
+    def _nested_base_dir(self, root_path: str) -> Optional[str]:
+        """
+        Return the directory the local includes of the nested nav are relative to: the root of the checkout.
+        Navs read from the object store have no directory on disk.
+        """
+        return root_path if self.tree is None else None
 
-        # Clone Git repo
-        git_repo_path = self._clone_git_repo(git_url, git_ref)
+    @staticmethod
+    def _describe(node: Tuple[str, Optional[str], str]) -> str:
+        source, commit, path = node
+        if commit is None:
+            return os.path.join(source, path)
+        return f"{source}@{commit[:8]}:{path}"
 
-        # Get nav path
-        nav_file_path = self._get_nav_file_path(git_repo_path, nav_path)
+    def execute(self, *args, **kwargs) -> Tuple[List, List[dict]]:
+        super().execute()
 
-        # Load nav file
-        if nav_file_path is None:
-            nav_config = self._generate_nav(git_repo_path, nav_path)
-        else:
-            nav_config = self._load_nav_file(nav_file_path)
+        try:
+            git_repo_path, nav_path, version, source_info = self._open_source()
+        except IncludeFetchError as e:
+            # Only raised when the build is configured to go on without includes that cannot be fetched
+            log.warning(f"{e} Leaving '{self.string}' out of the nav.")
+            return [], []
+
+        # Reuse what was already loaded and resolved for the same commit in this build
+        memo = getattr(self.resolver, "memo", None)
+        memo_key = (*version, nav_path, str(self.parent), self.resolver.resolve_depth)
+
+        # Includes may be shared by several others, but must not include themselves
+        node = (*version, nav_path)
+        ancestors = getattr(self.resolver, "ancestors", ())
+        if node in ancestors:
+            cycle = " -> ".join(self._describe(ancestor) for ancestor in ancestors[ancestors.index(node):] + (node,))
+            raise IncludeCycleError(f"Include cycle detected: {cycle}")
+        if hasattr(self.resolver, "set_ancestors"):
+            self.resolver.set_ancestors(ancestors + (node,))
+
+        if memo is not None:
+            memoized = memo.get(memo_key)
+            if memoized is not None:
+                return memoized
+
+        nav_config = memo.navs.get(node) if memo is not None else None
+        if nav_config is None:
+            # Get nav path
+            nav_file_path = self._get_nav_file_path(git_repo_path, nav_path)
+
+            # Load nav file
+            if nav_file_path is None:
+                nav_config = self._generate_nav(git_repo_path, nav_path)
+            else:
+                nav_config = self._load_nav_file(nav_file_path)
+            if memo is not None:
+                memo.navs[node] = nav_config
 
         # Resolve nav
+        if hasattr(self.resolver, "set_base_dir"):
+            self.resolver.set_base_dir(self._nested_base_dir(git_repo_path))
         resolved_nav, additional_info = self._resolve_nav_file(nav_config, kwargs.get("parsers", None))
 
         # Get original document directory and sub-directory where the nav file is located
         orig_docs_dir, orig_docs_sub_dir = self._get_docs_dir(nav_config, git_repo_path, nav_path)
 
         # Add additional info
-        additional_info.append({"orig_docs_dir": orig_docs_dir, "orig_docs_sub_dir": orig_docs_sub_dir})
+        info = {"orig_docs_dir": orig_docs_dir, "orig_docs_sub_dir": orig_docs_sub_dir}
+        info.update(source_info)
+        additional_info.append(info)
 
+        if memo is not None:
+            memo.put(memo_key, resolved_nav, additional_info)
         return resolved_nav, additional_info
 
-class IncludeParserPercent(ParserInterface):
-    def __init__(self, resolver, string) -> None:
-        super().__init__(resolver, string)
+class IncludeParserPercent(IncludeParserBang):
+    def __init__(self, resolver, parent, string) -> None:
+        """
+        Initialize IncludeParserPercent object.
 
-    def execute(self, *args, **kwargs) -> Tuple[List, List[dict]]:
-        """Implements the parser using % as pattern"""
-        print(f"IncludeParserPercent executed - {self.resolver} - {self.pattern}")
-        return ["IncludeParserPercent"], [{"alias": "Derp", "docs_dir": "derpio/derp"}]
+        Includes a nav from the local file system without git, e.g. `%include ./services/foo/docs` for the
+        docs of a subdirectory of a monorepo. The path is a nav file or a directory, like the `nav_path` of
+        `!include`, relative to the root of the repository of the nav it is in: the directory of `mkdocs.yml`,
+        or the checkout of a git include.
+        """
+        super().__init__(resolver, parent, string)
+
+    def parse(self, base_dir: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Resolve the path of the include.
+
+        :param base_dir: The directory relative paths start from, defaults to the one of the resolver.
+        :return: The directory the nav_path is relative to, and the nav_path.
+        """
+        path = self.string.strip()
+        if not path:
+            log.error("Missing path in local include.")
+            raise ValueError("Missing path in local include.")
+        if base_dir is None:
+            base_dir = getattr(self.resolver, "base_dir", None)
+        if base_dir is None and not os.path.isabs(path):
+            log.error(f"Unable to include '{path}': local includes are only supported in navs on disk.")
+            raise ValueError(f"Unable to include '{path}': local includes are only supported in navs on disk.")
+
+        base_dir = os.path.abspath(base_dir or os.sep)
+        nav_path = os.path.relpath(os.path.join(base_dir, path), base_dir)
+        return base_dir, nav_path.replace(os.sep, "/")
+
+    def _open_source(self) -> Tuple[str, str, Tuple[str, None], Dict]:
+        base_dir, nav_path = self.parse()
+        if not os.path.exists(os.path.join(base_dir, nav_path)):
+            raise InvalidNavPathError(f"The local include '{self.string}' does not exist in '{base_dir}'.")
+        # The files are merged straight from where they are, the nav is not versioned
+        return base_dir, nav_path, (base_dir, None), {"local": True, "nav_file": os.path.join(base_dir, nav_path)}
+
+    def _nested_base_dir(self, root_path: str) -> Optional[str]:
+        # Nested local includes stay relative to the same repository
+        return root_path
@@ -0,0 +1,68 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+from mkdocs.plugins import get_plugin_logger
+
+log = get_plugin_logger(__name__)
+
+LOCK_VERSION = 1
+
+
+class LockFile:
+    def __init__(self, path: str, shas: Optional[Dict[Tuple[str, str], str]] = None) -> None:
+        """
+        Initialize LockFile object.
+
+        Pins the reference of every include to the commit it resolved to, so builds are reproducible and
+        served from the clone cache without any network access.
+
+        :param path: The path of the lock file.
+        :param shas: The commit SHA of every (git_url, git_ref).
+        """
+        self.path = path
+        self.shas: Dict[Tuple[str, str], str] = dict(shas or {})
+
+    def get(self, git_url: str, git_ref: str) -> Optional[str]:
+        return self.shas.get((git_url, git_ref))
+
+    def __len__(self) -> int:
+        return len(self.shas)
+
+    def save(self) -> None:
+        """
+        Write the lock file, sorted so that it diffs well, replacing the previous one atomically.
+        """
+        includes: Dict[str, Dict[str, str]] = {}
+        for (git_url, git_ref), sha in sorted(self.shas.items()):
+            includes.setdefault(git_url, {})[git_ref] = sha
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": LOCK_VERSION, "includes": includes}, f, indent=2)
+            f.write("\n")
+        os.replace(temp_path, self.path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LockFile"]:
+        """
+        Read a lock file written by `save`.
+
+        :return: The lock file, or None if it does not exist.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error(f"Unable to read the lock file '{path}': {e}")
+            raise SystemExit(1)
+        if data.get("version") != LOCK_VERSION:
+            log.error(f"Unsupported version {data.get('version')} of the lock file '{path}'.")
+            raise SystemExit(1)
+
+        shas = {}
+        for git_url, refs in data["includes"].items():
+            for git_ref, sha in refs.items():
+                shas[(git_url, git_ref)] = sha
+        return cls(path, shas)
@@ -0,0 +1,173 @@
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from mkdocs.plugins import get_plugin_logger
+
+from .git_objects import GitBlob
+
+log = get_plugin_logger(__name__)
+
+MANIFEST_VERSION = 1
+
+# Written in the merged directory
+MANIFEST_FILE = ".ultirepo-manifest.json"
+
+
+class ManifestEntry:
+    """
+    Where a single merged file comes from.
+
+    Entries are slotted and share their interned root, so an entry costs little more than its relative path.
+    """
+    __slots__ = ("root", "path", "blob", "size")
+
+    def __init__(self, root: str, path: str, blob: Optional[str] = None, size: int = -1) -> None:
+        self.root = root
+        self.path = path
+        self.blob = blob
+        self.size = size
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, ManifestEntry) and self.root == other.root and self.path == other.path
+                and self.blob == other.blob)
+
+    def __hash__(self) -> int:
+        return hash((self.root, self.path, self.blob))
+
+    @property
+    def source_path(self) -> str:
+        return os.path.join(self.root, self.path)
+
+
+class Manifest:
+    def __init__(self) -> None:
+        """
+        Initialize Manifest object.
+
+        Indexes every file of the merged docs by its destination, relative to the merged directory
+        with "/" separators like the `src_uri` of MkDocs files, together with the source it is merged from.
+        """
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.roots: Dict[str, bool] = {}
+        self.git_repos: Dict[str, str] = {}
+        self.conflicts: List[Tuple[str, ManifestEntry, ManifestEntry]] = []
+
+    def root(self, path: str, include: bool = True, git_repo: Optional[str] = None) -> str:
+        """
+        Register a source root and return its interned path, to be shared by all its entries.
+
+        :param path: The source directory.
+        :param include: False for the original docs directory.
+        :param git_repo: The object store the files are read from, None for files on disk.
+        """
+        path = sys.intern(path)
+        self.roots[path] = include
+        if git_repo is not None:
+            self.git_repos[path] = git_repo
+        return path
+
+    def add(self, destination: str, root: str, path: str, blob: Optional[str] = None, size: int = -1) -> bool:
+        """
+        Add a file to the manifest.
+
+        :param destination: The destination relative to the merged directory.
+        :param root: The interned source root returned by `root`.
+        :param path: The source path relative to the root.
+        :param blob: The blob id of files read from the object store.
+        :param size: The size of the blob.
+        :return: False if another file already has the destination, the conflict is recorded.
+        """
+        entry = ManifestEntry(root, path, blob, size)
+        existing = self.entries.setdefault(destination, entry)
+        if existing is not entry:
+            self.conflicts.append((destination, existing, entry))
+            return False
+        return True
+
+    def source(self, destination: str) -> Union[str, GitBlob]:
+        """
+        Return the source of a destination: a path on disk, or a `GitBlob` for files read from the object store.
+        """
+        return self._source(self.entries[destination])
+
+    def _source(self, entry: ManifestEntry) -> Union[str, GitBlob]:
+        if entry.blob is None:
+            return entry.source_path
+        return GitBlob(self.git_repos[entry.root], entry.blob, entry.size, entry.source_path)
+
+    def get(self, destination: str) -> Optional[ManifestEntry]:
+        return self.entries.get(destination)
+
+    def is_include(self, destination: str) -> bool:
+        return self.roots[self.entries[destination].root]
+
+    def items(self) -> Iterator[Tuple[str, Union[str, GitBlob]]]:
+        for destination, entry in self.entries.items():
+            yield destination, self._source(entry)
+
+    def includes(self) -> Iterator[Tuple[str, Union[str, GitBlob]]]:
+        """
+        Iterate over the destination and source of every included file, leaving out the original docs.
+        """
+        for destination, entry in self.entries.items():
+            if self.roots[entry.root]:
+                yield destination, self._source(entry)
+
+    def __contains__(self, destination: str) -> bool:
+        return destination in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def save(self, path: str, previous: Optional[str] = None) -> str:
+        """
+        Write the manifest to disk, replacing the previous one atomically.
+
+        Nothing is written when the manifest did not change, so a build that merged nothing new leaves the
+        merged directory untouched, e.g. for `mkdocs serve` watching it.
+
+        :param path: The manifest file.
+        :param previous: What the file holds, as returned by the previous `save` to it.
+        :return: What the file holds now.
+        """
+        root_ids = {root: i for i, root in enumerate(self.roots)}
+        data = {
+            "version": MANIFEST_VERSION,
+            "roots": [[root, include, self.git_repos.get(root)] for root, include in self.roots.items()],
+            "entries": [[destination, root_ids[entry.root], entry.path, entry.blob, entry.size]
+                        for destination, entry in self.entries.items()],
+        }
+        content = json.dumps(data, separators=(",", ":"))
+        if content == previous and os.path.exists(path):
+            return content
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+        return content
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Manifest"]:
+        """
+        Read a manifest written by `save`.
+
+        :return: The manifest, or None if it does not exist or cannot be read.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable merge manifest '{path}': {e}")
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+
+        manifest = cls()
+        roots = [manifest.root(root, include, git_repo) for root, include, git_repo in data["roots"]]
+        for destination, root_id, source_path, blob, size in data["entries"]:
+            manifest.entries[destination] = ManifestEntry(roots[root_id], source_path, blob, size)
+        return manifest
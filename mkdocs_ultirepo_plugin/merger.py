@@ -1,69 +1,534 @@
-import logging
+import errno
+import hashlib
+import os
 import shutil
-from pathlib import Path
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 from tempfile import mkdtemp
 
-from mkdocs.utils import warning_filter
+from mkdocs.exceptions import ConfigurationError
+from mkdocs.plugins import get_plugin_logger
+
+from .cache import lock_file
+from .fingerprint import BUILD_STATE_FILE
+from .git_objects import GitBlob, GitTree, blob_hexsha, open_repo, stream_blob
+from .manifest import MANIFEST_FILE, Manifest
+from .report import BuildReport
+from .watcher import is_within
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = get_plugin_logger(__name__)
+
+LINK_STRATEGIES = ("copy", "hardlink", "symlink", "reflink")
+
+# Number of files placed by a single task of the merge workers
+SYNC_BATCH_SIZE = 64
+
+# ioctl(2) request that clones a file on copy-on-write filesystems (Btrfs, XFS, ...)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+
+def _posix(path):
+    return path if os.sep == "/" else path.replace(os.sep, "/")
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
 
-log = logging.getLogger(__name__)
-log.addFilter(warning_filter)
 
 class Merger:
-    def __init__(self, config, merged_docs_dir=None):
+    def __init__(self, config, merged_docs_dir=None, strategy="copy", copy_patterns=None, compare="mtime",
+                 report=None, workers=4, local_strategy="symlink"):
+        """
+        Initialize Merger object.
+
+        :param config: The MkDocs config.
+        :param merged_docs_dir: The directory where the documentation is merged.
+        :param strategy: How files are placed in the merged directory: "copy", "hardlink", "symlink"
+            or "reflink". Hard links and reflinks fall back to copying when they are not supported.
+        :param copy_patterns: Glob patterns of file names that are always copied, so that writes
+            to the merged file never reach the original.
+        :param compare: How copied files in an existing merged directory are compared with their source:
+            "mtime" compares size and modification time, "hash" compares the content.
+        :param report: The report the files merged for every include are recorded in.
+        :param workers: The number of threads placing files in the merged directory.
+        :param local_strategy: How the files of local includes are placed, they are linked by default since
+            they are not copies in the clone cache but the sources themselves.
+        """
+        for name in (strategy, local_strategy):
+            if name not in LINK_STRATEGIES:
+                raise ValueError(f"Unknown merge strategy '{name}'. Expected one of: {', '.join(LINK_STRATEGIES)}")
         self.orig_docs_dir = config['docs_dir']
-        self.merged_docs_dir = merged_docs_dir or mkdtemp()
-        self.files_source_dir = {}
-
-    def _copy_original(self):
-        orig_docs_path = Path(self.orig_docs_dir)
-        merged_docs_path = Path(self.merged_docs_dir)
-
-        for item in orig_docs_path.iterdir():
-            if item.is_file():
-                shutil.copy2(item, merged_docs_path)
-            elif item.is_dir():
-                shutil.copytree(item, merged_docs_path / item.name)
-
-    def _append(self, orig_docs_dir, orig_docs_sub_dir):
-        orig_docs_dir = Path(orig_docs_dir)
-        orig_docs_sub_dir = Path(orig_docs_sub_dir)
-        source_path = orig_docs_dir / orig_docs_sub_dir
-        for item in source_path.rglob("*"):
-            destination_path = Path(self.merged_docs_dir) / source_path.name / item.relative_to(source_path)
-            # print(self.merged_docs_dir, source_path.name, item.relative_to(source_path))
-
-            if item.is_file():
-                # Skip the nav.yaml file
-                if item.name == "nav.yml" or item.name == "nav.yaml":
-                    continue
-            
-                # Check if the file already exists in the destination
-                if destination_path.exists():
-                    log.error(f"Duplicate file: {item} already exists in the destination directory. Skipping.")
-                    continue
-                    
-                # Make sure the destination directory exists
-                destination_path.parent.mkdir(parents=True, exist_ok=True)
-
-                # Copy the file to the destination path
-                shutil.copy2(item, destination_path)
-
-                # Store the source directory for the copied file
-                self.files_source_dir[str(destination_path)] = { "parent": str(item.parent),
-                                                                "file": str(item.name),
-                                                                "orig_path": str(source_path),
-                                                                "edit_path": "" }
-            elif item.is_dir():
-                # Make sure the destination directory exists
-                destination_path.mkdir(parents=True, exist_ok=True)
-
-    def merge(self, additional_info):
-        # Copy original docs
-        self._copy_original()
-
-        # Copy the rest
+        self.merged_docs_dir = os.path.abspath(merged_docs_dir or mkdtemp())
+        self.manifest = Manifest()
+        self.strategy = strategy
+        self.local_strategy = local_strategy
+        self.copy_patterns = copy_patterns or []
+        self.compare = compare
+        self.report = report or BuildReport()
+        self.workers = max(1, workers)
+        self._unsupported_devices = set()
+        self._planned_dirs = set()
+        self._new_dirs = []
+        self._scans = {}
+        self._marker = os.path.join(self.merged_docs_dir, ".ultirepo-merged")
+        self._manifest_path = os.path.join(self.merged_docs_dir, MANIFEST_FILE)
+        self._own_files = (self._marker, self._manifest_path, os.path.join(self.merged_docs_dir, BUILD_STATE_FILE))
+        self._merge_lock = None
+        # What the manifest file holds since this instance last saved it, and the stat of the file then
+        self._saved_manifest = (None, None)
+
+    def _reflink(self, source, destination):
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+
+    def _place(self, source, destination, strategy):
+        """
+        Place a single file in the merged directory using the strategy returned by `_strategy_for`.
+        """
+        if isinstance(source, GitBlob):
+            with open(destination, "wb") as f:
+                stream_blob(open_repo(source.repo_path), source.hexsha, f)
+            return destination
+
+        if strategy == "symlink":
+            os.symlink(os.path.abspath(source), destination)
+            return destination
+
+        if strategy in ("hardlink", "reflink"):
+            device = os.stat(source).st_dev
+            if device not in self._unsupported_devices and (strategy == "hardlink" or fcntl is not None):
+                try:
+                    if strategy == "hardlink":
+                        os.link(source, destination)
+                    else:
+                        self._reflink(source, destination)
+                    return destination
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+                        raise
+                    log.debug(f"Unable to {strategy} '{source}', falling back to copying: {e}")
+                    self._unsupported_devices.add(device)
+                    if os.path.lexists(destination):
+                        os.remove(destination)
+
+        return shutil.copy2(source, destination)
+
+    def _is_current(self, source, destination, strategy):
+        """
+        Check if a file in the merged directory is still up to date with its source.
+        """
+        try:
+            destination_stat = os.lstat(destination)
+        except FileNotFoundError:
+            return False
+
+        if isinstance(source, GitBlob):
+            return (not os.path.islink(destination) and source.size == destination_stat.st_size
+                    and blob_hexsha(destination) == source.hexsha)
+        if strategy == "symlink":
+            return os.path.islink(destination) and os.readlink(destination) == os.path.abspath(source)
+        if os.path.islink(destination):
+            return False
+
+        source_stat = os.stat(source)
+        if source_stat.st_size != destination_stat.st_size:
+            return False
+        if self.compare == "hash":
+            return _file_digest(source) == _file_digest(destination)
+        return source_stat.st_mtime_ns == destination_stat.st_mtime_ns
+
+    def _strategy_for(self, source, item=None):
+        if isinstance(source, GitBlob):
+            # Blobs have no file to link to, they are always written
+            return "copy"
+        strategy = self.local_strategy if item is not None and item.get("local") else self.strategy
+        if strategy != "copy" and any(fnmatch(os.path.basename(source), pattern) for pattern in self.copy_patterns):
+            return "copy"
+        return strategy
+
+    def _scan_original(self):
+        """
+        Scan the original docs.
+
+        :return: The destination prefix, the (path, blob, size) of every file and the destination of every directory.
+        """
+        orig_docs_dir = self.orig_docs_dir
+        files = []
+        dirs = []
+
+        for root, _, names in os.walk(orig_docs_dir, followlinks=True):
+            relative_root = _posix(os.path.relpath(root, orig_docs_dir))
+            relative_root = "" if relative_root == "." else f"{relative_root}/"
+            if relative_root:
+                dirs.append(relative_root[:-1])
+            for name in names:
+                files.append((relative_root + name, None, -1))
+        return "", files, dirs
+
+    def _scan_include(self, source_path):
+        """
+        Scan the docs of an include.
+
+        :return: The destination prefix, the (path, blob, size) of every file and the destination of every directory.
+        """
+        prefix = f"{os.path.basename(os.path.normpath(source_path))}/"
+        files = []
+        dirs = []
+        # os.scandir knows the type of most entries without a stat call per file
+        stack = [(source_path, "")]
+        while stack:
+            path, relative_root = stack.pop()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    relative = relative_root + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(prefix + relative)
+                        stack.append((entry.path, f"{relative}/"))
+                    elif entry.is_file():
+                        # Skip the nav.yaml file
+                        if entry.name == "nav.yml" or entry.name == "nav.yaml":
+                            continue
+                        files.append((relative, None, -1))
+                    elif entry.is_dir():
+                        # Symlinked directories are not followed
+                        dirs.append(prefix + relative)
+        return prefix, files, dirs
+
+    def _scan_tree(self, source_path, git_repo, git_commit):
+        """
+        Scan the docs of an include that are read from the object store instead of a working tree.
+
+        :return: The destination prefix, the (path, blob, size) of every file and the destination of every directory.
+        """
+        prefix = f"{os.path.basename(source_path)}/"
+        tree = GitTree(git_repo, git_commit)
+        files = []
+        dirs = set()
+        for relative, blob in tree.files(source_path):
+            relative = _posix(relative)
+            # Skip the nav.yaml file
+            if os.path.basename(relative) in ("nav.yml", "nav.yaml"):
+                continue
+            files.append((relative, blob.hexsha, blob.size))
+            parent = os.path.dirname(relative)
+            while parent and prefix + parent not in dirs:
+                dirs.add(prefix + parent)
+                parent = os.path.dirname(parent)
+        return prefix, files, sorted(dirs)
+
+    def _append(self, manifest, root, scan):
+        """
+        Add the files of a scan to the manifest.
+
+        :return: The destinations that were added, leaving out the ones another file already has.
+        """
+        prefix, files, dirs = scan
+        added = []
+        for path, blob, size in files:
+            if manifest.add(prefix + path, root, path, blob, size):
+                added.append(prefix + path)
+        if prefix:
+            dirs = [prefix[:-1], *dirs]
+        new_dirs = [directory for directory in dirs if directory not in self._planned_dirs]
+        self._planned_dirs.update(new_dirs)
+        self._new_dirs.extend(new_dirs)
+        return added
+
+    def _make_dirs(self, dirs):
+        """
+        Create the directories of the merged directory at once, before any file is placed in them,
+        so the workers placing files never have to create their parents.
+        """
+        # Parents sort before their children
+        for directory in sorted(dirs):
+            path = os.path.join(self.merged_docs_dir, directory)
+            try:
+                os.mkdir(path)
+            except FileExistsError:
+                if os.path.islink(path) or not os.path.isdir(path):
+                    # A file that is no longer merged is in the way of a directory
+                    os.remove(path)
+                    os.mkdir(path)
+
+    def _sync(self, planned, item=None):
+        """
+        Bring the merged directory in line with the manifest, only touching files that changed.
+
+        :param planned: The (destination, source) of the files to check.
+        :param item: The include the files belong to, None for the original docs.
+        """
+        start = time.perf_counter()
+        placed = unchanged = placed_bytes = 0
+        for destination, source in planned:
+            destination = os.path.join(self.merged_docs_dir, destination)
+            strategy = self._strategy_for(source, item)
+            if self._is_current(source, destination, strategy):
+                unchanged += 1
+                continue
+
+            if os.path.isdir(destination) and not os.path.islink(destination):
+                shutil.rmtree(destination)
+            elif os.path.lexists(destination):
+                os.remove(destination)
+            self._place(source, destination, strategy)
+            placed += 1
+            placed_bytes += os.lstat(destination).st_size
+        if item is not None:
+            self.report.record(*self._report_key(item), merged_files=placed, merged_bytes=placed_bytes,
+                               unchanged_files=unchanged, merge_seconds=time.perf_counter() - start)
+        return placed, unchanged
+
+    def _clean(self):
+        """
+        Remove files and directories from the merged directory that are not in the manifest.
+        """
+        removed = 0
+        for root, dirs, files in os.walk(self.merged_docs_dir, topdown=False):
+            relative_root = _posix(os.path.relpath(root, self.merged_docs_dir))
+            relative_root = "" if relative_root == "." else f"{relative_root}/"
+            for name in files:
+                path = os.path.join(root, name)
+                if relative_root + name not in self.manifest and path not in self._own_files:
+                    os.remove(path)
+                    removed += 1
+            for name in dirs:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    os.remove(path)
+                elif relative_root + name not in self._planned_dirs and not os.listdir(path):
+                    os.rmdir(path)
+        return removed
+
+    def _remove_stale(self, destinations):
+        """
+        Remove files that are no longer in the manifest, and the directories they leave empty.
+        """
+        removed = 0
+        for destination in destinations:
+            path = os.path.join(self.merged_docs_dir, destination)
+            # A directory may have taken the place of the file
+            if destination in self._planned_dirs or not os.path.lexists(path):
+                continue
+            os.remove(path)
+            removed += 1
+            parent = os.path.dirname(destination)
+            while parent and parent not in self._planned_dirs:
+                path = os.path.join(self.merged_docs_dir, parent)
+                if os.listdir(path):
+                    break
+                os.rmdir(path)
+                parent = os.path.dirname(parent)
+        return removed
+
+    def _check_destination(self):
+        """
+        Make sure the merged directory can be cleaned without destroying anything that was not merged by us.
+        """
+        merged = os.path.realpath(self.merged_docs_dir)
+        orig = os.path.realpath(self.orig_docs_dir)
+        if merged == orig or merged.startswith(orig + os.sep) or orig.startswith(merged + os.sep):
+            raise ConfigurationError(
+                f"The merged docs directory '{self.merged_docs_dir}' must not overlap with the docs directory "
+                f"'{self.orig_docs_dir}'.")
+        os.makedirs(self.merged_docs_dir, exist_ok=True)
+        if os.listdir(self.merged_docs_dir) and not os.path.exists(self._marker):
+            raise ConfigurationError(
+                f"The merged docs directory '{self.merged_docs_dir}' is not empty and was not created by ultirepo.")
+
+    def _begin(self, changed):
+        """
+        Start a new manifest, planning the original docs first.
+
+        :return: The (destination, source) of the original docs that have to be checked.
+        """
+        self._changed = changed
+        self._previous = self.manifest
+        self.manifest = Manifest()
+        self._planned_dirs = set()
+        self._new_dirs = []
+        self._dirty = set()
+        self._seen = set()
+        self._next_scans = {}
+        return self._add_group(os.path.abspath(self.orig_docs_dir), None)
+
+    def _add_group(self, group, item):
+        """
+        Scan the docs of the original docs or an include, and add them to the manifest.
+
+        Groups are added in nav order, so the first file planned for a destination always wins.
+
+        :return: The (destination, source) of the files that have to be checked.
+        """
+        # Includes read from the object store are scanned again when they point to another commit
+        commit = item.get("git_commit") if item is not None else None
+
+        # An include that appears several times in the nav is merged once
+        if (group, commit) in self._seen:
+            return []
+        self._seen.add((group, commit))
+
+        # Reuse the scan of an include that did not change
+        changed = self._changed
+        if (changed is None or group not in self._scans or self._scans[group][0] != commit
+                or any(is_within(path, [group]) for path in changed)):
+            if item is None:
+                scan = self._scan_original()
+            elif commit:
+                scan = self._scan_tree(group, item["git_repo"], commit)
+            else:
+                scan = self._scan_include(group)
+            self._next_scans[group] = (commit, scan)
+            self._dirty.add(group)
+        else:
+            self._next_scans[group] = self._scans[group]
+
+        manifest = self.manifest
+        conflicts = len(manifest.conflicts)
+        root = manifest.root(group, include=item is not None,
+                             git_repo=item.get("git_repo") if item is not None else None)
+        added = self._append(manifest, root, self._next_scans[group][1])
+        for destination, existing, entry in manifest.conflicts[conflicts:]:
+            log.error(f"Duplicate file: {entry.source_path} already exists in the destination directory "
+                      f"as {existing.source_path}. Skipping.")
+        if item is not None:
+            self.report.record(*self._report_key(item), files=len(added),
+                               duplicates=len(manifest.conflicts) - conflicts)
+
+        if changed is not None and group not in self._dirty:
+            # Only look at the files of an unchanged include that were merged from another source before
+            added = [destination for destination in added
+                     if self._previous.get(destination) != manifest.entries[destination]]
+        return [(destination, manifest.source(destination)) for destination in added]
+
+    def _report_key(self, item):
+        return item.get("git_url") or self._group(item), item.get("git_ref")
+
+    def _group(self, item):
+        return os.path.abspath(os.path.join(item.get("orig_docs_dir"), item.get("orig_docs_sub_dir")))
+
+    def plan(self, additional_info, changed=None):
+        """
+        Build the manifest without touching the merged directory, for files that are served from their source.
+
+        :param additional_info: The include information produced by the resolver.
+        :param changed: The files changed since the previous plan by this instance, see `merge`.
+        :return: The manifest of every planned file.
+        """
+        self._begin(changed)
+        for item in additional_info:
+            self._add_group(self._group(item), item)
+        self._scans = self._next_scans
+        return self.manifest
+
+    def start(self, changed=None):
+        """
+        Start merging into the merged directory. Includes are added with `add` while they are resolved,
+        and their files are placed in the background while the next ones are still being resolved.
+
+        Which file is merged to a destination is decided when an include is added, in nav order. The
+        files are then placed by a pool of workers in batches, within and across includes.
+
+        :param changed: The files changed since the previous merge by this instance. Only includes
+            containing one of them are scanned again. None scans and compares everything.
+        """
+        self._check_destination()
+        # Builds of the same site sharing the merged directory merge one after the other
+        if self._merge_lock is not None:
+            self._merge_lock.close()
+        self._merge_lock = lock_file(self._marker)
+        if not self.manifest:
+            self.manifest = Manifest.load(self._manifest_path) or self.manifest
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ultirepo-merge")
+        self._syncs = []
+        self._submit(self._begin(changed))
+
+    def _submit(self, planned, item=None):
+        self._make_dirs(self._new_dirs)
+        self._new_dirs = []
+        for i in range(0, len(planned), SYNC_BATCH_SIZE):
+            self._syncs.append(self._executor.submit(self._sync, planned[i:i + SYNC_BATCH_SIZE], item))
+
+    def add(self, item):
+        """
+        Add the docs of a resolved include to the merge started with `start`.
+
+        :param item: The include information produced by the resolver.
+        """
+        self._submit(self._add_group(self._group(item), item), item)
+
+    def _save_manifest(self):
+        """
+        Save the manifest, unless the file already holds it and no other build has written it since.
+        """
+        content, stat = self._saved_manifest
+        if stat != _stat(self._manifest_path):
+            content = None
+        content = self.manifest.save(self._manifest_path, content)
+        self._saved_manifest = (content, _stat(self._manifest_path))
+
+    def finish(self):
+        """
+        Wait for every file to be placed and remove what is no longer merged.
+
+        The manifest is saved in the merged directory, so the next build removes what disappeared
+        without walking the merged directory.
+
+        :return: The manifest of every merged file and the merged directory.
+        """
+        placed = unchanged = 0
+        try:
+            try:
+                for future in self._syncs:
+                    group_placed, group_unchanged = future.result()
+                    placed += group_placed
+                    unchanged += group_unchanged
+            finally:
+                self._executor.shutdown()
+            self._scans = self._next_scans
+
+            if not self._previous:
+                # Nothing is known about the merged directory, remove everything that is not merged
+                removed = self._clean()
+            else:
+                removed = self._remove_stale([destination for destination in self._previous.entries
+                                              if destination not in self.manifest])
+
+            self._save_manifest()
+        finally:
+            self._merge_lock.close()
+            self._merge_lock = None
+        log.info(f"Merged docs into '{self.merged_docs_dir}': {placed} files updated, "
+                 f"{unchanged} unchanged, {removed} removed.")
+        return self.manifest, self.merged_docs_dir
+
+    def merge(self, additional_info, changed=None):
+        """
+        Merge the original docs and the docs of every include into the merged directory.
+
+        :param additional_info: The include information produced by the resolver.
+        :param changed: The files changed since the previous merge by this instance, see `start`.
+        :return: The manifest of every merged file and the merged directory.
+        """
+        self.start(changed)
         for item in additional_info:
-            orig_docs_dir = item.get("orig_docs_dir")
-            orig_docs_sub_dir = item.get("orig_docs_sub_dir")
-            self._append(orig_docs_dir, orig_docs_sub_dir)
-        return self.files_source_dir, self.merged_docs_dir
+            self.add(item)
+        return self.finish()
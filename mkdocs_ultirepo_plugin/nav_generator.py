@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from mkdocs.plugins import get_plugin_logger
+from mkdocs.utils import dirname_to_title, is_markdown_file
+
+from .git_objects import GitTree
+
+log = get_plugin_logger(__name__)
+
+INDEX_FILES = ("index.md", "README.md")
+NAV_FILES = ("nav.yml", "nav.yaml")
+
+Fingerprint = List[Tuple[str, int, int]]
+
+
+def _sort_key(name: str) -> Tuple[int, str]:
+    # Index pages come first, like MkDocs does for navs it generates itself
+    return (0 if name in INDEX_FILES else 1, name.lower())
+
+
+def _build(files: List[str], dirs: List[Tuple[str, List]], prefix: str) -> List:
+    nav = [prefix + name for name in sorted(files, key=_sort_key)]
+    for name, children in sorted(dirs, key=lambda item: item[0].lower()):
+        if children:
+            nav.append({dirname_to_title(name): children})
+    return nav
+
+
+class NavGenerator:
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        """
+        Initialize NavGenerator object.
+
+        Generates the nav of an include that has no nav file from its directory tree. Generated
+        navs are cached with a fingerprint of the directories they were generated from, and kept
+        on disk when a cache directory is given.
+
+        :param cache_dir: The directory where generated navs are kept between builds.
+        """
+        self.cache_dir = os.path.join(cache_dir, "navs") if cache_dir else None
+        self._navs: Dict[str, Tuple[object, List]] = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, path: str, prefix: str, fingerprint: Fingerprint) -> List:
+        """
+        Generate the nav of a directory on disk with os.scandir.
+
+        Only directories are part of the fingerprint: a file that is added, removed or renamed
+        changes the modification time of its directory, and the content of a file does not
+        change the nav.
+        """
+        stat = os.stat(path)
+        fingerprint.append((prefix, stat.st_ino, stat.st_mtime_ns))
+
+        files = []
+        dirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    dirs.append((entry.name, self._scan(entry.path, f"{prefix}{entry.name}/", fingerprint)))
+                elif entry.name not in NAV_FILES and is_markdown_file(entry.name):
+                    files.append(entry.name)
+        return _build(files, dirs, prefix)
+
+    def _scan_tree(self, tree: GitTree, path: str, prefix: str) -> List:
+        """
+        Generate the nav of a directory of a git tree.
+        """
+        files = []
+        dirs = []
+        for name, is_dir in tree.listdir(path):
+            if name.startswith("."):
+                continue
+            if is_dir:
+                dirs.append((name, self._scan_tree(tree, f"{path}/{name}", f"{prefix}{name}/")))
+            elif name not in NAV_FILES and is_markdown_file(name):
+                files.append(name)
+        return _build(files, dirs, prefix)
+
+    def _is_current(self, path: str, fingerprint: Fingerprint) -> bool:
+        for prefix, inode, mtime_ns in fingerprint:
+            try:
+                stat = os.stat(os.path.join(path, prefix))
+            except OSError:
+                return False
+            if stat.st_ino != inode or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def _cache_file(self, key: str) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.json")
+
+    def _load(self, key: str) -> Optional[Tuple[object, List]]:
+        cache_file = self._cache_file(key)
+        if cache_file is None:
+            return None
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        fingerprint = data["fingerprint"]
+        if isinstance(fingerprint, list):
+            fingerprint = [tuple(item) for item in fingerprint]
+        return fingerprint, data["nav"]
+
+    def _store(self, key: str, fingerprint: object, nav: List) -> None:
+        with self._lock:
+            self._navs[key] = (fingerprint, nav)
+        cache_file = self._cache_file(key)
+        if cache_file is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Builds sharing the cache may store the same nav concurrently, the last complete file wins
+        fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"key": key, "fingerprint": fingerprint, "nav": nav}, f)
+        os.replace(temp_file, cache_file)
+
+    def generate(self, path: str, tree: Optional[GitTree] = None) -> List:
+        """
+        Generate the nav of a directory: its Markdown files, index pages first, then a section per
+        subdirectory. Directories without any Markdown file are left out.
+
+        :param path: The directory, on disk or below the repository path of `tree`.
+        :param tree: The git tree to read the directory from instead of the disk.
+        :return: The nav, with paths relative to the directory.
+        """
+        path = os.path.abspath(path)
+        if tree is not None:
+            # The id of a git tree already is a fingerprint of everything below it
+            key = f"{tree.repo_path}:{tree.relative(path)}"
+            tree_id = tree.tree_id(path)
+            cached = self._navs.get(key) or self._load(key)
+            if cached is not None and cached[0] == tree_id:
+                self._navs[key] = cached
+                return cached[1]
+            nav = self._scan_tree(tree, path, "")
+            self._store(key, tree_id, nav)
+            return nav
+
+        cached = self._navs.get(path) or self._load(path)
+        if cached is not None and self._is_current(path, cached[0]):
+            log.debug(f"Reusing the generated nav of '{path}'.")
+            self._navs[path] = cached
+            return cached[1]
+
+        fingerprint: Fingerprint = []
+        nav = self._scan(path, "", fingerprint)
+        log.debug(f"Generated the nav of '{path}' from {len(fingerprint)} directories.")
+        self._store(path, fingerprint, nav)
+        return nav
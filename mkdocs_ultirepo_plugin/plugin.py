@@ -1,17 +1,32 @@
-import json
+import cProfile
+import os
 from typing import Any, Callable, Literal, Optional
 
-import yaml
 from mkdocs.config.base import Config
+from mkdocs.config.config_options import Choice as MkChoice
 from mkdocs.config.config_options import Type as MkType
 from mkdocs.config.defaults import MkDocsConfig
 from mkdocs.exceptions import ConfigurationError
 from mkdocs.livereload import LiveReloadServer
-from mkdocs.plugins import BasePlugin
+from mkdocs.plugins import BasePlugin, get_plugin_logger
+from mkdocs.structure.files import File, Files
 
+from .archive import DEFAULT_ARCHIVE_URL
+from .cache import CloneCache
+from .fetch_policy import FETCH_FAILURE_MODES, FetchPolicy
+from .fingerprint import BuildFingerprint
+from .git_objects import INCLUDE_SOURCES, GitBlob, read_blob
 from .include_parsers import IncludeParserBang, IncludeParserPercent
-from .merger import Merger
+from .lockfile import LockFile
+from .manifest import MANIFEST_FILE, Manifest
+from .merger import LINK_STRATEGIES, Merger
+from .nav_generator import NavGenerator
+from .prefetch import Prefetcher
+from .report import BuildReport
 from .resolver import Resolver
+from .watcher import IncludeWatcher, source_dirs
+
+log = get_plugin_logger(__name__)
 
 
 class UltirepoPlugin(BasePlugin):
@@ -20,7 +35,10 @@ class UltirepoPlugin(BasePlugin):
 
     This plugin defines the following event hooks:
 
+    - `on_startup`
     - `on_config`
+    - `on_files`
+    - `on_serve`
 
     Check the [Developing Plugins](https://www.mkdocs.org/user-guide/plugins/#developing-plugins) page of `mkdocs`
     for more information about its plugin system.
@@ -28,43 +46,302 @@ class UltirepoPlugin(BasePlugin):
 
     config_scheme: tuple[tuple[str, MkType]] = (
         ("resolve_max_depth", MkType(int, default=1)),
-        ("docs_destination_dir", MkType(str, default=None))
+        ("docs_destination_dir", MkType(str, default=None)),
+        ("prefetch_workers", MkType(int, default=4)),
+        ("cache_dir", MkType(str, default=None)),
+        ("cache_max_size", MkType(int, default=0)),
+        ("cache_max_age", MkType(int, default=30)),
+        ("clone_mode", MkChoice(("full", "shallow", "partial", "sparse"), default="full")),
+        ("include_source", MkChoice(INCLUDE_SOURCES, default="checkout")),
+        ("archive_url", MkType(str, default=DEFAULT_ARCHIVE_URL)),
+        ("merge_strategy", MkChoice(LINK_STRATEGIES, default="copy")),
+        ("local_merge_strategy", MkChoice(LINK_STRATEGIES, default="symlink")),
+        ("merge_copy_patterns", MkType(list, default=["*.md"])),
+        ("merge_compare", MkChoice(("mtime", "hash"), default="mtime")),
+        ("merge_workers", MkType(int, default=4)),
+        ("virtual_files", MkType(bool, default=False)),
+        ("report_file", MkType(str, default=None)),
+        ("profile_file", MkType(str, default=None)),
+        ("lock_file", MkType(str, default=None)),
+        ("lock_update", MkType(bool, default=False)),
+        ("fetch_timeout", MkType((int, float), default=0)),
+        ("fetch_retries", MkType(int, default=0)),
+        ("fetch_backoff", MkType((int, float), default=1)),
+        ("fetch_deadline", MkType((int, float), default=0)),
+        ("fetch_failure", MkChoice(FETCH_FAILURE_MODES, default="fail")),
+        ("build_fingerprint", MkType(bool, default=True))
     )
 
     def __init__(self) -> None:
         self.original_docs_dir = None
-        self.parsers = [("!include", IncludeParserBang)]
+        self.parsers = [("!include", IncludeParserBang), ("%include", IncludeParserPercent)]
+        self.is_serve = False
+        self.server = None
+        self.watcher = IncludeWatcher()
+        self.prefetcher = None
+        self.nav_generator = None
+        self.merger = None
+        self.additional_info = []
+        self.manifest = None
+        self.virtual_files = {}
+        self.report = BuildReport()
+        self._state_config = None
+
+    def on_startup(self, *, command: Literal['build', 'gh-deploy', 'serve'], dirty: bool) -> None:
+        # Defining on_startup keeps this instance, and everything it caches, alive between the builds of `mkdocs serve`
+        self.is_serve = command == "serve"
+
+    def _reuse_state(self, config: MkDocsConfig) -> Optional[set]:
+        """
+        Decide what can be reused from the previous build of `mkdocs serve`.
+
+        :return: The files changed since the previous build, or None if everything has to be rebuilt.
+        """
+        state_config = (dict(self.config), config['docs_dir'])
+        if not self.is_serve or self.prefetcher is None or state_config != self._state_config:
+            self._state_config = state_config
+            self.watcher = IncludeWatcher()
+            self._release_cache()
+            self.prefetcher = None
+            self.merger = None
+            return None
+        return self.watcher.invalidate()
+
+    def _project_path(self, config: MkDocsConfig, path: str) -> str:
+        if config.config_file_path:
+            return os.path.join(os.path.dirname(config.config_file_path), path)
+        return path
+
+    def _merged_docs_dir(self, config: MkDocsConfig) -> Optional[str]:
+        if self.config["virtual_files"]:
+            # Nothing is written, the planned destinations are relative to the original docs
+            return config['docs_dir']
+        merged_docs_dir = self.config["docs_destination_dir"]
+        if merged_docs_dir is not None and config.config_file_path:
+            merged_docs_dir = os.path.join(os.path.dirname(config.config_file_path), merged_docs_dir)
+        return merged_docs_dir
+
+    def _build_fingerprint(self, config: MkDocsConfig) -> Optional[BuildFingerprint]:
+        """
+        Return the fingerprint of the build when its results can be reused by the next one: they are merged
+        into a persistent directory, and the commits of the includes are not being updated. `mkdocs serve`
+        already rebuilds only what changed.
+        """
+        if (not self.config["build_fingerprint"] or self.is_serve or self.config["virtual_files"]
+                or self.config["docs_destination_dir"] is None or self.config["lock_update"]):
+            return None
+        # A build without its lock file yet writes it
+        if self.config["lock_file"] and self.prefetcher.lock_file is None:
+            return None
+        return BuildFingerprint(os.path.abspath(self._merged_docs_dir(config)))
+
+    def _reuse_build(self, config: MkDocsConfig, fingerprint: BuildFingerprint, config_key: str) -> bool:
+        """
+        Reuse the resolved nav and merged docs of the previous build when none of its inputs changed.
+
+        :return: True if the previous build was reused, and the config updated with its results.
+        """
+        previous = fingerprint.load()
+        if previous is None or previous["config_key"] != config_key:
+            return False
+        includes = fingerprint.includes()
+        if self.prefetcher.cache is not None:
+            # Keeps the sources of the merged files from being evicted by other builds while they are checked
+            for git_url in {include[0] for include in includes}:
+                self.prefetcher.cache.entry_dir(git_url)
+        if not fingerprint.matches(config_key, self.prefetcher.resolve_versions(includes)):
+            return False
+        manifest = Manifest.load(os.path.join(fingerprint.merged_docs_dir, MANIFEST_FILE))
+        if manifest is None:
+            return False
+
+        config["nav"] = previous["nav"]
+        self.additional_info = previous["additional_info"]
+        self.manifest = manifest
+        config["docs_dir"] = fingerprint.merged_docs_dir
+        log.info(f"Nothing changed since the previous build, reusing its nav and the docs merged into "
+                 f"'{fingerprint.merged_docs_dir}'.")
+        return True
 
     def on_config(self, config: MkDocsConfig) -> Config | None:
-        resolve_max_depth = 1
+        self.report = BuildReport()
+        profiler = None
+        if self.config["profile_file"]:
+            # Only the main thread is profiled, clones and file placement in the worker threads show up as waits
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return self._on_config(config)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile_file = self._project_path(config, self.config["profile_file"])
+                profiler.dump_stats(profile_file)
+                log.info(f"Wrote the profile of the build to '{profile_file}'.")
+            log.debug(f"Build report: {self.report.summary()}")
+            if self.config["report_file"]:
+                report_file = self._project_path(config, self.config["report_file"])
+                self.report.save(report_file)
+                log.info(f"Wrote the build report to '{report_file}'.")
+
+    def _on_config(self, config: MkDocsConfig) -> Config | None:
+        resolve_max_depth = self.config["resolve_max_depth"]
+        self.virtual_files = {}
         if not config.get("nav"):
             return config
 
         # setting originalDocsDir means that on_config has been run
         self.original_docs_dir = config['docs_dir']
+        changed = self._reuse_state(config)
+        project_dir = os.path.abspath(self._project_path(config, "."))
+
+        # Pin every include to the commit in the lock file, unless the lock file is being updated
+        lock_file_path = None
+        if self.config["lock_file"]:
+            lock_file_path = self._project_path(config, self.config["lock_file"])
+
+        # Clone all included repositories concurrently in the background
+        cache = None
+        if self.prefetcher is None:
+            lock_file = None
+            if lock_file_path is not None and not self.config["lock_update"]:
+                lock_file = LockFile.load(lock_file_path)
+                if lock_file is not None:
+                    log.info(f"Building the {len(lock_file)} includes locked in '{lock_file_path}' "
+                             f"from the clone cache.")
+            cache = CloneCache(cache_dir=self.config["cache_dir"],
+                               max_size=self.config["cache_max_size"],
+                               max_age=self.config["cache_max_age"])
+            self.prefetcher = Prefetcher(self.parsers,
+                                         max_workers=self.config["prefetch_workers"],
+                                         resolve_max_depth=resolve_max_depth,
+                                         cache=cache,
+                                         clone_mode=self.config["clone_mode"],
+                                         source=self.config["include_source"],
+                                         lock_file=lock_file,
+                                         archive_url=self.config["archive_url"],
+                                         fetch_failure=self.config["fetch_failure"])
+            # Generated navs are kept next to the clones, and only generated again when their directory changed
+            self.nav_generator = NavGenerator(cache_dir=cache.cache_dir)
+        self.prefetcher.report = self.report
+        self.prefetcher.forget_failures()
+        # The deadline bounds the fetches of every build, it starts now
+        self.prefetcher.policy = FetchPolicy(timeout=self.config["fetch_timeout"],
+                                             retries=self.config["fetch_retries"],
+                                             backoff=self.config["fetch_backoff"],
+                                             deadline=self.config["fetch_deadline"])
+
+        # Skip resolving and merging when nothing changed since the previous build
+        fingerprint = self._build_fingerprint(config)
+        if fingerprint is not None:
+            config_key = BuildFingerprint.config_key(config['nav'], dict(self.config), config['docs_dir'])
+            with self.report.phase("fingerprint"):
+                if self._reuse_build(config, fingerprint, config_key):
+                    return config
+                # The merged directory no longer matches the state until this build completes
+                fingerprint.discard()
+
+        prefetch = self.prefetcher.start(config['nav'], base_dir=project_dir)
+
+        # Generate a new "docs" directory, or update the persistent one
+        if self.merger is None:
+            self.merger = Merger(config=config,
+                                 merged_docs_dir=self._merged_docs_dir(config),
+                                 strategy=self.config["merge_strategy"],
+                                 local_strategy=self.config["local_merge_strategy"],
+                                 copy_patterns=self.config["merge_copy_patterns"],
+                                 compare=self.config["merge_compare"],
+                                 workers=self.config["merge_workers"])
+        self.merger.report = self.report
 
         # Parse the nav and handle all import statements
 
         resolver = Resolver(resolve_max_depth=resolve_max_depth)
         resolver.set_parsers(self.parsers)
-        resolved_nav, additional_info = resolver.resolve(config['nav'])
+        resolver.set_prefetcher(self.prefetcher)
+        resolver.set_nav_generator(self.nav_generator)
+        # Local includes of mkdocs.yml are relative to its directory
+        resolver.set_base_dir(project_dir)
+        if self.is_serve:
+            resolver.set_include_cache(self.watcher)
+        if not self.config["virtual_files"]:
+            # Every include is merged while the includes after it are still being cloned and resolved
+            self.merger.start(changed=changed)
+            resolver.set_include_callback(self.merger.add)
+        with self.report.phase("resolve"):
+            resolved_nav, additional_info = resolver.resolve(config['nav'])
+        with self.report.phase("prefetch_wait"):
+            prefetch.result()
+        self.additional_info = additional_info
 
         config["nav"] = resolved_nav
-        print(config["nav"])
+        log.debug(f"Resolved nav: {config['nav']}")
+
+        with self.report.phase("merge"):
+            if self.config["virtual_files"]:
+                # Leave the docs_dir alone, the included files are added to the site in on_files
+                self.manifest = self.merger.plan(additional_info=additional_info, changed=changed)
+                self.virtual_files = dict(self.manifest.includes())
+                temp_docs_dir = config['docs_dir']
+            else:
+                self.manifest, temp_docs_dir = self.merger.finish()
+
+        # Write the lock file when it is updated, or when there is none yet
+        if lock_file_path is not None and self.prefetcher.lock_file is None:
+            lock_file = LockFile(lock_file_path, self.prefetcher.commits())
+            lock_file.save()
+            log.info(f"Locked {len(lock_file)} includes in '{lock_file_path}'.")
 
-        # Generate a new "docs" directory
-        merger = Merger(config=config)
-        merged, temp_docs_dir  = merger.merge(additional_info=additional_info)
+        # Let the next build reuse this one, unless includes were missing from it
+        if fingerprint is not None and not self.report.degraded():
+            fingerprint.save(config_key, self.prefetcher.commits(), self.prefetcher.archives,
+                             config['docs_dir'], resolved_nav, additional_info)
 
-        # print("### Resolver")
-        # print(yaml.dump(resolved_nav, sort_keys=False, indent=2))
-        # print(additional_info)
-        # print("")
-        # print("")
-        # print("### Merger")
-        # print(json.dumps(merged, sort_keys=False, indent=2))
+        # Keep the clone cache within its limits
+        if cache is not None:
+            with self.report.phase("evict"):
+                cache.evict()
 
         # Update the docs_dir with our temporary one
         config["docs_dir"] = temp_docs_dir
 
+        # Watch the sources of includes that were added since the server started
+        if self.server is not None:
+            self.watcher.watch(self.server, self._source_dirs())
+
         return config
+
+    def on_files(self, files: Files, config: MkDocsConfig) -> Files | None:
+        # Add the included files straight from their checkout, or from memory when they are read from git objects
+        for src_uri, source in self.virtual_files.items():
+            if files.get_file_from_path(src_uri) is not None:
+                continue
+            if isinstance(source, GitBlob):
+                file = File.generated(config, src_uri, content=read_blob(source.repo_path, source.hexsha))
+            else:
+                file = File.generated(config, src_uri, abs_src_path=source)
+            files.append(file)
+        return files
+
+    def _source_dirs(self) -> set:
+        return {self.original_docs_dir} | source_dirs(self.additional_info)
+
+    def on_serve(self, server: LiveReloadServer, config: MkDocsConfig, builder: Callable) -> LiveReloadServer:
+        # Rebuild when the original docs or the sources of an include change,
+        # only the includes containing the changed files are resolved and merged again
+        self.server = server
+        self.watcher.watch(server, self._source_dirs())
+        # MkDocs watches the docs_dir, which is the merged directory: merging a change into it must not
+        # trigger another build
+        merged_docs_dir = os.path.abspath(config['docs_dir'])
+        if self.original_docs_dir is not None and merged_docs_dir != os.path.abspath(self.original_docs_dir):
+            server.unwatch(merged_docs_dir)
+        return server
+
+    def _release_cache(self) -> None:
+        # Let other builds sharing the clone cache evict the repositories used by this one
+        if self.prefetcher is not None and self.prefetcher.cache is not None:
+            self.prefetcher.cache.close()
+
+    def on_shutdown(self) -> None:
+        self._release_cache()
@@ -0,0 +1,665 @@
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from tempfile import mkdtemp
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+import git
+from mkdocs.exceptions import PluginError
+from mkdocs.plugins import get_plugin_logger
+
+from .archive import DEFAULT_ARCHIVE_URL, GitArchive, archive_url
+from .cache import CloneCache
+from .exceptions import IncludeFetchError, InvalidNavPathError
+from .fetch_policy import FETCH_FAILURE_MODES, FetchPolicy
+from .git_clone import CLONE_MODES, GitClone
+from .git_objects import GitTree, open_repo
+from .include_parsers import IncludeParserBang, IncludeParserPercent
+from .lockfile import LockFile
+from .report import BuildReport
+
+log = get_plugin_logger(__name__)
+
+
+class Prefetcher:
+    def __init__(self, parsers, max_workers: int = 4, resolve_max_depth: int = 1, clone_dir: str = None,
+                 cache: CloneCache = None, clone_mode: str = "full", source: str = "checkout",
+                 report: BuildReport = None, lock_file: LockFile = None,
+                 archive_url: str = DEFAULT_ARCHIVE_URL, policy: FetchPolicy = None,
+                 fetch_failure: str = "fail") -> None:
+        """
+        Initialize Prefetcher object.
+
+        :param parsers: The (pattern, parser) pairs used by the resolver.
+        :param max_workers: The maximum number of repositories cloned concurrently.
+        :param resolve_max_depth: The maximum include depth that is scanned for nested includes, 0 for no limit.
+        :param clone_dir: The directory where the git repositories will be cloned when no cache is used.
+        :param cache: The persistent clone cache to clone into and update.
+        :param clone_mode: The clone mode used for includes that do not set the `clone_mode` query parameter.
+        :param source: The source used for includes that do not set the `source` query parameter:
+            "checkout" clones a working tree, "objects" only fetches into a shared object store and "archive"
+            extracts an archive of the reference.
+        :param report: The report every clone and fetch is recorded in.
+        :param lock_file: The lock file pinning every include to a commit. Locked includes are served from the
+            clone cache without any network access, and including a reference that is not locked fails.
+        :param archive_url: The template of the URL of the archive of a reference, see `archive.archive_url`.
+        :param policy: The timeouts, retries and deadline of every clone, fetch and download.
+        :param fetch_failure: What happens to an include that cannot be fetched within the policy: "fail" ends
+            the build, "cached" uses what the clone cache still holds of it, and "omit" (or "cached" when
+            nothing is cached) leaves it out of the nav.
+        """
+        if fetch_failure not in FETCH_FAILURE_MODES:
+            raise ValueError(f"Unknown fetch failure mode '{fetch_failure}'. "
+                             f"Expected one of: {', '.join(FETCH_FAILURE_MODES)}")
+        self.parsers = parsers
+        self.max_workers = max(1, max_workers)
+        self.resolve_max_depth = resolve_max_depth
+        self.cache = cache
+        self.clone_dir = clone_dir if cache is None else cache.cache_dir
+        if self.clone_dir is None:
+            self.clone_dir = mkdtemp(prefix="ultirepo_")
+        self.clone_mode = clone_mode
+        self.source = source
+        self.report = report or BuildReport()
+        self.lock_file = lock_file
+        self.archive_url = archive_url
+        self.policy = policy or FetchPolicy()
+        self.fetch_failure = fetch_failure
+        self.checkouts: Dict[Tuple[str, str], str] = {}
+        self.objects: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.archives: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._archive_urls: Dict[Tuple[str, str], str] = {}
+        self._wanted: Dict[Tuple[str, str], Tuple[str, Set[str]]] = {}
+        self._applied: Dict[Tuple[str, str], Tuple[str, FrozenSet[str]]] = {}
+        self._requested_refs: Dict[str, Set[str]] = defaultdict(set)
+        self._resolved_refs: Dict[str, Dict[str, Optional[str]]] = defaultdict(dict)
+        self._remote_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._futures: Dict[Tuple[str, str, str], Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ultirepo")
+        self._lock = threading.Lock()
+
+    def _find_includes(self, nav: Union[str, List, Dict]) -> List[IncludeParserBang]:
+        """
+        Find all git based and local include directives in a nav.
+
+        :param nav: The nav (or part of a nav) to scan.
+        :return: A parser for every include directive found, in nav order.
+        """
+        includes = []
+        stack = [nav]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                stack.extend(reversed(list(item.values())))
+            elif isinstance(item, list):
+                stack.extend(reversed(item))
+            elif isinstance(item, str):
+                parser = None
+                for pattern, parser_cls in self.parsers:
+                    if item.startswith(pattern):
+                        parser = parser_cls
+                if parser is None or not issubclass(parser, IncludeParserBang):
+                    continue
+                includes.append(parser(None, None, item.split(" ", 1)[1]))
+        return includes
+
+    def _want(self, key: Tuple[str, str], clone_mode: Optional[str], sparse_path: Optional[str]) -> None:
+        """
+        Record the clone mode and sparse path an include needs.
+
+        A checkout shared by several includes is only ever widened, so the widest clone mode and the
+        union of all sparse paths is kept.
+        """
+        clone_mode = clone_mode or self.clone_mode
+        if clone_mode not in CLONE_MODES:
+            raise ValueError(f"Unknown clone mode '{clone_mode}'. Expected one of: {', '.join(CLONE_MODES)}")
+        with self._lock:
+            self._requested_refs[key[0]].add(key[1])
+            wanted_mode, sparse_paths = self._wanted.get(key, (clone_mode, set()))
+            if CLONE_MODES[clone_mode] > CLONE_MODES[wanted_mode]:
+                wanted_mode = clone_mode
+            if sparse_path is not None:
+                sparse_paths.add(sparse_path)
+            self._wanted[key] = (wanted_mode, sparse_paths)
+
+    def _ensure(self, key: Tuple[str, str]) -> None:
+        """
+        Widen an existing checkout when includes processed after it was cloned need more of the tree.
+        """
+        with self._lock:
+            clone_mode, sparse_paths = self._wanted[key]
+            wanted = (clone_mode, frozenset(sparse_paths))
+            if self._applied.get(key) == wanted:
+                return
+            self._applied[key] = wanted
+            git_repo_path = self.checkouts[key]
+            remote_lock = self._remote_locks[key[0]]
+        log.debug(f"Updating checkout of '{key[0]}' at '{key[1]}' to {clone_mode} {sorted(sparse_paths)}")
+        with remote_lock:
+            git_clone = GitClone(target_dir=os.path.dirname(git_repo_path), offline=self.lock_file is not None,
+                                 policy=self.policy)
+            git_clone.configure_checkout(git_repo_path, clone_mode, sparse_paths)
+
+    def _resolve_ref(self, git_url: str, git_ref: str) -> Optional[str]:
+        """
+        Resolve a reference to the commit it points to.
+
+        All references requested for the remote so far are resolved together, so a remote
+        costs a single ls-remote no matter how many of its references are included.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :return: The commit SHA, or None if it could not be resolved.
+        """
+        if GitClone._is_full_sha(git_ref):
+            return git_ref
+
+        with self._lock:
+            remote_lock = self._remote_locks[git_url]
+        with remote_lock:
+            return self._resolve_ref_locked(git_url, git_ref)
+
+    def _resolve_ref_locked(self, git_url: str, git_ref: str) -> Optional[str]:
+        """
+        Resolve a reference like `_resolve_ref`, while the lock of its remote is already held.
+        """
+        with self._lock:
+            resolved = self._resolved_refs[git_url]
+            if git_ref in resolved:
+                return resolved[git_ref]
+            git_refs = sorted((self._requested_refs[git_url] | {git_ref}) - set(resolved))
+        try:
+            shas = self.policy.run(f"list the references of '{git_url}'",
+                                   lambda timeout: GitClone.ls_remote(git_url, git_refs, timeout=timeout),
+                                   errors=(git.GitCommandError,))
+            log.debug(f"Resolved {len(git_refs)} references of '{git_url}' with one ls-remote.")
+        except IncludeFetchError as e:
+            log.warning(str(e))
+            shas = dict.fromkeys(git_refs)
+        with self._lock:
+            resolved.update(shas)
+            return resolved[git_ref]
+
+    def _locked_sha(self, git_url: str, git_ref: str) -> str:
+        sha = self.lock_file.get(git_url, git_ref)
+        if sha is None:
+            log.error(f"'{git_ref}' of '{git_url}' is not in the lock file '{self.lock_file.path}'. "
+                      f"Update the lock file to add it.")
+            raise SystemExit(1)
+        return sha
+
+    def _expected_sha(self, git_url: str, git_ref: str, target_dir: str) -> Optional[str]:
+        if self.lock_file is not None:
+            return self._locked_sha(git_url, git_ref)
+        # Resolving the reference only pays off when there is a clone that may already be up to date
+        return self._resolve_ref(git_url, git_ref) if os.path.isdir(target_dir) else None
+
+    def _fetched_meanwhile(self, git_url: str, git_ref: str, target_dir: str,
+                           expected_sha: Optional[str]) -> Optional[str]:
+        """
+        Resolve a reference that was not resolved because the object store did not exist yet, once another
+        build sharing the cache may have fetched it. Must be called with the locks of the remote held.
+
+        :return: The commit the reference is expected at, or None if it still has to be fetched blindly.
+        """
+        if expected_sha is not None or self.cache is None or not os.listdir(target_dir):
+            return expected_sha
+        return self._resolve_ref_locked(git_url, git_ref)
+
+    def _clone(self, git_url: str, git_ref: str) -> str:
+        """
+        Check out a single reference in its own worktree of the object store of its remote.
+
+        All references of a remote are fetched into one object store, so including several versions of a
+        repository costs one object database, and only what the other versions do not share is fetched.
+
+        :param git_url: The URL of the git repository to clone.
+        :param git_ref: The git reference to checkout after cloning.
+        :return: The path to the worktree.
+        """
+        key = (git_url, git_ref)
+        with self._lock:
+            clone_mode, sparse_paths = self._wanted.get(key, (self.clone_mode, set()))
+            self._applied[key] = (clone_mode, frozenset(sparse_paths))
+            remote_lock = self._remote_locks[git_url]
+
+        store_dir = self._store_dir(git_url)
+        worktree_dir = self._worktree_dir(git_url, git_ref)
+        start = time.perf_counter()
+        expected_sha = self._expected_sha(git_url, git_ref, store_dir)
+        git_clone = GitClone(target_dir=store_dir, offline=self.lock_file is not None, policy=self.policy)
+        # Fetching and adding worktrees change the object store, only the checkouts run concurrently. Another
+        # build sharing the cache waits for the fetch, and skips its own when the commit is then in the store.
+        with remote_lock, self._cache_lock(git_url):
+            expected_sha = self._fetched_meanwhile(git_url, git_ref, store_dir, expected_sha)
+            store_path, sha = git_clone.fetch_objects(git_url, git_ref, clone_mode=clone_mode,
+                                                      expected_sha=expected_sha,
+                                                      filter_blobs=clone_mode in ("partial", "sparse"))
+            git_repo_path, added = git_clone.add_worktree(store_path, worktree_dir, git_url, sha)
+        with self._cache_lock(git_url, os.path.basename(worktree_dir)):
+            git_clone.configure_checkout(git_repo_path, clone_mode, sorted(sparse_paths))
+            checked_out = git_clone.checkout_worktree(git_repo_path, git_url, sha, added=added)
+        elapsed = time.perf_counter() - start
+        if checked_out:
+            git_clone.report(git_repo_path, git_url, git_ref, clone_mode, elapsed)
+        self.report.record(git_url, git_ref, source="checkout", clone_mode=clone_mode,
+                           clone_seconds=elapsed, **git_clone.stats)
+        return git_repo_path
+
+    def _worktree_dir(self, git_url: str, git_ref: str) -> str:
+        if self.cache is not None:
+            return self.cache.checkout_dir(git_url, git_ref)
+        key_hash = hashlib.sha1(f"{git_url}@{git_ref}".encode()).hexdigest()[:12]
+        return os.path.join(self.clone_dir, key_hash)
+
+    def _cache_lock(self, git_url: str, name: str = "objects"):
+        """
+        Lock a part of the clone cache against other builds sharing it, see `CloneCache.lock`.
+        """
+        if self.cache is None:
+            return nullcontext()
+        return self.cache.lock(git_url, name)
+
+    def _store_dir(self, git_url: str) -> str:
+        if self.cache is not None:
+            return self.cache.objects_dir(git_url)
+        return os.path.join(self.clone_dir, hashlib.sha1(git_url.encode()).hexdigest()[:12])
+
+    def _fetch_objects(self, git_url: str, git_ref: str) -> Tuple[str, str]:
+        """
+        Fetch a single reference into the object store of its remote, without checking it out.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference to fetch.
+        :return: The path to the object store and the commit the reference points to.
+        """
+        key = (git_url, git_ref)
+        with self._lock:
+            clone_mode, _ = self._wanted.get(key, (self.clone_mode, set()))
+            remote_lock = self._remote_locks[git_url]
+
+        target_dir = self._store_dir(git_url)
+        start = time.perf_counter()
+        expected_sha = self._expected_sha(git_url, git_ref, target_dir)
+        git_clone = GitClone(target_dir=target_dir, offline=self.lock_file is not None, policy=self.policy)
+        # All references of a remote share one object store, which git does not allow to be fetched into concurrently
+        with remote_lock, self._cache_lock(git_url):
+            expected_sha = self._fetched_meanwhile(git_url, git_ref, target_dir, expected_sha)
+            result = git_clone.fetch_objects(git_url, git_ref, clone_mode=clone_mode, expected_sha=expected_sha)
+        self.report.record(git_url, git_ref, source="objects", clone_mode=clone_mode,
+                           clone_seconds=time.perf_counter() - start, **git_clone.stats)
+        return result
+
+    def _archive_dir(self, git_url: str) -> str:
+        if self.cache is not None:
+            return self.cache.archives_dir(git_url)
+        return os.path.join(self.clone_dir, hashlib.sha1(git_url.encode()).hexdigest()[:12], "archives")
+
+    def _want_archive(self, key: Tuple[str, str], template: Optional[str]) -> None:
+        """
+        Record the template of the archive URL of a reference, when an include sets the `archive_url` query parameter.
+        """
+        if template is not None:
+            with self._lock:
+                self._archive_urls[key] = template
+
+    def _fetch_archive(self, git_url: str, git_ref: str) -> Tuple[str, str]:
+        """
+        Extract the directories every include of a reference needs from the archive of the reference.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :return: The directory of the extracted tree and the digest of the archive.
+        """
+        key = (git_url, git_ref)
+        with self._lock:
+            _, subtrees = self._wanted.get(key, (self.clone_mode, set()))
+            subtrees = sorted(subtrees)
+            url = archive_url(self._archive_urls.get(key, self.archive_url), git_url, git_ref)
+            remote_lock = self._remote_locks[git_url]
+
+        start = time.perf_counter()
+        expected_digest = self._locked_sha(git_url, git_ref) if self.lock_file is not None else None
+        git_archive = GitArchive(self._archive_dir(git_url), offline=self.lock_file is not None, policy=self.policy)
+        # The archives of a remote share one index, and the same tree when they have the same digest
+        with remote_lock, self._cache_lock(git_url, "archives"):
+            result = git_archive.fetch(url, subtrees, expected_digest=expected_digest,
+                                       immutable=GitClone._is_full_sha(git_ref))
+        self.report.record(git_url, git_ref, source="archive", clone_seconds=time.perf_counter() - start,
+                           **git_archive.stats)
+        return result
+
+    def _cached_result(self, task: Tuple[str, str, str]):
+        """
+        Find what the clone cache still holds of an include, from a previous build.
+
+        :return: The result the clone or fetch of the task would have, or None if nothing usable is cached.
+        """
+        git_url, git_ref, source = task
+        try:
+            if source == "archive":
+                with self._lock:
+                    _, subtrees = self._wanted.get((git_url, git_ref), (self.clone_mode, set()))
+                    url = archive_url(self._archive_urls.get((git_url, git_ref), self.archive_url), git_url, git_ref)
+                with self._cache_lock(git_url, "archives"):
+                    return GitArchive(self._archive_dir(git_url)).cached(url, sorted(subtrees))
+            if source == "objects":
+                store_path = os.path.join(self._store_dir(git_url), f"{GitClone._repo_name(git_url)}.git")
+                sha = git.Repo(store_path).git.rev_parse("--verify", f"{GitClone._objects_ref(git_ref)}^{{commit}}")
+                return store_path, sha
+            worktree_path = os.path.join(self._worktree_dir(git_url, git_ref), GitClone._repo_name(git_url))
+            repo = git.Repo(worktree_path)
+            # A worktree without an index was added, but never checked out
+            if not os.path.exists(os.path.join(repo.git_dir, "index")):
+                return None
+            repo.head.commit
+            return worktree_path
+        except (git.GitError, ValueError, OSError):
+            return None
+
+    def _run(self, task: Tuple[str, str, str]):
+        """
+        Clone, fetch or extract an include, and handle a failure according to the fetch failure mode.
+        """
+        fetch = {"objects": self._fetch_objects, "archive": self._fetch_archive}.get(task[2], self._clone)
+        try:
+            return fetch(*task[:2])
+        except IncludeFetchError as e:
+            if self.fetch_failure == "fail":
+                # Not an IncludeFetchError, which leaves the include out: the build ends once it gets the result
+                raise PluginError(str(e)) from e
+            cached = self._cached_result(task) if self.fetch_failure == "cached" else None
+            if cached is None:
+                self.report.record(*task[:2], degraded="omitted")
+                raise
+            log.warning(f"{e} Using the cached copy of '{task[1]}' of '{task[0]}' from a previous build.")
+            self.report.record(*task[:2], degraded="cached")
+            if task[2] == "checkout":
+                # Leave the cached checkout as it is, widening it could need the network
+                with self._lock:
+                    clone_mode, sparse_paths = self._wanted.get(task[:2], (self.clone_mode, set()))
+                    self._applied[task[:2]] = (clone_mode, frozenset(sparse_paths))
+            return cached
+
+    def _nested_nav(self, parser: IncludeParserBang, git_repo_path: str, nav_path: str,
+                    tree: Optional[GitTree] = None) -> List:
+        """
+        Load the nav of a cloned include so it can be scanned for nested includes.
+
+        Errors are ignored here, they are reported by the resolver when the include is executed.
+        """
+        parser.tree = tree
+        try:
+            nav_file_path = parser._get_nav_file_path(git_repo_path, nav_path)
+            if nav_file_path is None:
+                return []
+            nav_config = parser._load_nav_file(nav_file_path) or {}
+        except (InvalidNavPathError, OSError, ValueError) as e:
+            log.debug(f"Unable to scan '{nav_path}' in '{git_repo_path}' for nested includes: {e}")
+            return []
+        return nav_config.get("nav") or []
+
+    def _submit(self, task: Tuple[str, str, str]) -> Future:
+        """
+        Start cloning or fetching a repository, unless it is already in progress or done.
+
+        The prefetcher and the resolver share the clones in progress, so a repository the resolver
+        needs before the prefetcher got to it is never cloned twice.
+
+        :param task: The (git_url, git_ref, source) to clone or fetch.
+        :return: The future of the clone or fetch.
+        """
+        with self._lock:
+            future = self._futures.get(task)
+            if future is None:
+                log.debug(f"Prefetching '{task[0]}' at '{task[1]}' ({task[2]})")
+                future = self._executor.submit(self._run, task)
+                self._futures[task] = future
+            return future
+
+    def forget_failures(self) -> None:
+        """
+        Let the next build try again the clones, fetches and downloads that failed in the previous one.
+        """
+        with self._lock:
+            for task, future in list(self._futures.items()):
+                if future.done() and future.exception() is not None:
+                    del self._futures[task]
+
+    def _done(self, task: Tuple[str, str, str], future: Future) -> None:
+        """
+        Record the result of a finished clone or fetch.
+        """
+        key = task[:2]
+        # A failure is kept for the rest of the build, so the include is not fetched and timed out again
+        result = future.result()
+        with self._lock:
+            if task[2] == "objects":
+                self.objects[key] = result
+            elif task[2] == "archive":
+                self.archives[key] = result
+            else:
+                self.checkouts[key] = result
+        if task[2] == "checkout":
+            self._ensure(key)
+
+    def prefetch(self, nav: List, base_dir: Optional[str] = None) -> Dict[Tuple[str, str], str]:
+        """
+        Clone every repository referenced by the nav, including nested navs, on a bounded worker pool.
+
+        Includes are deduplicated by (git_url, git_ref). Nested navs are scanned as soon as the
+        repository containing them has been cloned. Every nav is scanned completely before its
+        repositories are cloned, so the references of a remote are resolved in one batch. The navs of
+        local includes are read right away.
+
+        :param nav: The nav to prefetch.
+        :param base_dir: The directory the local includes of the nav are relative to.
+        :return: The local checkout path for every (git_url, git_ref).
+        """
+        pending: Dict[Future, Tuple[str, str, str]] = {}
+        waiting: Dict[Tuple[str, str, str], List[Tuple[IncludeParserBang, str, int]]] = {}
+        scanned: Dict[Tuple[str, str, str, str], int] = {}
+        new_keys: List[Tuple[str, str, str]] = []
+
+        def nested_nav(parser: IncludeParserBang, task: Tuple[str, str, str], nav_path: str) -> Tuple[List, str]:
+            key = task[:2]
+            if task[2] == "objects":
+                git_repo_path, git_commit = self.objects[key]
+                tree = GitTree(git_repo_path, git_commit)
+                return self._nested_nav(parser, git_repo_path, nav_path, tree), None
+            if task[2] == "archive":
+                tree_dir, _ = self.archives[key]
+                return self._nested_nav(parser, tree_dir, nav_path), tree_dir
+            return self._nested_nav(parser, self.checkouts[key], nav_path), self.checkouts[key]
+
+        def scan(items, base_dir: Optional[str], depth: int):
+            if 0 < self.resolve_max_depth < depth:
+                return
+            for parser in self._find_includes(items):
+                if isinstance(parser, IncludeParserPercent):
+                    # Nothing to fetch, only look for git includes in the local nav
+                    try:
+                        local_dir, nav_path = parser.parse(base_dir)
+                    except ValueError as e:
+                        log.debug(f"Skipping prefetch of '{parser.string}': {e}")
+                        continue
+                    local = (local_dir, None, None, nav_path)
+                    if scanned.get(local, depth + 1) <= depth:
+                        continue
+                    scanned[local] = depth
+                    scan(self._nested_nav(parser, local_dir, nav_path), local_dir, depth + 1)
+                    continue
+
+                try:
+                    git_url, git_ref, nav_path = parser.parse()
+                    source = parser.get_source(self.source)
+                except ValueError as e:
+                    log.debug(f"Skipping prefetch of '{parser.string}': {e}")
+                    continue
+
+                key = (git_url, git_ref)
+                task = (git_url, git_ref, source)
+                self._want(key, parser.get_option("clone_mode"), parser._get_nav_dir(nav_path))
+                if source == "archive":
+                    self._want_archive(key, parser.get_option("archive_url"))
+                if scanned.get(task + (nav_path,), depth + 1) <= depth:
+                    continue
+                scanned[task + (nav_path,)] = depth
+
+                with self._lock:
+                    done = key in {"objects": self.objects, "archive": self.archives}.get(source, self.checkouts)
+                if done:
+                    if source == "checkout":
+                        self._ensure(key)
+                    scan(*nested_nav(parser, task, nav_path), depth + 1)
+                    continue
+
+                waiting.setdefault(task, []).append((parser, nav_path, depth))
+                if task not in pending.values() and task not in new_keys:
+                    new_keys.append(task)
+
+        def submit():
+            for task in new_keys:
+                pending[self._submit(task)] = task
+            new_keys.clear()
+
+        with self.report.phase("prefetch"):
+            scan(nav, base_dir, 1)
+            submit()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    try:
+                        self._done(task, future)
+                    except IncludeFetchError:
+                        # The resolver leaves the include out of the nav, there is nothing to scan
+                        waiting.pop(task, None)
+                        continue
+                    for parser, nav_path, depth in waiting.pop(task, []):
+                        scan(*nested_nav(parser, task, nav_path), depth + 1)
+                submit()
+
+        log.info(f"Prefetched {len(self.checkouts)} checkouts and {len(self.objects)} object stores "
+                 f"using {self.max_workers} workers.")
+        return self.checkouts
+
+    def commits(self) -> Dict[Tuple[str, str], str]:
+        """
+        Return the commit every (git_url, git_ref) cloned or fetched so far points to, to write a lock file.
+        """
+        with self._lock:
+            shas = {key: sha for key, (_, sha) in self.objects.items()}
+            # Archives are pinned to their digest
+            shas.update((key, digest) for key, (_, digest) in self.archives.items())
+            checkouts = dict(self.checkouts)
+        for key, git_repo_path in checkouts.items():
+            shas.setdefault(key, open_repo(git_repo_path).head.commit.hexsha)
+        return shas
+
+    def resolve_versions(self, includes: List[Tuple[str, str, bool, str]]) -> Dict[Tuple[str, str], Optional[str]]:
+        """
+        Find what the includes of a previous build point to now, without fetching anything.
+
+        Locked includes are read from the lock file. Otherwise the references of a remote are resolved with
+        a single ls-remote, and the remotes concurrently. The results are kept for the clones of the build.
+        The archive of a commit never changes, whether the archive of another reference changed is only
+        known by downloading it.
+
+        :param includes: The (git_url, git_ref, archive, version) of every include, where the version is the
+            commit, or the digest of the archive.
+        :return: The current version of every (git_url, git_ref), None when it is not known.
+        """
+        if self.lock_file is not None:
+            return {(git_url, git_ref): self.lock_file.get(git_url, git_ref) for git_url, git_ref, _, _ in includes}
+        versions = {}
+        futures = {}
+        for git_url, git_ref, archive, version in includes:
+            if archive:
+                versions[(git_url, git_ref)] = version if GitClone._is_full_sha(git_ref) else None
+                continue
+            with self._lock:
+                self._requested_refs[git_url].add(git_ref)
+        for git_url, git_ref, archive, _ in includes:
+            if not archive:
+                futures[(git_url, git_ref)] = self._executor.submit(self._resolve_ref, git_url, git_ref)
+        versions.update((key, future.result()) for key, future in futures.items())
+        return versions
+
+    def start(self, nav: List, base_dir: Optional[str] = None) -> Future:
+        """
+        Prefetch in the background, so the resolver can use every repository as soon as it is cloned.
+
+        :param nav: The nav to prefetch.
+        :param base_dir: The directory the local includes of the nav are relative to.
+        :return: The future of the prefetch.
+        """
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ultirepo-prefetch")
+        future = executor.submit(self.prefetch, nav, base_dir)
+        executor.shutdown(wait=False)
+        return future
+
+    def get(self, git_url: str, git_ref: str, clone_mode: Optional[str] = None,
+            sparse_path: Optional[str] = None) -> str:
+        """
+        Return the local checkout of a repository, waiting for it when it is being prefetched and
+        cloning it if it has not been prefetched.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :param clone_mode: The clone mode requested by the include.
+        :param sparse_path: The directory the include needs when the clone mode is "sparse".
+        :return: The path to the cloned git repository.
+        """
+        key = (git_url, git_ref)
+        self._want(key, clone_mode, sparse_path)
+        task = (git_url, git_ref, "checkout")
+        future = self._submit(task)
+        self._done(task, future)
+        return self.checkouts[key]
+
+    def get_objects(self, git_url: str, git_ref: str, clone_mode: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Return the object store holding a reference of a repository, fetching it if it has not been prefetched.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :param clone_mode: The clone mode requested by the include.
+        :return: The path to the object store and the commit the reference points to.
+        """
+        key = (git_url, git_ref)
+        self._want(key, clone_mode, None)
+        task = (git_url, git_ref, "objects")
+        future = self._submit(task)
+        self._done(task, future)
+        return self.objects[key]
+
+    def get_archive(self, git_url: str, git_ref: str, subtree: str, archive_url: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Return the extracted archive of a reference, extracting it if it has not been prefetched.
+
+        An archive that was prefetched for other includes of the reference is extracted again when it
+        does not hold `subtree` yet.
+
+        :param git_url: The URL of the git repository.
+        :param git_ref: The git reference.
+        :param subtree: The directory of the archive the include needs.
+        :param archive_url: The template of the URL of the archive requested by the include.
+        :return: The directory of the extracted tree and the digest of the archive.
+        """
+        key = (git_url, git_ref)
+        self._want(key, None, subtree)
+        self._want_archive(key, archive_url)
+        task = (git_url, git_ref, "archive")
+        future = self._submit(task)
+        self._done(task, future)
+        result = self.archives[key]
+        if not os.path.exists(os.path.join(result[0], subtree)):
+            result = self._run(task)
+            with self._lock:
+                self.archives[key] = result
+        return result
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mkdocs.plugins import get_plugin_logger
+
+log = get_plugin_logger(__name__)
+
+REPORT_VERSION = 1
+
+
+class BuildReport:
+    def __init__(self) -> None:
+        """
+        Initialize BuildReport object.
+
+        Collects the time spent in every phase of a build and what every include cost: clone or fetch time,
+        bytes fetched, checkout time, files and bytes merged and duplicates skipped. Recording only
+        takes a clock reading and a dict update, so a report is kept for every build.
+        """
+        self.phases: Dict[str, float] = {}
+        self.includes: Dict[Tuple[str, Optional[str]], Dict[str, object]] = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a phase of the build. Phases that run several times are added up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            log.debug(f"Phase '{name}' took {elapsed:.3f}s.")
+
+    def record(self, git_url: str, git_ref: Optional[str], **values) -> None:
+        """
+        Record what an include cost.
+
+        Numbers are added to the ones recorded before, so an include that is fetched or merged in several
+        steps gets its totals. Other values replace the previous ones.
+
+        :param git_url: The URL of the include, or the directory of an include that is not a git repository.
+        :param git_ref: The git reference of the include.
+        """
+        with self._lock:
+            entry = self.includes.setdefault((git_url, git_ref), {"url": git_url, "ref": git_ref})
+            for name, value in values.items():
+                previous = entry.get(name)
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(previous, (int, float)):
+                    entry[name] = previous + value
+                else:
+                    entry[name] = value
+        log.debug(f"Include '{git_url}' at '{git_ref}': {values}")
+
+    def degraded(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        Return the includes that could not be fetched, and were served from the cache or left out.
+        """
+        with self._lock:
+            return [key for key, entry in self.includes.items() if entry.get("degraded")]
+
+    def to_dict(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "version": REPORT_VERSION,
+                "total_seconds": time.perf_counter() - self._start,
+                "phases": dict(self.phases),
+                "includes": [dict(entry) for entry in self.includes.values()],
+            }
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"{len(self.includes)} includes, {phases}"
+
+    def save(self, path: str) -> None:
+        """
+        Write the report as JSON, replacing the previous one atomically.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(temp_path, path)
@@ -1,26 +1,106 @@
-import logging
+import re
 import sys
 from copy import deepcopy
-from pathlib import Path, PosixPath
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 
-from mkdocs.utils import warning_filter
+from mkdocs.exceptions import PluginError
+from mkdocs.plugins import get_plugin_logger
 
 from .include_parsers import ParserInterface
 
-log = logging.getLogger(__name__)
-log.addFilter(warning_filter)
+log = get_plugin_logger(__name__)
+
+# Page paths that pathlib would normalize: absolute, trailing or doubled slashes, and "." components
+_NOT_PLAIN_PATH = re.compile(r"^/|/$|//|(?:^|/)\.(?:/|$)")
+
+class ResolveMemo:
+    def __init__(self) -> None:
+        """
+        Initialize ResolveMemo object.
+
+        Keeps the loaded nav files and resolved includes of a single build, so an include that appears
+        several times in the nav is only loaded and resolved once.
+        """
+        self.navs: Dict[Tuple, Dict] = {}
+        self.results: Dict[Tuple, Tuple[List, List[dict]]] = {}
+
+    def get(self, key: Tuple) -> Optional[Tuple[List, List[dict]]]:
+        result = self.results.get(key)
+        if result is None:
+            return None
+        return deepcopy(result)
+
+    def put(self, key: Tuple, resolved_nav: List, additional_info: List[dict]) -> None:
+        # The resolver never modifies a result once it is returned, so only the copies handed out are deep
+        self.results[key] = (resolved_nav, additional_info)
+
 
 class Resolver:
     def __init__(self, resolve_depth: int = 0, resolve_max_depth: int = 1) -> None:
+        """
+        Initialize Resolver object.
+
+        A single resolver walks the whole nav, including the navs of nested includes: the state of the
+        include being resolved is saved while its parser resolves the nested nav with the same resolver,
+        and restored afterwards. Every nav is walked iteratively in a single pass, so the cost of a nav
+        grows linearly with its number of entries whatever its nesting.
+
+        :param resolve_depth: The include depth of the nav this resolver starts with.
+        :param resolve_max_depth: The maximum include depth that is resolved, 0 or less for no limit.
+        """
         self.resolve_depth = resolve_depth
         self.resolve_max_depth = resolve_max_depth
         self.parsers = None
+        self.prefetcher = None
+        self.include_cache = None
+        self.memo = ResolveMemo()
+        self.nav_generator = None
+        self.ancestors: Tuple[Tuple[str, str, str], ...] = ()
+        self.on_include = None
         self.parent: Path = None
         self.include_parent: Path = None
+        # The root of the repository the nav being resolved is in, local includes are relative to it
+        self.base_dir: Optional[str] = None
+        # The parent cannot change anymore once it is a single directory, see `_set_parent`
+        self._parent_settled = False
+        self._parent_key = "None"
+        # The include parent as an interned string, None when pages are not prefixed or need pathlib to be joined
+        self._include_prefix: Optional[str] = None
+        self._nested = 0
 
     def set_parsers(self, parsers):
         self.parsers = parsers
+
+    def set_prefetcher(self, prefetcher):
+        self.prefetcher = prefetcher
+
+    def set_include_cache(self, include_cache):
+        self.include_cache = include_cache
+
+    def set_memo(self, memo: ResolveMemo):
+        self.memo = memo
+
+    def set_nav_generator(self, nav_generator):
+        self.nav_generator = nav_generator
+
+    def set_base_dir(self, base_dir: Optional[str]):
+        """
+        Set the directory the local includes of the nav are relative to, None when the nav is not on disk.
+        """
+        self.base_dir = base_dir
+
+    def set_include_callback(self, on_include):
+        """
+        Set a callable that is given the additional info of every include as soon as it is resolved, in nav order.
+        """
+        self.on_include = on_include
+
+    def set_ancestors(self, ancestors: Tuple[Tuple[str, str, str], ...]):
+        """
+        Set the (git_url, commit, nav_path) of every include this resolver is nested in, to detect cycles.
+        """
+        self.ancestors = ancestors
     
     def strip_prefix(self, string: str) -> str:
         result = string.split(" ", 1)
@@ -46,100 +126,153 @@ class Resolver:
         string = key.lower().replace(" ", "-")
         return string
 
+    def _update_parent(self, parent: Path) -> None:
+        self.parent = parent
+        path_parent = parent.parent
+        self._parent_settled = path_parent == path_parent.parent
+        self._parent_key = sys.intern(str(parent))
+
     def _set_parent(self, item):
         if isinstance(item, dict):
             key, = item.keys()
             value, = item.values()
 
-            nice_string = self._nicelify_string(key)
-            child = Path(nice_string)
-            
-            if not self.parent is None:
-                path_parent = self.parent.parent
-                if not isinstance(value, str):
-                    if not nice_string == self.parent.name and not path_parent == path_parent.parent:
-                        self.parent = path_parent / child
-                elif isinstance(value, str):
-                    pass
-                else:
-                    pass
-            else:
-                self.parent = Path(nice_string)
+            if self.parent is None:
+                self._update_parent(Path(self._nicelify_string(key)))
+            elif not self._parent_settled and not isinstance(value, str):
+                # Replaces the last directory of a parent with several directories
+                nice_string = self._nicelify_string(key)
+                if not nice_string == self.parent.name:
+                    self._update_parent(self.parent.parent / nice_string)
 
-    def _resolve_dict(self, item: Dict) -> Tuple[List, List[dict]]:
+    def _page_path(self, string: str) -> str:
+        """
+        Prefix a page of an included nav with the include parent, unless it is already in that directory.
+        """
+        if self.include_parent is None:
+            return string
 
-        key, = item.keys()
-        value, = item.values()
+        prefix = self._include_prefix
+        if prefix is not None and string and _NOT_PLAIN_PATH.search(string) is None:
+            # pathlib would not normalize anything, join the strings
+            slash = string.rfind("/")
+            if slash != -1 and string[:slash] == prefix:
+                return string
+            return f"{prefix}/{string}"
 
-        resolved_value, additional_info = self._resolve(value)
-        if len(resolved_value) <= 1:
-            return [{key: resolved_value[0]}], additional_info
-        else:
-            return [{key: resolved_value}], additional_info
+        string_path_prefix = self._get_prefix(string)
+        if not string_path_prefix == str(self.include_parent):
+            return str(self.include_parent / Path(string))
+        return string
 
-    def _resolve_list(self, items: List) -> Tuple[List, List[dict]]:
+    def _save_state(self) -> Tuple:
+        return (self.resolve_depth, self.parsers, self.ancestors, self.base_dir, self.parent,
+                self._parent_settled, self._parent_key, self.include_parent, self._include_prefix)
 
-        resolved_items = []
-        additional_info = []
+    def _restore_state(self, state: Tuple) -> None:
+        (self.resolve_depth, self.parsers, self.ancestors, self.base_dir, self.parent,
+         self._parent_settled, self._parent_key, self.include_parent, self._include_prefix) = state
 
-        for item in items:
-            resolved_item, info = self._resolve(item)
-            resolved_items.extend(resolved_item)
-            additional_info.extend(info)
-        
-        return resolved_items, additional_info
+    def _resolve_include(self, parser, string: str) -> Tuple[List, List[dict]]:
+        resolve_depth = self.resolve_depth + 1
+        stripped_string = self.strip_prefix(string)
 
-    def _resolve_string(self, string: str) -> Tuple[List, List[dict]]:
+        # Reuse the result of an include that was already resolved in this build. Local includes with the same
+        # path in different repositories are different includes.
+        cache_key = (stripped_string, self._parent_key, resolve_depth, self.base_dir)
+        memoized = self.memo.get(cache_key)
+        if memoized is not None:
+            return memoized
 
-        pattern_exists, parser = self._include_pattern_exists(string)
-        string_path_prefix = self._get_prefix(string)
+        # Reuse the result of an include whose sources did not change
+        if self.include_cache is not None:
+            cached = self.include_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
+        # The parser resolves the nested nav with this resolver, starting from a clean parent
+        parent = self.parent
+        state = self._save_state()
+        self.resolve_depth = resolve_depth
+        self.parent = None
+        self._parent_settled = False
+        self._parent_key = "None"
+        self._nested += 1
+        try:
+            include = parser(self, parent, stripped_string)
+            resolved_nav, additional_info = include.execute(parsers=self.parsers)
+        except PluginError:
+            # Ends the build with a clean message instead of a traceback
+            raise
+        except Exception as e:
+            raise Exception(e)
+        finally:
+            self._nested -= 1
+            self._restore_state(state)
 
-        if not pattern_exists:
-            if not string_path_prefix == str(self.include_parent) and not self.include_parent is None:
-                result = str(self.include_parent / Path(string))
-            else:
-                result = string
+        self.memo.put(cache_key, resolved_nav, additional_info)
+        if self.include_cache is not None:
+            self.include_cache.put(cache_key, resolved_nav, additional_info)
+        return resolved_nav, additional_info
 
-            return [result], []
-        else:
-            resolve_depth = self.resolve_depth + 1
-            resolver = Resolver(resolve_depth=resolve_depth, resolve_max_depth=self.resolve_max_depth)
-            stripped_string = self.strip_prefix(string)
-            try:
-                include = parser(resolver, self.parent, stripped_string)
-                resolved_nav, additional_info = include.execute(parsers=self.parsers)
-
-                return resolved_nav, additional_info
-            except Exception as e:
-                raise Exception(e)
-
-    def _resolve(self, value: Union[str, List, Dict]) -> Tuple[Union[str, List, Dict], List[dict]]:
-        self._set_parent(value)
-
-        if isinstance(value, dict):
-            return self._resolve_dict(value)
-        elif isinstance(value, list):
-            return self._resolve_list(value)
-        elif isinstance(value, str):
-            return self._resolve_string(value)
-        else:
-            return [], []
+    def _walk(self, nav, additional_info: List[dict]) -> List:
+        """
+        Resolve a nav in a single iterative pass.
 
-    def resolve(self, nav, parent: Path = None) -> Tuple[Union[str, List, Dict], List[dict]]:
+        Every list of the nav is walked by its own iterator on an explicit stack, and resolved entries are
+        appended to their final list right away. Nested lists are flattened into their parent, the value
+        of a section is unwrapped when it resolves to a single entry, and sections left empty by includes
+        that were left out are dropped.
+        """
         resolved_nav = []
+        patterns = tuple(pattern for pattern, _ in self.parsers or ())
+        on_include = self.on_include if self._nested == 0 else None
+        stack = [(iter(nav), resolved_nav, None)]
+        while stack:
+            items, target, section = stack[-1]
+            for item in items:
+                if isinstance(item, str):
+                    if not patterns or not item.startswith(patterns):
+                        target.append(self._page_path(item))
+                        continue
+                    _, parser = self._include_pattern_exists(item)
+                    include_nav, info = self._resolve_include(parser, item)
+                    target.extend(include_nav)
+                    additional_info.extend(info)
+                    if on_include is not None:
+                        for include_info in info:
+                            on_include(include_info)
+                elif isinstance(item, dict):
+                    self._set_parent(item)
+                    key, = item.keys()
+                    value, = item.values()
+                    stack.append((iter((value,)), [], (key, target)))
+                    break
+                elif isinstance(item, list):
+                    stack.append((iter(item), target, None))
+                    break
+            else:
+                stack.pop()
+                if section is not None and target:
+                    key, outer = section
+                    outer.append({key: target[0] if len(target) == 1 else target})
+        return resolved_nav
+
+    def resolve(self, nav, parent: Path = None) -> Tuple[Union[str, List, Dict], List[dict]]:
         additional_info = []
 
         self.include_parent = parent
-        if self.resolve_depth > self.resolve_max_depth:
+        self._include_prefix = None
+        if parent is not None:
+            prefix = str(parent)
+            if prefix not in (".", "/"):
+                self._include_prefix = sys.intern(prefix)
+        # A maximum depth of 0 or less resolves nested includes at any depth
+        if 0 < self.resolve_max_depth < self.resolve_depth:
             log.info(
                 f"Reached maximum depth ({self.resolve_max_depth}). Stopping further processing of include directives."
             )
             return nav, additional_info
 
-        for item in nav:
-            resolved_item, a_info = self._resolve(item)
-            resolved_nav.extend(resolved_item)
-            additional_info.extend(a_info)
-
+        resolved_nav = self._walk(nav, additional_info)
         return resolved_nav, additional_info
@@ -0,0 +1,90 @@
+import os
+import threading
+from copy import deepcopy
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import watchdog.events
+from mkdocs.livereload import LiveReloadServer
+from mkdocs.plugins import get_plugin_logger
+
+log = get_plugin_logger(__name__)
+
+
+def is_within(path: str, directories: Iterable[str]) -> bool:
+    """
+    Check if a path is one of the directories or inside of one of them.
+    """
+    return any(path == directory or path.startswith(directory + os.sep) for directory in directories)
+
+
+def source_dirs(additional_info: List[dict]) -> Set[str]:
+    """
+    Get the source directory of every include described by `additional_info`.
+    """
+    return {os.path.abspath(os.path.join(info["orig_docs_dir"], info["orig_docs_sub_dir"]))
+            for info in additional_info}
+
+
+class IncludeWatcher:
+    def __init__(self) -> None:
+        """
+        Initialize IncludeWatcher object.
+
+        Keeps the resolved result of every include between the builds of `mkdocs serve`, together
+        with the source directories it was built from, and drops it once something in them changes.
+        """
+        self.results: Dict[Hashable, Tuple[List, List[dict], Set[str]]] = {}
+        self.watched: Set[str] = set()
+        self._changed: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[List, List[dict]]]:
+        """
+        Get the resolved nav and additional info of an include that did not change since it was resolved.
+        """
+        result = self.results.get(key)
+        if result is None:
+            return None
+        resolved_nav, additional_info, _ = result
+        return deepcopy(resolved_nav), deepcopy(additional_info)
+
+    def put(self, key: Hashable, resolved_nav: List, additional_info: List[dict]) -> None:
+        self.results[key] = (deepcopy(resolved_nav), deepcopy(additional_info), source_dirs(additional_info))
+
+    def _on_event(self, event) -> None:
+        if event.is_directory:
+            return
+        with self._lock:
+            self._changed.add(os.path.abspath(event.src_path))
+            if getattr(event, "dest_path", None):
+                self._changed.add(os.path.abspath(event.dest_path))
+
+    def watch(self, server: LiveReloadServer, paths: Iterable[str]) -> None:
+        """
+        Watch the source directories of the includes, so the server rebuilds when they change
+        and the changed files are known to the next build.
+        """
+        handler = watchdog.events.FileSystemEventHandler()
+        handler.on_any_event = self._on_event
+        for path in sorted(set(os.path.abspath(path) for path in paths) - self.watched):
+            if not os.path.isdir(path):
+                continue
+            self.watched.add(path)
+            server.watch(path)
+            server.observer.schedule(handler, path, recursive=True)
+
+    def invalidate(self) -> Set[str]:
+        """
+        Drop the results of every include that has a changed file in one of its source directories.
+
+        :return: The files that changed since the previous call.
+        """
+        with self._lock:
+            changed, self._changed = self._changed, set()
+
+        for key, (_, _, sources) in list(self.results.items()):
+            if any(is_within(path, sources) for path in changed):
+                del self.results[key]
+        if changed:
+            log.debug(f"{len(changed)} changed files, {len(self.results)} includes are reused.")
+        return changed
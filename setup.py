@@ -14,7 +14,7 @@ setuptools.setup(
     license='MIT Licence',
     python_requires='>=3.10',
     install_requires=[
-        'mkdocs>=1.4.0',
+        'mkdocs>=1.6',
         'python-slugify>=4.0.1'
     ],
     classifiers=[
@@ -0,0 +1,117 @@
+import os
+import textwrap
+from typing import Dict, Optional
+
+import git
+import pytest
+import yaml
+from mkdocs.commands.build import build
+from mkdocs.config import load_config
+
+GIT_ENVIRONMENT = {"GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@example.com",
+                   "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@example.com"}
+
+
+def write(path, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(textwrap.dedent(content))
+
+
+def read(path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+class Remote:
+    """
+    A bare repository served over `file://`, committed to through a working copy next to it.
+    """
+
+    def __init__(self, root, name: str) -> None:
+        self.work_dir = os.path.join(root, "work", name)
+        self.path = os.path.join(root, "remotes", f"{name}.git")
+        self.url = f"file://{self.path}"
+        self.repo = git.Repo.init(self.work_dir, initial_branch="main")
+        self.repo.create_remote("origin", self.path)
+        git.Repo.init(self.path, bare=True, initial_branch="main")
+
+    def commit(self, files: Dict[str, Optional[str]], tag: Optional[str] = None, branch: str = "main") -> str:
+        """
+        Commit files to a branch and push it, None removes a file.
+
+        :return: The SHA of the commit.
+        """
+        if self.repo.head.is_valid() and self.repo.active_branch.name != branch:
+            self.repo.git.checkout("-B", branch)
+        for name, content in files.items():
+            path = os.path.join(self.work_dir, name)
+            if content is None:
+                self.repo.git.rm("--quiet", name)
+                continue
+            write(path, content)
+            self.repo.git.add(name)
+        self.repo.git.commit("--quiet", "--allow-empty", "--message", "Update docs", env=GIT_ENVIRONMENT)
+        if tag is not None:
+            self.repo.git.tag(tag)
+        self.repo.git.push("--quiet", "--force", "--tags", "origin", f"HEAD:refs/heads/{branch}")
+        return self.repo.head.commit.hexsha
+
+
+def docs_files(name: str, pages=("index.md",), nav: Optional[list] = None) -> Dict[str, str]:
+    """
+    Return the files of an included docs directory `docs/<name>` with its nav file.
+    """
+    files = {f"docs/{name}/{page}": f"# {name} {page}\n" for page in pages}
+    files[f"docs/{name}/nav.yml"] = yaml.safe_dump({"nav": list(nav if nav is not None else pages)})
+    return files
+
+
+def include(remote: Remote, name: str, ref: str = "main", **options: str) -> str:
+    query = "".join(f"&{option}={value}" for option, value in options.items())
+    return f"!include {remote.url}?ref={ref}&nav_path=docs/{name}/nav.yml{query}"
+
+
+@pytest.fixture
+def remotes(tmp_path):
+    """
+    Create the bare repositories of a test by name.
+    """
+    created = {}
+
+    def remote(name: str) -> Remote:
+        if name not in created:
+            created[name] = Remote(tmp_path, name)
+        return created[name]
+
+    return remote
+
+
+class Site:
+    def __init__(self, root) -> None:
+        self.root = root
+        self.cache_dir = str(root / "cache")
+        write(root / "docs" / "index.md", "# Home\n")
+
+    def configure(self, nav: list, **options) -> None:
+        options.setdefault("cache_dir", self.cache_dir)
+        config = {"site_name": "Test", "nav": ["index.md", *nav], "plugins": [{"ultirepo": options}]}
+        with open(self.root / "mkdocs.yml", "w") as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+
+    def build(self):
+        """
+        Build the site in this process.
+
+        :return: The config of the build, with the resolved nav.
+        """
+        config = load_config(config_file=str(self.root / "mkdocs.yml"))
+        config.plugins.on_startup(command="build", dirty=False)
+        build(config)
+        config.plugins.on_shutdown()
+        return config
+
+
+@pytest.fixture
+def site(tmp_path):
+    return Site(tmp_path / "site")
@@ -0,0 +1,123 @@
+"""
+The recursive resolver the plugin shipped with, kept as the reference the resolver is compared with.
+"""
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+
+class ReferenceResolver:
+    def __init__(self, resolve_depth: int = 0, resolve_max_depth: int = 1) -> None:
+        self.resolve_depth = resolve_depth
+        self.resolve_max_depth = resolve_max_depth
+        self.parsers = None
+        self.parent: Path = None
+        self.include_parent: Path = None
+
+    def set_parsers(self, parsers):
+        self.parsers = parsers
+
+    def strip_prefix(self, string: str) -> str:
+        result = string.split(" ", 1)
+        return result[1]
+
+    def _get_prefix(self, path_str: str) -> str:
+        path = Path(path_str)
+        if path.parent != Path('.'):
+            return str(path.parent)
+        else:
+            return None
+
+    def _include_pattern_exists(self, string: str):
+        result = False, None
+
+        for pattern, parser in self.parsers:
+            if string.startswith(pattern):
+                result = True, parser
+
+        return result
+
+    def _nicelify_string(self, key: str) -> str:
+        string = key.lower().replace(" ", "-")
+        return string
+
+    def _set_parent(self, item):
+        if isinstance(item, dict):
+            key, = item.keys()
+            value, = item.values()
+
+            nice_string = self._nicelify_string(key)
+            child = Path(nice_string)
+
+            if self.parent is not None:
+                path_parent = self.parent.parent
+                if not isinstance(value, str):
+                    if not nice_string == self.parent.name and not path_parent == path_parent.parent:
+                        self.parent = path_parent / child
+            else:
+                self.parent = Path(nice_string)
+
+    def _resolve_dict(self, item: Dict) -> Tuple[List, List[dict]]:
+        key, = item.keys()
+        value, = item.values()
+
+        resolved_value, additional_info = self._resolve(value)
+        if len(resolved_value) <= 1:
+            return [{key: resolved_value[0]}], additional_info
+        else:
+            return [{key: resolved_value}], additional_info
+
+    def _resolve_list(self, items: List) -> Tuple[List, List[dict]]:
+        resolved_items = []
+        additional_info = []
+
+        for item in items:
+            resolved_item, info = self._resolve(item)
+            resolved_items.extend(resolved_item)
+            additional_info.extend(info)
+
+        return resolved_items, additional_info
+
+    def _resolve_string(self, string: str) -> Tuple[List, List[dict]]:
+        pattern_exists, parser = self._include_pattern_exists(string)
+        string_path_prefix = self._get_prefix(string)
+
+        if not pattern_exists:
+            if not string_path_prefix == str(self.include_parent) and self.include_parent is not None:
+                result = str(self.include_parent / Path(string))
+            else:
+                result = string
+
+            return [result], []
+        else:
+            resolve_depth = self.resolve_depth + 1
+            resolver = ReferenceResolver(resolve_depth=resolve_depth, resolve_max_depth=self.resolve_max_depth)
+            stripped_string = self.strip_prefix(string)
+            include = parser(resolver, self.parent, stripped_string)
+            return include.execute(parsers=self.parsers)
+
+    def _resolve(self, value: Union[str, List, Dict]) -> Tuple[Union[str, List, Dict], List[dict]]:
+        self._set_parent(value)
+
+        if isinstance(value, dict):
+            return self._resolve_dict(value)
+        elif isinstance(value, list):
+            return self._resolve_list(value)
+        elif isinstance(value, str):
+            return self._resolve_string(value)
+        else:
+            return [], []
+
+    def resolve(self, nav, parent: Path = None) -> Tuple[Union[str, List, Dict], List[dict]]:
+        resolved_nav = []
+        additional_info = []
+
+        self.include_parent = parent
+        if self.resolve_depth > self.resolve_max_depth:
+            return nav, additional_info
+
+        for item in nav:
+            resolved_item, a_info = self._resolve(item)
+            resolved_nav.extend(resolved_item)
+            additional_info.extend(a_info)
+
+        return resolved_nav, additional_info
@@ -0,0 +1,109 @@
+import io
+import logging
+import os
+import subprocess
+import sys
+import tarfile
+import textwrap
+
+import pytest
+
+from mkdocs_ultirepo_plugin.cache import CloneCache
+from mkdocs_ultirepo_plugin.exceptions import IncludeFetchError
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+
+URL = "https://example.invalid/org/repo.git"
+INCLUDE = f"!include {URL}?ref=main&nav_path=docs/guide/nav.yml&source=archive"
+
+
+def _write(path, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(textwrap.dedent(content))
+
+
+def _make_archive(path) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path, "w:gz") as tar:
+        for name, content in (("repo-main/docs/guide/nav.yml", "nav:\n- index.md\n"),
+                              ("repo-main/docs/guide/index.md", "# Guide\n")):
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def site(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "# Home\n")
+    return tmp_path
+
+
+def _build(site, fetch_failure: str, *args: str) -> subprocess.CompletedProcess:
+    _write(site / "mkdocs.yml", f"""\
+        site_name: Archive
+        nav:
+        - index.md
+        - Repo:
+            - "{INCLUDE}"
+        plugins:
+        - ultirepo:
+            cache_dir: {site / "cache"}
+            docs_destination_dir: merged
+            archive_url: "{site / "archives"}/{{name}}-{{ref}}.tar.gz"
+            fetch_failure: {fetch_failure}
+        """)
+    return subprocess.run([sys.executable, "-m", "mkdocs", "build", *args], cwd=site, capture_output=True, text=True)
+
+
+def test_missing_archive_fails_the_build(site):
+    result = _build(site, "fail")
+    assert result.returncode != 0
+    assert "Error while getting the archive" in result.stderr
+    assert "Aborted with a BuildError" in result.stdout
+    assert "Traceback" not in result.stderr
+
+
+def test_missing_archive_is_omitted(site):
+    result = _build(site, "omit")
+    assert result.returncode == 0, result.stderr
+    assert "out of the nav" in result.stderr
+    assert os.path.exists(site / "site" / "index.html")
+    assert not os.path.exists(site / "merged" / "guide" / "index.md")
+
+
+def test_failed_archive_is_not_fetched_again_in_the_same_build(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG)
+    prefetcher = Prefetcher([("!include", IncludeParserBang)], cache=CloneCache(cache_dir=str(tmp_path / "cache")),
+                            source="archive", archive_url=f"{tmp_path}/{{name}}-{{ref}}.tar.gz", fetch_failure="omit")
+    for _ in range(2):
+        with pytest.raises(IncludeFetchError):
+            prefetcher.get_archive(URL, "main", "docs/guide")
+    assert caplog.text.count("Prefetching") == 1
+
+    # The next build tries again
+    prefetcher.forget_failures()
+    with pytest.raises(IncludeFetchError):
+        prefetcher.get_archive(URL, "main", "docs/guide")
+    assert caplog.text.count("Prefetching") == 2
+
+
+def test_missing_archive_is_served_from_the_cache(site):
+    _make_archive(site / "archives" / "repo-main.tar.gz")
+    result = _build(site, "fail")
+    assert result.returncode == 0, result.stderr
+    assert os.path.exists(site / "merged" / "guide" / "index.md")
+
+    os.remove(site / "archives" / "repo-main.tar.gz")
+    result = _build(site, "cached")
+    assert result.returncode == 0, result.stderr
+    assert "Using the cached copy" in result.stderr
+    assert os.path.exists(site / "merged" / "guide" / "index.md")
+    assert os.path.exists(site / "site" / "guide" / "index.html")
+
+
+def test_missing_archive_without_cache_is_omitted(site):
+    result = _build(site, "cached")
+    assert result.returncode == 0, result.stderr
+    assert "out of the nav" in result.stderr
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import docs_files, include, read, write
+
+from mkdocs_ultirepo_plugin.cache import CloneCache, lock_file
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+
+PARSERS = [("!include", IncludeParserBang)]
+
+DAY = 86400
+
+
+def _prefetch(cache_dir, nav):
+    cache = CloneCache(cache_dir=str(cache_dir))
+    try:
+        return Prefetcher(PARSERS, cache=cache).prefetch(nav)
+    finally:
+        cache.close()
+
+
+def _entry(cache_dir, git_url: str, size: int, last_used: float) -> str:
+    """
+    Add an entry of the given size to the cache, last used at the given time.
+    """
+    cache = CloneCache(cache_dir=str(cache_dir))
+    entry = cache.entry_dir(git_url)
+    cache.close()
+    write(os.path.join(entry, "data"), "x" * size)
+    os.utime(os.path.join(entry, CloneCache.access_file), (last_used, last_used))
+    return entry
+
+
+def test_an_unchanged_remote_is_not_fetched_again(tmp_path, remotes, caplog):
+    caplog.set_level(logging.DEBUG)
+    remote = remotes("docs")
+    sha = remote.commit(docs_files("docs"))
+
+    first = _prefetch(tmp_path / "cache", [include(remote, "docs")])
+    assert "Fetched '" in caplog.text
+
+    caplog.clear()
+    second = _prefetch(tmp_path / "cache", [include(remote, "docs")])
+
+    assert second == first
+    assert "Fetched '" not in caplog.text
+    assert f"Commit {sha} of '{remote.url}' is already in the object store." in caplog.text
+
+
+def test_a_changed_remote_is_fetched_into_the_cached_checkout(tmp_path, remotes):
+    remote = remotes("docs")
+    remote.commit(docs_files("docs"))
+    first = _prefetch(tmp_path / "cache", [include(remote, "docs")])
+
+    remote.commit({"docs/docs/index.md": "# Updated\n"})
+    second = _prefetch(tmp_path / "cache", [include(remote, "docs")])
+
+    path = second[(remote.url, "main")]
+    assert path == first[(remote.url, "main")]
+    assert read(os.path.join(path, "docs", "docs", "index.md")) == "# Updated\n"
+
+
+def test_least_recently_used_entries_are_evicted_above_the_size_limit(tmp_path):
+    now = time.time()
+    oldest = _entry(tmp_path, "https://example.com/oldest.git", 600 * 1024, now - 3 * DAY)
+    older = _entry(tmp_path, "https://example.com/older.git", 600 * 1024, now - 2 * DAY)
+    recent = _entry(tmp_path, "https://example.com/recent.git", 600 * 1024, now - DAY)
+
+    CloneCache(cache_dir=str(tmp_path), max_size=1).evict()
+
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(older)
+    assert os.path.exists(recent)
+
+
+def test_entries_unused_for_too_long_are_evicted(tmp_path):
+    now = time.time()
+    expired = _entry(tmp_path, "https://example.com/expired.git", 10, now - 8 * DAY)
+    fresh = _entry(tmp_path, "https://example.com/fresh.git", 10, now - 6 * DAY)
+
+    CloneCache(cache_dir=str(tmp_path), max_age=7).evict()
+
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh)
+
+
+def test_entries_used_by_the_build_are_kept(tmp_path):
+    now = time.time()
+    used = _entry(tmp_path, "https://example.com/used.git", 2 * 1024 * 1024, now - 8 * DAY)
+    kept = _entry(tmp_path, "https://example.com/kept.git", 2 * 1024 * 1024, now - 8 * DAY)
+
+    cache = CloneCache(cache_dir=str(tmp_path), max_size=1, max_age=7)
+    cache.entry_dir("https://example.com/used.git")
+    cache.evict(keep=[kept])
+    cache.close()
+
+    assert os.path.exists(used)
+    assert os.path.exists(kept)
+
+
+def test_entries_used_by_another_build_are_not_evicted(tmp_path):
+    entry = _entry(tmp_path, "https://example.com/shared.git", 2 * 1024 * 1024, time.time() - 8 * DAY)
+    other_build = CloneCache(cache_dir=str(tmp_path))
+    other_build.entry_dir("https://example.com/shared.git")
+    os.utime(os.path.join(entry, CloneCache.access_file), (time.time() - 8 * DAY,) * 2)
+
+    CloneCache(cache_dir=str(tmp_path), max_size=1, max_age=7).evict()
+    assert os.path.exists(entry)
+
+    other_build.close()
+    CloneCache(cache_dir=str(tmp_path), max_size=1, max_age=7).evict()
+    assert not os.path.exists(entry)
+
+
+def test_an_exclusive_lock_is_not_taken_while_held(tmp_path):
+    path = str(tmp_path / "lock")
+    held = lock_file(path)
+
+    assert lock_file(path, blocking=False) is None
+    assert lock_file(path, shared=True, blocking=False) is None
+
+    held.close()
+    again = lock_file(path, blocking=False)
+    assert again is not None
+    again.close()
+
+
+def test_a_cache_lock_excludes_other_builds(tmp_path):
+    url = "https://example.com/docs.git"
+    builds = [CloneCache(cache_dir=str(tmp_path)) for _ in range(4)]
+    holders = []
+    overlaps = []
+    guard = threading.Lock()
+
+    def fetch(cache):
+        with cache.lock(url):
+            with guard:
+                holders.append(cache)
+                overlaps.append(len(holders))
+            time.sleep(0.05)
+            with guard:
+                holders.remove(cache)
+
+    with ThreadPoolExecutor(max_workers=len(builds)) as executor:
+        list(executor.map(fetch, builds))
+
+    assert overlaps == [1] * len(builds)
+
+
+class ColdCachePrefetcher(Prefetcher):
+    """
+    Every build looks for the object store before any of them fetches it.
+    """
+    barrier = threading.Barrier(3, timeout=30)
+
+    def _expected_sha(self, git_url, git_ref, target_dir):
+        expected_sha = super()._expected_sha(git_url, git_ref, target_dir)
+        self.barrier.wait()
+        return expected_sha
+
+
+def test_builds_sharing_a_cold_cache_fetch_a_remote_once(tmp_path, remotes, caplog):
+    caplog.set_level(logging.DEBUG)
+    remote = remotes("docs")
+    remote.commit(docs_files("docs"))
+
+    def build(_):
+        cache = CloneCache(cache_dir=str(tmp_path / "cache"))
+        try:
+            return ColdCachePrefetcher(PARSERS, cache=cache).prefetch([include(remote, "docs")])
+        finally:
+            cache.close()
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        checkouts = list(executor.map(build, range(3)))
+
+    path = checkouts[0][(remote.url, "main")]
+    assert all(checkout == {(remote.url, "main"): path} for checkout in checkouts)
+    assert read(os.path.join(path, "docs", "docs", "index.md")) == "# docs index.md\n"
+    assert caplog.text.count(f"Fetched '{remote.url}'") == 1
@@ -0,0 +1,91 @@
+import os
+
+import git
+
+from conftest import docs_files, include
+
+from mkdocs_ultirepo_plugin.cache import CloneCache
+from mkdocs_ultirepo_plugin.git_clone import GitClone
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+
+PARSERS = [("!include", IncludeParserBang)]
+
+
+def _monorepo(remotes):
+    """
+    Create a remote with the docs of two projects and a few commits of history.
+    """
+    remote = remotes("monorepo")
+    remote.commit({"README.md": "# Monorepo\n", "src/main.py": "print('hello')\n"})
+    remote.commit(docs_files("alpha"))
+    remote.commit(docs_files("beta"))
+    return remote
+
+
+def _commits(path) -> int:
+    return int(git.Repo(path).git.rev_list("--count", "HEAD"))
+
+
+def test_a_full_clone_has_the_whole_history(tmp_path, remotes):
+    remote = _monorepo(remotes)
+
+    path = GitClone(target_dir=str(tmp_path / "clones")).clone(remote.url, "main", clone_mode="full")
+
+    assert _commits(path) == 3
+    assert os.path.exists(os.path.join(path, "src", "main.py"))
+
+
+def test_a_shallow_clone_only_has_the_requested_commit(tmp_path, remotes):
+    remote = _monorepo(remotes)
+
+    path = GitClone(target_dir=str(tmp_path / "clones")).clone(remote.url, "main", clone_mode="shallow")
+
+    assert _commits(path) == 1
+    assert os.path.exists(os.path.join(path, "docs", "alpha", "index.md"))
+
+
+def test_a_partial_clone_checks_out_every_file(tmp_path, remotes):
+    remote = _monorepo(remotes)
+
+    path = GitClone(target_dir=str(tmp_path / "clones")).clone(remote.url, "main", clone_mode="partial")
+
+    assert git.Repo(path).git.config("--get", "remote.origin.partialclonefilter") == "blob:none"
+    assert os.path.exists(os.path.join(path, "src", "main.py"))
+    assert os.path.exists(os.path.join(path, "docs", "beta", "index.md"))
+
+
+def test_a_sparse_clone_only_checks_out_the_docs_subtree(tmp_path, remotes):
+    remote = _monorepo(remotes)
+
+    git_clone = GitClone(target_dir=str(tmp_path / "clones"))
+    path = git_clone.clone(remote.url, "main", clone_mode="sparse", sparse_paths=["docs/alpha"])
+
+    assert _commits(path) == 1
+    assert os.path.exists(os.path.join(path, "docs", "alpha", "index.md"))
+    assert not os.path.exists(os.path.join(path, "docs", "beta"))
+    assert not os.path.exists(os.path.join(path, "src"))
+
+
+def test_a_sparse_clone_is_widened_to_a_full_checkout(tmp_path, remotes):
+    remote = _monorepo(remotes)
+    git_clone = GitClone(target_dir=str(tmp_path / "clones"))
+    git_clone.clone(remote.url, "main", clone_mode="sparse", sparse_paths=["docs/alpha"])
+
+    path = git_clone.clone(remote.url, "main", clone_mode="full")
+
+    assert _commits(path) == 3
+    assert os.path.exists(os.path.join(path, "docs", "beta", "index.md"))
+    assert os.path.exists(os.path.join(path, "src", "main.py"))
+
+
+def test_includes_of_a_sparse_checkout_share_the_union_of_their_subtrees(tmp_path, remotes):
+    remote = _monorepo(remotes)
+    nav = [include(remote, "alpha", clone_mode="sparse"), include(remote, "beta", clone_mode="sparse")]
+
+    prefetcher = Prefetcher(PARSERS, cache=CloneCache(cache_dir=str(tmp_path / "cache")))
+    path = prefetcher.prefetch(nav)[(remote.url, "main")]
+
+    assert os.path.exists(os.path.join(path, "docs", "alpha", "index.md"))
+    assert os.path.exists(os.path.join(path, "docs", "beta", "index.md"))
+    assert not os.path.exists(os.path.join(path, "src"))
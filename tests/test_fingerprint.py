@@ -0,0 +1,64 @@
+import logging
+import os
+
+from conftest import docs_files, include, read, write
+
+from mkdocs_ultirepo_plugin.fingerprint import BUILD_STATE_FILE
+
+REUSED = "Nothing changed since the previous build"
+
+
+def _build_twice(site, remotes, caplog, change, **options):
+    """
+    Build a site with an include, change something and build it again.
+
+    :return: The config of the first and the second build.
+    """
+    caplog.set_level(logging.INFO)
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", build_fingerprint=True)
+    first = site.build()
+    assert REUSED not in caplog.text
+
+    caplog.clear()
+    change(remote)
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", build_fingerprint=True,
+                   **options)
+    return first, site.build()
+
+
+def test_an_unchanged_build_is_reused(site, remotes, caplog):
+    first, second = _build_twice(site, remotes, caplog, lambda remote: None)
+
+    assert REUSED in caplog.text
+    assert second["nav"] == first["nav"]
+    assert second["docs_dir"] == str(site.root / "merged")
+    assert os.path.exists(site.root / "site" / "alpha" / "usage" / "index.html")
+
+
+def test_a_new_commit_of_an_include_is_noticed(site, remotes, caplog):
+    _build_twice(site, remotes, caplog, lambda remote: remote.commit({"docs/alpha/usage.md": "# Updated\n"}))
+
+    assert REUSED not in caplog.text
+    assert read(site.root / "merged" / "alpha" / "usage.md") == "# Updated\n"
+
+
+def test_a_changed_original_page_is_noticed(site, remotes, caplog):
+    _build_twice(site, remotes, caplog, lambda remote: write(site.root / "docs" / "index.md", "# New home\n"))
+
+    assert REUSED not in caplog.text
+    assert read(site.root / "merged" / "index.md") == "# New home\n"
+
+
+def test_a_changed_config_is_noticed(site, remotes, caplog):
+    _build_twice(site, remotes, caplog, lambda remote: None, merge_strategy="hardlink")
+
+    assert REUSED not in caplog.text
+
+
+def test_removing_the_build_state_merges_everything_again(site, remotes, caplog):
+    _build_twice(site, remotes, caplog, lambda remote: os.remove(site.root / "merged" / BUILD_STATE_FILE))
+
+    assert REUSED not in caplog.text
+    assert os.path.exists(site.root / "merged" / BUILD_STATE_FILE)
@@ -0,0 +1,65 @@
+import os
+
+from conftest import docs_files, include, read
+
+from mkdocs_ultirepo_plugin.git_clone import GitClone
+from mkdocs_ultirepo_plugin.git_objects import GitTree, blob_hexsha
+
+
+def _worktrees(cache_dir) -> list:
+    """
+    Find the checked out files in the clone cache.
+    """
+    return [root for root, _, files in os.walk(cache_dir) if "index.md" in files]
+
+
+def test_a_tree_is_read_without_a_working_tree(tmp_path, remotes):
+    remote = remotes("docs")
+    sha = remote.commit({**docs_files("docs", pages=("index.md", "guide/usage.md")), "README.md": "# Docs\n"})
+    store_path, commit = GitClone(target_dir=str(tmp_path / "store")).fetch_objects(remote.url, "main")
+
+    tree = GitTree(store_path, commit)
+
+    assert commit == sha
+    assert tree.read("docs/docs/guide/usage.md") == b"# docs guide/usage.md\n"
+    assert sorted(tree.listdir("docs/docs")) == [("guide", True), ("index.md", False), ("nav.yml", False)]
+    assert sorted(path for path, _ in tree.files("docs/docs")) == ["guide/usage.md", "index.md", "nav.yml"]
+    assert tree.is_dir("docs/docs/guide") and not tree.exists("docs/other")
+
+
+def test_a_site_is_built_from_git_objects(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], include_source="objects", docs_destination_dir="merged")
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Alpha": ["alpha/index.md", "alpha/usage.md"]}]
+    assert read(site.root / "merged" / "alpha" / "usage.md") == "# alpha usage.md\n"
+    assert os.path.exists(site.root / "site" / "alpha" / "usage" / "index.html")
+    assert _worktrees(site.cache_dir) == []
+
+
+def test_the_source_of_an_include_overrides_the_configured_one(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha"))
+    site.configure([{"Alpha": [include(remote, "alpha", source="objects")]}], docs_destination_dir="merged")
+
+    site.build()
+
+    assert read(site.root / "merged" / "alpha" / "index.md") == "# alpha index.md\n"
+    assert _worktrees(site.cache_dir) == []
+
+
+def test_files_of_a_new_commit_are_written_again(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], include_source="objects", docs_destination_dir="merged")
+    site.build()
+
+    sha = remote.commit({"docs/alpha/usage.md": "# Updated\n"})
+    site.build()
+
+    merged = site.root / "merged" / "alpha" / "usage.md"
+    assert read(merged) == "# Updated\n"
+    assert blob_hexsha(merged) == remote.repo.git.rev_parse(f"{sha}:docs/alpha/usage.md")
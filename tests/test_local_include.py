@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from conftest import docs_files, include, read, write
+
+
+def _service(root, name: str, nav: str = "nav:\n- index.md\n- usage.md\n") -> None:
+    write(root / "services" / name / "index.md", f"# {name}\n")
+    write(root / "services" / name / "usage.md", f"# {name} usage\n")
+    if nav is not None:
+        write(root / "services" / name / "nav.yml", nav)
+
+
+def test_a_subdirectory_is_included_without_git(site):
+    _service(site.root, "foo")
+    write(site.root / "services" / "foo" / "extra.css", "body {}\n")
+    site.configure([{"Foo": ["%include ./services/foo"]}], docs_destination_dir="merged",
+                   merge_copy_patterns=["*.css"])
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Foo": ["foo/index.md", "foo/usage.md"]}]
+    merged = site.root / "merged" / "foo"
+    assert os.readlink(merged / "usage.md") == str(site.root / "services" / "foo" / "usage.md")
+    assert not os.path.islink(merged / "extra.css")
+    assert os.path.exists(site.root / "site" / "foo" / "usage" / "index.html")
+    assert os.listdir(site.cache_dir) == [".locks"]
+
+
+def test_a_subdirectory_without_a_nav_file_gets_a_generated_nav(site):
+    _service(site.root, "foo", nav=None)
+    site.configure([{"Foo": ["%include ./services/foo"]}], docs_destination_dir="merged")
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Foo": ["foo/index.md", "foo/usage.md"]}]
+
+
+def test_a_local_include_in_a_git_include_is_relative_to_its_checkout(site, remotes):
+    remote = remotes("monorepo")
+    remote.commit({**docs_files("alpha", nav=["index.md", {"Bar": ["%include ./services/bar"]}]),
+                   "services/bar/index.md": "# bar\n", "services/bar/nav.yml": "nav:\n- index.md\n"})
+    # Not the one of the checkout
+    _service(site.root, "bar")
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", resolve_max_depth=0)
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Alpha": ["alpha/index.md", {"Bar": "bar/index.md"}]}]
+    assert read(site.root / "merged" / "bar" / "index.md") == "# bar\n"
+    assert not os.path.exists(site.root / "merged" / "bar" / "usage.md")
+
+
+def test_git_includes_of_a_local_include_are_fetched(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    _service(site.root, "foo", nav=f"nav:\n- index.md\n- Alpha:\n  - '{include(remote, 'alpha')}'\n")
+    site.configure([{"Foo": ["%include ./services/foo"]}], docs_destination_dir="merged", resolve_max_depth=0)
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Foo": ["foo/index.md", {"Alpha": ["alpha/index.md", "alpha/usage.md"]}]}]
+    assert read(site.root / "merged" / "alpha" / "usage.md") == "# alpha usage.md\n"
+
+
+def test_a_missing_subdirectory_is_an_error(site):
+    site.configure([{"Foo": ["%include ./services/missing"]}], docs_destination_dir="merged")
+
+    with pytest.raises(Exception, match="The local include './services/missing' does not exist"):
+        site.build()
@@ -0,0 +1,78 @@
+import shutil
+
+import pytest
+
+from conftest import docs_files, include, read
+
+from mkdocs_ultirepo_plugin.lockfile import LockFile
+
+
+def _locked(site) -> dict:
+    return LockFile.load(str(site.root / "ultirepo.lock")).shas
+
+
+def test_the_lock_file_is_written_by_the_first_build(site, remotes):
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha_sha = alpha.commit(docs_files("alpha"))
+    beta_sha = beta.commit(docs_files("beta"), tag="v1")
+    site.configure([{"Docs": [include(alpha, "alpha"), include(beta, "beta", ref="v1")]}],
+                   docs_destination_dir="merged", lock_file="ultirepo.lock")
+
+    site.build()
+
+    assert _locked(site) == {(alpha.url, "main"): alpha_sha, (beta.url, "v1"): beta_sha}
+
+
+def test_a_locked_build_uses_the_locked_commits_without_the_network(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha"))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", lock_file="ultirepo.lock")
+    site.build()
+    remote.commit({"docs/alpha/index.md": "# Newer\n"})
+    # The remote cannot be reached anymore
+    shutil.move(remote.path, f"{remote.path}.gone")
+
+    site.build()
+
+    assert read(site.root / "merged" / "alpha" / "index.md") == "# alpha index.md\n"
+
+
+def test_updating_the_lock_file_fetches_the_new_commits(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha"))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", lock_file="ultirepo.lock")
+    site.build()
+    sha = remote.commit({"docs/alpha/index.md": "# Newer\n"})
+
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", lock_file="ultirepo.lock",
+                   lock_update=True)
+    site.build()
+
+    assert _locked(site) == {(remote.url, "main"): sha}
+    assert read(site.root / "merged" / "alpha" / "index.md") == "# Newer\n"
+
+
+def test_an_include_missing_from_the_lock_file_fails_the_build(site, remotes, caplog):
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha.commit(docs_files("alpha"))
+    beta.commit(docs_files("beta"))
+    site.configure([{"Alpha": [include(alpha, "alpha")]}], docs_destination_dir="merged", lock_file="ultirepo.lock")
+    site.build()
+
+    site.configure([{"Docs": [include(alpha, "alpha"), include(beta, "beta")]}], docs_destination_dir="merged",
+                   lock_file="ultirepo.lock")
+    with pytest.raises(SystemExit):
+        site.build()
+    assert f"'main' of '{beta.url}' is not in the lock file" in caplog.text
+
+
+def test_a_locked_commit_missing_from_the_cache_fails_the_build(site, remotes, caplog):
+    remote = remotes("alpha")
+    sha = remote.commit(docs_files("alpha"))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], docs_destination_dir="merged", lock_file="ultirepo.lock")
+    site.build()
+
+    shutil.rmtree(site.cache_dir)
+    with pytest.raises(SystemExit):
+        site.build()
+    assert f"Commit {sha} of '{remote.url}' is not in the clone cache" in caplog.text
@@ -0,0 +1,42 @@
+import logging
+
+from conftest import GIT_ENVIRONMENT, docs_files, include
+
+from mkdocs_ultirepo_plugin.cache import CloneCache
+from mkdocs_ultirepo_plugin.git_clone import GitClone
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+
+PARSERS = [("!include", IncludeParserBang)]
+
+
+def test_references_are_resolved_in_one_call(remotes):
+    remote = remotes("docs")
+    first = remote.commit(docs_files("docs"), tag="v1")
+    second = remote.commit({"docs/docs/index.md": "# Second\n"})
+    remote.repo.git.tag("--annotate", "--message", "Release", "v2", env=GIT_ENVIRONMENT)
+    remote.repo.git.push("--quiet", "origin", "v2")
+    develop = remote.commit({"docs/docs/index.md": "# Develop\n"}, branch="develop")
+
+    shas = GitClone.ls_remote(remote.url, ["main", "develop", "v1", "v2", "missing", "refs/heads/main"])
+
+    assert shas == {"main": second, "develop": develop, "v1": first, "v2": second, "missing": None,
+                    "refs/heads/main": second}
+
+
+def test_a_remote_costs_one_ls_remote_for_all_its_references(tmp_path, remotes, caplog):
+    remote = remotes("versions")
+    for version in ("v1", "v2", "v3"):
+        remote.commit({"docs/versions/index.md": f"# {version}\n", "docs/versions/nav.yml": "nav:\n- index.md\n"},
+                      tag=version)
+    nav = [include(remote, "versions", ref=version) for version in ("v1", "v2", "v3")]
+    cache = CloneCache(cache_dir=str(tmp_path / "cache"))
+    Prefetcher(PARSERS, cache=cache).prefetch(nav)
+
+    # The references are only resolved when a previous build left the object store to update
+    caplog.set_level(logging.DEBUG)
+    Prefetcher(PARSERS, max_workers=3, cache=cache).prefetch(nav)
+
+    assert caplog.text.count("with one ls-remote") == 1
+    assert f"Resolved 3 references of '{remote.url}' with one ls-remote." in caplog.text
+    assert "Fetched '" not in caplog.text
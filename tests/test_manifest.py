@@ -0,0 +1,95 @@
+import logging
+import os
+
+from conftest import write
+
+from mkdocs_ultirepo_plugin.git_objects import GitBlob
+from mkdocs_ultirepo_plugin.manifest import MANIFEST_FILE, Manifest
+from mkdocs_ultirepo_plugin.merger import Merger
+
+
+def _manifest() -> Manifest:
+    manifest = Manifest()
+    docs = manifest.root("/site/docs", include=False)
+    alpha = manifest.root("/cache/alpha/docs/alpha")
+    beta = manifest.root("/cache/beta/docs/beta", git_repo="/cache/beta/objects/beta.git")
+    manifest.add("index.md", docs, "index.md")
+    manifest.add("alpha/index.md", alpha, "index.md")
+    manifest.add("beta/index.md", beta, "index.md", blob="a" * 40, size=12)
+    return manifest
+
+
+def test_a_saved_manifest_is_loaded_unchanged(tmp_path):
+    manifest = _manifest()
+    manifest.save(str(tmp_path / MANIFEST_FILE))
+
+    loaded = Manifest.load(str(tmp_path / MANIFEST_FILE))
+
+    assert dict(loaded.items()) == dict(manifest.items())
+    assert loaded.source("beta/index.md") == GitBlob("/cache/beta/objects/beta.git", "a" * 40, 12,
+                                                     "/cache/beta/docs/beta/index.md")
+    assert dict(loaded.includes()) == {"alpha/index.md": "/cache/alpha/docs/alpha/index.md",
+                                       "beta/index.md": loaded.source("beta/index.md")}
+    assert not loaded.is_include("index.md")
+
+
+def test_entries_share_their_root(tmp_path):
+    manifest = Manifest()
+    root = manifest.root("".join(["/cache/alpha/", "docs"]))
+    manifest.add("alpha/index.md", root, "index.md")
+    manifest.add("alpha/usage.md", manifest.root("/cache/alpha/docs"), "usage.md")
+    manifest.save(str(tmp_path / MANIFEST_FILE))
+
+    loaded = Manifest.load(str(tmp_path / MANIFEST_FILE))
+
+    assert loaded.get("alpha/index.md").root is loaded.get("alpha/usage.md").root
+
+
+def test_the_first_file_of_a_destination_wins():
+    manifest = Manifest()
+    first = manifest.root("/first")
+    second = manifest.root("/second")
+
+    assert manifest.add("page.md", first, "page.md")
+    assert not manifest.add("page.md", second, "page.md")
+
+    assert manifest.source("page.md") == "/first/page.md"
+    assert [(destination, entry.source_path) for destination, _, entry in manifest.conflicts] == [
+        ("page.md", "/second/page.md")]
+
+
+def test_an_unchanged_manifest_is_not_written_again(tmp_path):
+    path = str(tmp_path / MANIFEST_FILE)
+    content = _manifest().save(path)
+    os.utime(path, ns=(0, 0))
+
+    assert _manifest().save(path, content) == content
+    assert os.stat(path).st_mtime_ns == 0
+
+
+def test_unreadable_manifests_are_ignored(tmp_path, caplog):
+    assert Manifest.load(str(tmp_path / "missing.json")) is None
+
+    write(tmp_path / "broken.json", "{")
+    assert Manifest.load(str(tmp_path / "broken.json")) is None
+    assert "Ignoring unreadable merge manifest" in caplog.text
+
+    write(tmp_path / "old.json", '{"version": 0, "roots": [], "entries": []}')
+    assert Manifest.load(str(tmp_path / "old.json")) is None
+
+
+def test_the_next_build_removes_stale_files_with_the_manifest(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    write(tmp_path / "docs" / "index.md", "home")
+    write(tmp_path / "docs" / "old.md", "old")
+    config = {"docs_dir": str(tmp_path / "docs")}
+    Merger(config=config, merged_docs_dir=str(tmp_path / "merged")).merge([])
+    # Not in the manifest, so the next build does not know about it
+    write(tmp_path / "merged" / "unknown.md", "unknown")
+
+    os.remove(tmp_path / "docs" / "old.md")
+    Merger(config=config, merged_docs_dir=str(tmp_path / "merged")).merge([])
+
+    assert not os.path.exists(tmp_path / "merged" / "old.md")
+    assert os.path.exists(tmp_path / "merged" / "unknown.md")
+    assert "0 files updated, 1 unchanged, 1 removed." in caplog.text
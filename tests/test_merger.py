@@ -0,0 +1,161 @@
+import logging
+import os
+import shutil
+
+import pytest
+from mkdocs.exceptions import ConfigurationError
+
+from mkdocs_ultirepo_plugin.manifest import MANIFEST_FILE
+from mkdocs_ultirepo_plugin.merger import Merger
+
+# A modification time with a fraction of a second, in nanoseconds
+MTIME_NS = 1_700_000_000_250_000_000
+
+
+def _write(path, content: str, mtime_ns: int = None) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _read(path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def _merge(tmp_path, additional_info=(), **options):
+    merger = Merger(config={"docs_dir": str(tmp_path / "docs")}, merged_docs_dir=str(tmp_path / "merged"), **options)
+    return merger.merge(list(additional_info))
+
+
+def _include(tmp_path, name: str, files) -> dict:
+    """
+    Write the docs of an include in a checkout, and return the include information the resolver would.
+    """
+    checkout = tmp_path / "checkouts" / name
+    for path, content in files.items():
+        _write(checkout / "docs" / name / path, content)
+    return {"orig_docs_dir": str(checkout), "orig_docs_sub_dir": f"docs/{name}",
+            "git_url": f"https://example.com/{name}.git", "git_ref": "main"}
+
+
+def test_edit_within_the_same_second_is_merged(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "first", MTIME_NS)
+    _merge(tmp_path)
+    assert _read(tmp_path / "merged" / "index.md") == "first"
+
+    # Same size, and modified less than a second later
+    _write(tmp_path / "docs" / "index.md", "again", MTIME_NS + 500_000_000)
+    _merge(tmp_path)
+    assert _read(tmp_path / "merged" / "index.md") == "again"
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "reflink"])
+def test_files_are_placed_with_their_content(tmp_path, strategy):
+    _write(tmp_path / "docs" / "index.md", "home")
+    item = _include(tmp_path, "alpha", {"index.md": "alpha", "nav.yml": "nav:\n- index.md\n"})
+
+    _merge(tmp_path, [item], strategy=strategy)
+
+    assert _read(tmp_path / "merged" / "index.md") == "home"
+    assert _read(tmp_path / "merged" / "alpha" / "index.md") == "alpha"
+    assert not os.path.islink(tmp_path / "merged" / "alpha" / "index.md")
+    assert not os.path.exists(tmp_path / "merged" / "alpha" / "nav.yml")
+
+
+def test_hardlinks_share_the_file_of_the_checkout(tmp_path):
+    item = _include(tmp_path, "alpha", {"index.md": "alpha"})
+
+    _merge(tmp_path, [item], strategy="hardlink")
+
+    merged = os.stat(tmp_path / "merged" / "alpha" / "index.md")
+    source = os.stat(tmp_path / "checkouts" / "alpha" / "docs" / "alpha" / "index.md")
+    assert merged.st_ino == source.st_ino
+
+
+def test_symlinks_point_to_the_checkout(tmp_path):
+    item = _include(tmp_path, "alpha", {"index.md": "alpha"})
+
+    _merge(tmp_path, [item], strategy="symlink")
+
+    merged = tmp_path / "merged" / "alpha" / "index.md"
+    assert os.readlink(merged) == str(tmp_path / "checkouts" / "alpha" / "docs" / "alpha" / "index.md")
+
+
+def test_files_matching_the_copy_patterns_are_copied(tmp_path):
+    item = _include(tmp_path, "alpha", {"index.md": "alpha", "extra.css": "body {}"})
+
+    _merge(tmp_path, [item], strategy="symlink", copy_patterns=["*.css"])
+
+    assert os.path.islink(tmp_path / "merged" / "alpha" / "index.md")
+    assert not os.path.islink(tmp_path / "merged" / "alpha" / "extra.css")
+    assert _read(tmp_path / "merged" / "alpha" / "extra.css") == "body {}"
+
+
+def test_changing_the_strategy_replaces_the_merged_files(tmp_path):
+    item = _include(tmp_path, "alpha", {"index.md": "alpha"})
+    _merge(tmp_path, [item], strategy="symlink")
+
+    _merge(tmp_path, [item], strategy="copy")
+
+    assert not os.path.islink(tmp_path / "merged" / "alpha" / "index.md")
+    assert _read(tmp_path / "merged" / "alpha" / "index.md") == "alpha"
+
+
+def test_only_changed_files_are_merged_again(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    _write(tmp_path / "docs" / "index.md", "home")
+    item = _include(tmp_path, "alpha", {"index.md": "alpha", "usage.md": "usage"})
+    _merge(tmp_path, [item])
+
+    caplog.clear()
+    _write(tmp_path / "checkouts" / "alpha" / "docs" / "alpha" / "usage.md", "new usage")
+    _merge(tmp_path, [item])
+
+    assert "1 files updated, 2 unchanged, 0 removed." in caplog.text
+    assert _read(tmp_path / "merged" / "alpha" / "usage.md") == "new usage"
+
+
+def test_files_no_longer_merged_are_removed(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "home")
+    alpha = _include(tmp_path, "alpha", {"index.md": "alpha", "guide/usage.md": "usage"})
+    beta = _include(tmp_path, "beta", {"index.md": "beta"})
+    _merge(tmp_path, [alpha, beta])
+
+    shutil.rmtree(tmp_path / "checkouts" / "alpha" / "docs" / "alpha" / "guide")
+    _merge(tmp_path, [alpha])
+
+    assert sorted(os.listdir(tmp_path / "merged" / "alpha")) == ["index.md"]
+    assert not os.path.exists(tmp_path / "merged" / "beta")
+    assert _read(tmp_path / "merged" / "index.md") == "home"
+
+
+def test_files_left_by_an_unknown_merge_are_removed(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "home")
+    _merge(tmp_path)
+    os.remove(tmp_path / "merged" / MANIFEST_FILE)
+    _write(tmp_path / "merged" / "stale" / "page.md", "stale")
+
+    _merge(tmp_path)
+
+    assert not os.path.exists(tmp_path / "merged" / "stale")
+    assert _read(tmp_path / "merged" / "index.md") == "home"
+
+
+def test_a_directory_not_merged_by_the_plugin_is_left_alone(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "home")
+    _write(tmp_path / "merged" / "notes.txt", "mine")
+
+    with pytest.raises(ConfigurationError):
+        _merge(tmp_path)
+    assert _read(tmp_path / "merged" / "notes.txt") == "mine"
+
+
+def test_the_merged_directory_must_not_be_in_the_docs(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "home")
+    merger = Merger(config={"docs_dir": str(tmp_path / "docs")}, merged_docs_dir=str(tmp_path / "docs" / "merged"))
+
+    with pytest.raises(ConfigurationError):
+        merger.merge([])
@@ -0,0 +1,76 @@
+import logging
+import os
+
+from conftest import write
+
+from mkdocs_ultirepo_plugin.git_clone import GitClone
+from mkdocs_ultirepo_plugin.git_objects import GitTree
+from mkdocs_ultirepo_plugin.nav_generator import NavGenerator
+
+FILES = {
+    "usage.md": "# Usage\n",
+    "index.md": "# Home\n",
+    "nav.yaml": "nav: []\n",
+    "image.png": "",
+    ".hidden/page.md": "# Hidden\n",
+    "api_reference/README.md": "# API\n",
+    "api_reference/client.md": "# Client\n",
+    "assets/logo.svg": "",
+}
+
+NAV = [
+    "index.md",
+    "usage.md",
+    {"Api reference": ["api_reference/README.md", "api_reference/client.md"]},
+]
+
+
+def _docs(path):
+    for name, content in FILES.items():
+        write(path / name, content)
+    return str(path)
+
+
+def test_the_nav_of_a_directory_is_generated(tmp_path):
+    assert NavGenerator().generate(_docs(tmp_path / "docs")) == NAV
+
+
+def test_the_nav_of_a_git_tree_is_generated_like_on_disk(tmp_path, remotes):
+    remote = remotes("docs")
+    remote.commit({f"docs/{name}": content for name, content in FILES.items()})
+    store_path, commit = GitClone(target_dir=str(tmp_path / "store")).fetch_objects(remote.url, "main")
+
+    tree = GitTree(store_path, commit)
+
+    assert NavGenerator().generate(os.path.join(store_path, "docs"), tree=tree) == NAV
+
+
+def test_a_generated_nav_is_reused_until_its_directories_change(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG)
+    docs = _docs(tmp_path / "docs")
+    generator = NavGenerator(cache_dir=str(tmp_path / "cache"))
+    generator.generate(docs)
+
+    # Another build sharing the cache
+    caplog.clear()
+    assert NavGenerator(cache_dir=str(tmp_path / "cache")).generate(docs) == NAV
+    assert f"Reusing the generated nav of '{docs}'." in caplog.text
+
+    write(tmp_path / "docs" / "api_reference" / "server.md", "# Server\n")
+    caplog.clear()
+    nav = generator.generate(docs)
+
+    assert nav[-1] == {"Api reference": ["api_reference/README.md", "api_reference/client.md",
+                                         "api_reference/server.md"]}
+    assert "Reusing" not in caplog.text
+
+
+def test_an_include_without_a_nav_file_gets_a_generated_nav(site, remotes):
+    remote = remotes("alpha")
+    remote.commit({"docs/alpha/index.md": "# Alpha\n", "docs/alpha/guides/setup.md": "# Setup\n"})
+    site.configure([{"Alpha": [f"!include {remote.url}?ref=main&nav_path=docs/alpha"]}],
+                   docs_destination_dir="merged")
+
+    config = site.build()
+
+    assert config["nav"] == ["index.md", {"Alpha": ["alpha/index.md", {"Guides": "alpha/guides/setup.md"}]}]
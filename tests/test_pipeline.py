@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+
+from conftest import docs_files, include, read, write
+
+from mkdocs_ultirepo_plugin.cache import CloneCache
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang, IncludeParserPercent
+from mkdocs_ultirepo_plugin.merger import Merger
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+from mkdocs_ultirepo_plugin.resolver import Resolver
+
+PARSERS = [("!include", IncludeParserBang)]
+
+
+class GatedPrefetcher(Prefetcher):
+    """
+    Clones only go on once the test opens the gate.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+
+    def _clone(self, git_url, git_ref):
+        assert self.gate.wait(timeout=30)
+        return super()._clone(git_url, git_ref)
+
+
+def test_the_resolver_waits_for_the_clone_started_in_the_background(tmp_path, remotes, caplog):
+    caplog.set_level(logging.DEBUG)
+    remote = remotes("docs")
+    remote.commit(docs_files("docs"))
+    prefetcher = GatedPrefetcher(PARSERS, cache=CloneCache(cache_dir=str(tmp_path / "cache")))
+
+    prefetch = prefetcher.start([include(remote, "docs")])
+    assert not prefetch.done()
+    prefetcher.gate.set()
+    path = prefetcher.get(remote.url, "main")
+
+    assert prefetch.result()[(remote.url, "main")] == path
+    assert caplog.text.count(f"Prefetching '{remote.url}' at 'main'") == 1
+
+
+class RecordingParser(IncludeParserPercent):
+    events = []
+
+    def execute(self, **kwargs):
+        self.events.append(f"resolve {self.string}")
+        return super().execute(**kwargs)
+
+
+def test_includes_are_handed_over_in_nav_order_as_they_are_resolved(tmp_path):
+    for name in ("alpha", "beta", "gamma"):
+        write(tmp_path / name / "index.md", f"# {name}\n")
+        write(tmp_path / name / "nav.yml", "nav:\n- index.md\n")
+    # Nested includes are handed over with the include they are in
+    write(tmp_path / "beta" / "nav.yml", "nav:\n- index.md\n- '%include ./gamma'\n")
+    resolver = Resolver(resolve_max_depth=0)
+    resolver.set_parsers([("%include", RecordingParser)])
+    resolver.set_base_dir(str(tmp_path))
+    RecordingParser.events = events = []
+    resolver.set_include_callback(lambda info: events.append(f"merge {os.path.basename(info['orig_docs_dir'])}"))
+
+    _, additional_info = resolver.resolve([{"Services": ["%include ./alpha", "%include ./beta"]}])
+
+    assert events == ["resolve ./alpha", "merge alpha", "resolve ./beta", "resolve ./gamma", "merge gamma",
+                      "merge beta"]
+    assert [os.path.basename(info["orig_docs_dir"]) for info in additional_info] == ["alpha", "gamma", "beta"]
+
+
+def test_the_first_include_in_the_nav_wins_whatever_the_merge_order(tmp_path):
+    write(tmp_path / "docs" / "index.md", "home")
+    items = []
+    for name in ("first", "second"):
+        write(tmp_path / name / "docs" / "page.md", name)
+        items.append({"orig_docs_dir": str(tmp_path / name), "orig_docs_sub_dir": "docs"})
+    merger = Merger(config={"docs_dir": str(tmp_path / "docs")}, merged_docs_dir=str(tmp_path / "merged"),
+                    workers=8)
+
+    merger.start()
+    for item in items:
+        merger.add(item)
+    manifest, merged_docs_dir = merger.finish()
+
+    assert read(tmp_path / "merged" / "docs" / "page.md") == "first"
+    assert manifest.source("docs/page.md") == str(tmp_path / "first" / "docs" / "page.md")
+    assert [entry.source_path for _, _, entry in manifest.conflicts] == [str(tmp_path / "second" / "docs" / "page.md")]
+
+
+def test_a_build_merges_every_include(site, remotes):
+    names = ["alpha", "beta", "gamma", "delta"]
+    for name in names:
+        remotes(name).commit(docs_files(name, pages=("index.md", "usage.md")))
+    site.configure([{"Services": [include(remotes(name), name) for name in names]}],
+                   docs_destination_dir="merged", prefetch_workers=4, merge_workers=4)
+
+    site.build()
+
+    for name in names:
+        assert read(site.root / "merged" / name / "usage.md") == f"# {name} usage.md\n"
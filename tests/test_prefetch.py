@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+
+import git
+
+from conftest import docs_files, include, read
+
+from mkdocs_ultirepo_plugin.cache import CloneCache
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserBang
+from mkdocs_ultirepo_plugin.prefetch import Prefetcher
+
+PARSERS = [("!include", IncludeParserBang)]
+
+
+def _prefetcher(tmp_path, **options) -> Prefetcher:
+    options.setdefault("resolve_max_depth", 0)
+    return Prefetcher(PARSERS, cache=CloneCache(cache_dir=str(tmp_path / "cache")), **options)
+
+
+def test_every_include_is_fetched_once(tmp_path, remotes, caplog):
+    caplog.set_level(logging.DEBUG)
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha.commit(docs_files("alpha"))
+    beta.commit(docs_files("beta"))
+    nav = [
+        {"Alpha": [include(alpha, "alpha")]},
+        {"Beta": [include(beta, "beta")]},
+        {"Alpha again": [include(alpha, "alpha")]},
+    ]
+
+    checkouts = _prefetcher(tmp_path).prefetch(nav)
+
+    assert set(checkouts) == {(alpha.url, "main"), (beta.url, "main")}
+    assert read(os.path.join(checkouts[(alpha.url, "main")], "docs", "alpha", "index.md")) == "# alpha index.md\n"
+    assert caplog.text.count(f"Prefetching '{alpha.url}' at 'main'") == 1
+
+
+def test_nested_includes_are_prefetched(tmp_path, remotes):
+    outer, inner = remotes("outer"), remotes("inner")
+    inner.commit(docs_files("inner"))
+    outer.commit(docs_files("outer", nav=["index.md", {"Inner": [include(inner, "inner")]}]))
+
+    checkouts = _prefetcher(tmp_path).prefetch([include(outer, "outer")])
+    assert set(checkouts) == {(outer.url, "main"), (inner.url, "main")}
+
+    # Only the first level with a maximum depth of 1
+    checkouts = _prefetcher(tmp_path / "shallow", resolve_max_depth=1).prefetch([include(outer, "outer")])
+    assert set(checkouts) == {(outer.url, "main")}
+
+
+class BarrierPrefetcher(Prefetcher):
+    """
+    Clones only go on once two of them are running at the same time.
+    """
+    barrier = threading.Barrier(2, timeout=30)
+
+    def _clone(self, git_url, git_ref):
+        self.barrier.wait()
+        return super()._clone(git_url, git_ref)
+
+
+def test_includes_are_fetched_concurrently(tmp_path, remotes):
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha.commit(docs_files("alpha"))
+    beta.commit(docs_files("beta"))
+
+    prefetcher = BarrierPrefetcher(PARSERS, max_workers=2, resolve_max_depth=0,
+                                   cache=CloneCache(cache_dir=str(tmp_path / "cache")))
+    checkouts = prefetcher.prefetch([include(alpha, "alpha"), include(beta, "beta")])
+
+    assert set(checkouts) == {(alpha.url, "main"), (beta.url, "main")}
+
+
+def test_several_refs_of_a_remote_share_one_object_store(tmp_path, remotes):
+    remote = remotes("versions")
+    previous = None
+    for version in ("v1", "v2", "v3"):
+        files = docs_files("versions", pages=(f"{version}.md",))
+        if previous is not None:
+            files[f"docs/versions/{previous}.md"] = None
+        remote.commit(files, tag=version)
+        previous = version
+    nav = [include(remote, "versions", ref=version) for version in ("v1", "v2", "v3")]
+
+    checkouts = _prefetcher(tmp_path, max_workers=3).prefetch(nav)
+
+    for version in ("v1", "v2", "v3"):
+        path = checkouts[(remote.url, version)]
+        assert sorted(os.listdir(os.path.join(path, "docs", "versions"))) == ["nav.yml", f"{version}.md"]
+    stores = {os.path.realpath(git.Repo(path).common_dir) for path in checkouts.values()}
+    assert len(stores) == 1
+
+
+def test_resolver_reuses_the_prefetched_checkout(tmp_path, remotes, caplog):
+    caplog.set_level(logging.DEBUG)
+    remote = remotes("docs")
+    remote.commit(docs_files("docs"))
+    prefetcher = _prefetcher(tmp_path)
+    checkouts = prefetcher.prefetch([include(remote, "docs")])
+
+    assert prefetcher.get(remote.url, "main") == checkouts[(remote.url, "main")]
+    assert caplog.text.count(f"Prefetching '{remote.url}' at 'main'") == 1
+
+
+def test_build_with_prefetched_includes(site, remotes):
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    beta.commit(docs_files("beta"))
+    site.configure([{"Alpha": [include(alpha, "alpha")]}, {"Beta": [include(beta, "beta")]}],
+                   docs_destination_dir="merged", prefetch_workers=2)
+
+    config = site.build()
+
+    assert config["nav"][:2] == ["index.md", {"Alpha": ["alpha/index.md", "alpha/usage.md"]}]
+    assert read(site.root / "merged" / "alpha" / "usage.md") == "# alpha usage.md\n"
+    assert read(site.root / "merged" / "beta" / "index.md") == "# beta index.md\n"
+    assert os.path.exists(site.root / "site" / "alpha" / "usage" / "index.html")
@@ -0,0 +1,134 @@
+import pytest
+import yaml
+from mkdocs.exceptions import Abort, PluginError
+
+from conftest import docs_files, include, write
+
+from mkdocs_ultirepo_plugin.exceptions import IncludeCycleError
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserPercent
+from mkdocs_ultirepo_plugin.resolver import ResolveMemo, Resolver
+
+
+class CountingParser(IncludeParserPercent):
+    executed = []
+    loaded = []
+
+    def execute(self, **kwargs):
+        self.executed.append(self.string)
+        return super().execute(**kwargs)
+
+    def _load_nav_file(self, nav_file_path):
+        self.loaded.append(nav_file_path)
+        return super()._load_nav_file(nav_file_path)
+
+
+def _resolver(base_dir, **options) -> Resolver:
+    resolver = Resolver(**options)
+    resolver.set_parsers([("%include", CountingParser)])
+    resolver.set_base_dir(str(base_dir))
+    CountingParser.executed = []
+    CountingParser.loaded = []
+    return resolver
+
+
+def _service(base_dir, name: str, nav=("index.md",)) -> None:
+    write(base_dir / name / "index.md", f"# {name}\n")
+    write(base_dir / name / "nav.yml", yaml.safe_dump({"nav": list(nav)}))
+
+
+def test_an_include_repeated_in_a_section_is_resolved_once(tmp_path):
+    _service(tmp_path, "alpha")
+
+    nav, additional_info = _resolver(tmp_path).resolve([{"Alpha": ["%include ./alpha", "%include ./alpha"]}])
+
+    assert nav == [{"Alpha": ["alpha/index.md", "alpha/index.md"]}]
+    assert len(additional_info) == 2
+    assert CountingParser.executed == ["./alpha"]
+
+
+def test_includes_of_the_same_nav_file_share_its_result(tmp_path):
+    _service(tmp_path, "alpha")
+
+    nav, _ = _resolver(tmp_path).resolve([{"Alpha": ["%include ./alpha", "%include alpha"]}])
+
+    assert nav == [{"Alpha": ["alpha/index.md", "alpha/index.md"]}]
+    assert len(CountingParser.executed) == 2
+    assert CountingParser.loaded == [str(tmp_path / "alpha" / "nav.yml")]
+
+
+def test_memoized_results_are_copies(tmp_path):
+    _service(tmp_path, "alpha")
+    resolver = _resolver(tmp_path)
+    memo = ResolveMemo()
+    resolver.set_memo(memo)
+
+    first, _ = resolver.resolve([{"Alpha": ["%include ./alpha"]}])
+    first[0]["Alpha"] = "changed.md"
+    second, _ = resolver.resolve([{"Alpha": ["%include ./alpha"]}])
+
+    assert second == [{"Alpha": "alpha/index.md"}]
+    assert CountingParser.executed == ["./alpha"]
+
+
+def test_a_new_build_resolves_everything_again(tmp_path):
+    _service(tmp_path, "alpha")
+    _resolver(tmp_path).resolve([{"Alpha": ["%include ./alpha"]}])
+
+    write(tmp_path / "alpha" / "nav.yml", "nav:\n- index.md\n- usage.md\n")
+    nav, _ = _resolver(tmp_path).resolve([{"Alpha": ["%include ./alpha"]}])
+
+    assert nav == [{"Alpha": ["alpha/index.md", "alpha/usage.md"]}]
+    assert CountingParser.executed == ["./alpha"]
+
+
+def test_an_include_cycle_is_an_error(tmp_path):
+    _service(tmp_path, "alpha", nav=("index.md", "%include ./beta"))
+    _service(tmp_path, "beta", nav=("index.md", "%include ./alpha"))
+
+    with pytest.raises(IncludeCycleError) as e:
+        _resolver(tmp_path, resolve_max_depth=0).resolve([{"Alpha": ["%include ./alpha"]}])
+
+    alpha, beta = str(tmp_path / "alpha"), str(tmp_path / "beta")
+    assert str(e.value) == f"Include cycle detected: {alpha} -> {beta} -> {alpha}"
+    assert isinstance(e.value, PluginError)
+
+
+def test_an_include_shared_by_several_others_is_not_a_cycle(tmp_path):
+    _service(tmp_path, "alpha", nav=("index.md", {"Common": ["%include ./common"]}))
+    _service(tmp_path, "beta", nav=("index.md", {"Common": ["%include ./common"]}))
+    _service(tmp_path, "common")
+
+    nav, additional_info = _resolver(tmp_path, resolve_max_depth=0).resolve(
+        [{"Services": ["%include ./alpha", "%include ./beta"]}])
+
+    assert nav == [{"Services": ["services/index.md", {"Common": "common/index.md"},
+                                 "services/index.md", {"Common": "common/index.md"}]}]
+    assert len(additional_info) == 4
+
+
+def test_the_navs_of_includes_deeper_than_the_maximum_depth_are_not_resolved(tmp_path):
+    _service(tmp_path, "alpha", nav=("index.md", {"Beta": ["%include ./beta"]}))
+    _service(tmp_path, "beta", nav=("index.md", {"Gamma": ["%include ./gamma"]}))
+    _service(tmp_path, "gamma")
+    nav = [{"Alpha": ["%include ./alpha"]}]
+
+    assert _resolver(tmp_path, resolve_max_depth=1).resolve(nav)[0] == [
+        {"Alpha": ["alpha/index.md", {"Beta": ["index.md", {"Gamma": ["%include ./gamma"]}]}]}]
+    assert CountingParser.executed == ["./alpha", "./beta"]
+    assert _resolver(tmp_path, resolve_max_depth=0).resolve(nav)[0] == [
+        {"Alpha": ["alpha/index.md", {"Beta": ["beta/index.md", {"Gamma": "gamma/index.md"}]}]}]
+
+
+def test_a_build_with_an_include_cycle_between_remotes_ends_cleanly(site, remotes, caplog):
+    alpha, beta = remotes("alpha"), remotes("beta")
+    alpha_sha = alpha.commit(docs_files("alpha", nav=["index.md", {"Beta": [include(beta, "beta")]}]))
+    beta_sha = beta.commit(docs_files("beta", nav=["index.md", {"Alpha": [include(alpha, "alpha")]}]))
+    site.configure([{"Alpha": [include(alpha, "alpha")]}], resolve_max_depth=0)
+
+    with pytest.raises(Abort):
+        site.build()
+
+    cycle = [f"{remote.url}@{sha[:8]}:docs/{name}/nav.yml" for remote, sha, name in (
+        (alpha, alpha_sha, "alpha"), (beta, beta_sha, "beta"), (alpha, alpha_sha, "alpha"))]
+    assert f"Include cycle detected: {' -> '.join(cycle)}" in caplog.text
+    assert "Traceback" not in caplog.text
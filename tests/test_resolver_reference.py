@@ -0,0 +1,76 @@
+import random
+from copy import deepcopy
+
+import pytest
+
+from reference_resolver import ReferenceResolver
+
+from mkdocs_ultirepo_plugin.resolver import Resolver
+
+PAGES = ["index.md", "usage.md", "guide/setup.md", "guide/deep/api.md", "./local.md", "a//b.md", "/absolute.md",
+         "trailing/", "section/index.md", "other-section/page.md", "https://example.com/"]
+KEYS = ["Section", "Other Section", "Guide", "API Reference", "section", "Deep"]
+
+
+class MemoryParser:
+    """
+    Include the navs of a dictionary instead of the navs of repositories.
+    """
+    navs = {}
+
+    def __init__(self, resolver, parent, string) -> None:
+        self.resolver = resolver
+        self.parent = parent
+        self.string = string
+
+    def execute(self, parsers=None, **kwargs):
+        self.resolver.set_parsers(parsers)
+        resolved_nav, additional_info = self.resolver.resolve(nav=deepcopy(self.navs[self.string]),
+                                                              parent=self.parent)
+        additional_info.append({"include": self.string, "parent": str(self.parent)})
+        return resolved_nav, additional_info
+
+
+def _random_items(rng: random.Random, includes: list, depth: int) -> list:
+    """
+    Generate a non-empty list of nav entries: pages, includes, sections and nested lists.
+    """
+    items = []
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.random()
+        if kind < 0.4 or depth > 3:
+            items.append(rng.choice(PAGES))
+        elif kind < 0.6 and includes:
+            items.append(f"@include {rng.choice(includes)}")
+        elif kind < 0.75:
+            items.append({rng.choice(KEYS): rng.choice(PAGES)})
+        elif kind < 0.95:
+            items.append({rng.choice(KEYS): _random_items(rng, includes, depth + 1)})
+        else:
+            items.append(_random_items(rng, includes, depth + 1))
+    return items
+
+
+def _random_navs(seed: int):
+    """
+    Generate a root nav and the navs it includes. An include only includes the ones after it, so there are no cycles.
+    """
+    rng = random.Random(seed)
+    names = [f"nav{i}" for i in range(rng.randint(1, 6))]
+    navs = {name: _random_items(rng, names[i + 1:], 0) for i, name in enumerate(names)}
+    return _random_items(rng, names, 0), navs
+
+
+def _resolve(resolver, nav):
+    resolver.set_parsers([("@include", MemoryParser)])
+    return resolver.resolve(deepcopy(nav))
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_the_resolver_resolves_like_the_reference(seed):
+    nav, MemoryParser.navs = _random_navs(seed)
+    max_depth = seed % 4 + 1
+
+    expected = _resolve(ReferenceResolver(resolve_max_depth=max_depth), nav)
+
+    assert _resolve(Resolver(resolve_max_depth=max_depth), nav) == expected
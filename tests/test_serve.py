@@ -0,0 +1,85 @@
+import os
+import re
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+# Long enough for the rebuild triggered by a change, and for any rebuild it would trigger in turn
+SETTLE_SECONDS = 6
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write(path, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(textwrap.dedent(content))
+
+
+def _builds(log_path) -> int:
+    with open(log_path) as f:
+        return len(re.findall(r"Building documentation\.\.\.", f.read()))
+
+
+def _wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+@pytest.fixture
+def site(tmp_path):
+    _write(tmp_path / "docs" / "index.md", "# Home\n")
+    _write(tmp_path / "services" / "foo" / "nav.yml", """\
+        nav:
+        - index.md
+        """)
+    _write(tmp_path / "services" / "foo" / "index.md", "# Foo\n")
+    return tmp_path
+
+
+def _config(site, **options) -> None:
+    plugin_options = "".join(f"\n    {name}: {value}" for name, value in options.items())
+    _write(site / "mkdocs.yml", """\
+        site_name: Serve
+        nav:
+        - index.md
+        - Foo:
+            - "%include ./services/foo"
+        plugins:
+        - ultirepo:""" + plugin_options.replace("\n", "\n" + " " * 8) + "\n")
+
+
+@pytest.mark.parametrize("options", [{}, {"docs_destination_dir": "merged"}], ids=["temporary", "persistent"])
+@pytest.mark.parametrize("changed", ["docs/index.md", "services/foo/index.md"], ids=["docs", "include"])
+def test_one_rebuild_per_change(site, options, changed):
+    _config(site, cache_dir=str(site / "cache"), **options)
+    log_path = site / "serve.log"
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "mkdocs", "serve", "--dev-addr", f"127.0.0.1:{_free_port()}"],
+            cwd=site, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        assert _wait_for(lambda: "Serving on" in log_path.read_text(), 60), log_path.read_text()
+        # Nothing changed, the initial build must not trigger another one
+        time.sleep(SETTLE_SECONDS)
+        assert _builds(log_path) == 1, log_path.read_text()
+
+        with open(site / changed, "a") as f:
+            f.write("\nChanged.\n")
+        time.sleep(SETTLE_SECONDS)
+        assert _builds(log_path) == 2, log_path.read_text()
+    finally:
+        server.terminate()
+        server.wait(10)
@@ -0,0 +1,43 @@
+import os
+
+from conftest import docs_files, include, read, write
+
+
+def _pages(site_dir) -> list:
+    return sorted(os.path.relpath(root, site_dir) for root, _, files in os.walk(site_dir) if "index.html" in files)
+
+
+def test_included_files_are_added_without_merging(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], virtual_files=True)
+
+    config = site.build()
+
+    assert config["docs_dir"] == str(site.root / "docs")
+    assert sorted(os.listdir(site.root / "docs")) == ["index.md"]
+    assert config["nav"] == ["index.md", {"Alpha": ["alpha/index.md", "alpha/usage.md"]}]
+    assert _pages(site.root / "site") == [".", "alpha", "alpha/usage"]
+    assert "alpha usage.md" in read(site.root / "site" / "alpha" / "usage" / "index.html")
+
+
+def test_included_files_are_added_from_git_objects(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    site.configure([{"Alpha": [include(remote, "alpha")]}], virtual_files=True, include_source="objects")
+
+    site.build()
+
+    assert sorted(os.listdir(site.root / "docs")) == ["index.md"]
+    assert "alpha usage.md" in read(site.root / "site" / "alpha" / "usage" / "index.html")
+
+
+def test_original_docs_win_over_included_files(site, remotes):
+    remote = remotes("alpha")
+    remote.commit(docs_files("alpha", pages=("index.md", "usage.md")))
+    write(site.root / "docs" / "alpha" / "usage.md", "# Local usage\n")
+    site.configure([{"Alpha": [include(remote, "alpha")]}], virtual_files=True)
+
+    site.build()
+
+    assert "Local usage" in read(site.root / "site" / "alpha" / "usage" / "index.html")
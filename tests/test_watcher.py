@@ -0,0 +1,88 @@
+import os
+
+from watchdog.events import FileModifiedEvent, FileMovedEvent
+
+from conftest import write
+
+from mkdocs_ultirepo_plugin.include_parsers import IncludeParserPercent
+from mkdocs_ultirepo_plugin.resolver import Resolver
+from mkdocs_ultirepo_plugin.watcher import IncludeWatcher
+
+NAV = [{"Services": ["%include ./services/alpha/nav.yml", "%include ./services/beta/nav.yml"]}]
+
+
+class CountingParser(IncludeParserPercent):
+    executed = []
+
+    def execute(self, **kwargs):
+        self.executed.append(self.string)
+        return super().execute(**kwargs)
+
+
+def _site(tmp_path):
+    for name in ("alpha", "beta"):
+        write(tmp_path / "services" / name / "index.md", f"# {name}\n")
+        write(tmp_path / "services" / name / "nav.yml", "nav:\n- index.md\n")
+    return tmp_path
+
+
+def _resolve(site_root, watcher):
+    resolver = Resolver(resolve_max_depth=0)
+    resolver.set_parsers([("%include", CountingParser)])
+    resolver.set_base_dir(str(site_root))
+    resolver.set_include_cache(watcher)
+    CountingParser.executed = []
+    return resolver.resolve(NAV)
+
+
+def test_only_the_include_with_a_changed_file_is_resolved_again(tmp_path):
+    site_root = _site(tmp_path)
+    watcher = IncludeWatcher()
+    nav, _ = _resolve(site_root, watcher)
+    assert CountingParser.executed == ["./services/alpha/nav.yml", "./services/beta/nav.yml"]
+
+    changed = str(site_root / "services" / "alpha" / "index.md")
+    watcher._on_event(FileModifiedEvent(changed))
+    assert watcher.invalidate() == {changed}
+
+    assert _resolve(site_root, watcher)[0] == nav
+    assert CountingParser.executed == ["./services/alpha/nav.yml"]
+
+
+def test_changes_outside_of_the_includes_keep_every_result(tmp_path):
+    site_root = _site(tmp_path)
+    watcher = IncludeWatcher()
+    _resolve(site_root, watcher)
+
+    watcher._on_event(FileModifiedEvent(str(site_root / "services" / "alphabet.md")))
+    watcher.invalidate()
+
+    _resolve(site_root, watcher)
+    assert CountingParser.executed == []
+
+
+def test_a_file_moved_into_an_include_changes_it(tmp_path):
+    site_root = _site(tmp_path)
+    watcher = IncludeWatcher()
+    _resolve(site_root, watcher)
+
+    destination = str(site_root / "services" / "beta" / "usage.md")
+    watcher._on_event(FileMovedEvent(str(site_root / "usage.md"), destination))
+
+    assert destination in watcher.invalidate()
+    _resolve(site_root, watcher)
+    assert CountingParser.executed == ["./services/beta/nav.yml"]
+
+
+def test_results_are_copies(tmp_path):
+    site_root = _site(tmp_path)
+    watcher = IncludeWatcher()
+    _resolve(site_root, watcher)
+    key, = [key for key in watcher.results if "alpha" in key[0]]
+
+    resolved_nav, additional_info = watcher.get(key)
+    resolved_nav.append("changed.md")
+    additional_info.clear()
+
+    assert watcher.get(key)[0] != resolved_nav
+    assert watcher.get(key)[1] and os.path.isdir(watcher.get(key)[1][0]["orig_docs_dir"])